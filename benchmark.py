@@ -0,0 +1,581 @@
+"""Benchmarks for skiplist.py and multiset.py.
+
+Every operation is timed on SkipList, MultiSet and, as baselines, on a sorted
+list kept with bisect and on a collections.Counter, for sizes from 10**3 to
+10**6 and for sequential, random and Zipf-duplicated keys. The report gives
+operations per second, peak memory of a build, and the exponent b of the
+fitted scaling law time(n) ~ n ** b for n operations on n elements, so b close
+to 1 means O(1) or O(log n) per operation.
+
+With --threads, a stress test runs instead: several threads share one
+MultiSet, mostly reading and sometimes writing, once with concurrent=True and
+once with every call behind a single global lock. The contents are checked at
+the end and the throughput of both is reported for every number of threads.
+
+With --cores, a ShardedMultiSet is built, queried and combined in this
+process and then on a ShardPool of every given number of worker processes
+instead, and the speedup of every operation over this process is reported.
+
+Run "python benchmark.py --help" for the options. With --json, the results
+are also written as JSON so two commits can be compared.
+"""
+
+import argparse
+import bisect
+import json
+import math
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from skiplist import SkipList
+from multiset import MultiSet
+from sharded import ShardedMultiSet, ShardPool
+
+try:
+    import numpy
+except ImportError:  # The numeric MultiSet is left out.
+    numpy = None
+
+
+SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+DISTRIBUTIONS = ('sequential', 'random', 'zipf')
+IMPLEMENTATIONS = ('skiplist', 'multiset', 'bisect', 'counter') + (
+    ('numeric',) if numpy else ())
+
+
+def make_keys(dist, n, rng):
+    """(str, int, random.Random) -> list of int
+    Return n keys drawn from the distribution dist.
+    """
+
+    if dist == 'sequential':
+        return list(range(n))
+
+    if dist == 'random':
+        return [rng.randrange(10 * n) for i in range(n)]
+
+    # Zipf with exponent 1.1 over n // 10 distinct keys: a few keys take
+    # most of the occurrences.
+    distinct = max(n // 10, 1)
+    weights = [1 / (k + 1) ** 1.1 for k in range(distinct)]
+    keys = list(range(distinct))
+    rng.shuffle(keys)
+    return rng.choices(keys, weights, k=n)
+
+
+class _Bisect(object):
+    """A sorted list kept with the bisect module."""
+
+    def __init__(self, keys=()):
+        """(_Bisect, iterable) -> NoneType
+        Make a sorted list of keys.
+        """
+
+        self.data = sorted(keys)
+
+    def insert(self, key):
+        """(_Bisect, object) -> NoneType
+        Insert key after any equal keys.
+        """
+
+        bisect.insort(self.data, key)
+
+    def remove(self, key):
+        """(_Bisect, object) -> NoneType
+        Remove one occurrence of key, if there is one.
+        """
+
+        i = bisect.bisect_left(self.data, key)
+        if i < len(self.data) and self.data[i] == key:
+            del self.data[i]
+
+    def __contains__(self, key):
+        """(_Bisect, object) -> bool
+        Return True if key is in this list.
+        """
+
+        i = bisect.bisect_left(self.data, key)
+        return i < len(self.data) and self.data[i] == key
+
+    def __getitem__(self, i):
+        """(_Bisect, int or slice) -> object or list
+        Return the key at index i, or the list of keys in slice i.
+        """
+
+        return self.data[i]
+
+    def count(self, key):
+        """(_Bisect, object) -> int
+        Return the number of occurrences of key.
+        """
+
+        return (bisect.bisect_right(self.data, key) -
+                bisect.bisect_left(self.data, key))
+
+    def copy(self):
+        """(_Bisect) -> _Bisect
+        Return a copy of this list.
+        """
+
+        new = _Bisect()
+        new.data = self.data[:]
+        return new
+
+
+class _Counter(Counter):
+    """A Counter with the method names of MultiSet."""
+
+    def insert(self, key):
+        """(_Counter, object) -> NoneType
+        Add one occurrence of key.
+        """
+
+        self[key] += 1
+
+    def remove(self, key):
+        """(_Counter, object) -> NoneType
+        Remove one occurrence of key, if there is one.
+        """
+
+        if self[key] > 1:
+            self[key] -= 1
+        else:
+            self.pop(key, None)
+
+    def count(self, key):
+        """(_Counter, object) -> int
+        Return the number of occurrences of key.
+        """
+
+        return self[key]
+
+    def copy(self):
+        """(_Counter) -> _Counter
+        Return a copy of this Counter.
+        """
+
+        return _Counter(self)
+
+    __add__ = Counter.__or__  # MultiSet's + keeps the larger count.
+
+
+def build(impl, keys, bulk=False, seed=0):
+    """(str, list, bool, int) -> object
+    Return a new container of kind impl holding keys, bulk-loaded if bulk
+    is True or inserted one at a time otherwise. Skip list levels are drawn
+    from a generator seeded with seed, so the layout is reproducible.
+    """
+
+    if impl == 'bisect':
+        return _Bisect(keys)
+
+    if impl == 'counter':
+        return _Counter(keys)
+
+    if bulk:
+        if impl == 'skiplist':
+            return SkipList.from_sorted(sorted(keys), rng=seed)
+        if impl == 'numeric':
+            return MultiSet.from_iterable(keys, dtype='int64')
+        return MultiSet.from_iterable(keys, rng=seed)
+
+    if impl == 'skiplist':
+        new = SkipList(rng=seed)
+    elif impl == 'numeric':
+        new = MultiSet(dtype='int64')
+    else:
+        new = MultiSet(rng=seed)
+    for key in keys:
+        new.insert(key)
+    return new
+
+
+def operations(impl, keys, other, probes, indexes):
+    """(str, list, list, list, list) -> list of (str, function, int)
+    Return (name, run, ops) for every operation to time on impl, where run
+    takes a freshly built container and performs ops operations.
+    """
+
+    n = len(keys)
+
+    def insert(c):
+        fresh = build(impl, [])
+        for key in keys:
+            fresh.insert(key)
+
+    def search(c):
+        for key in probes:
+            key in c
+
+    def getitem(c):
+        for i in indexes:
+            c[i]
+
+    def remove(c):
+        for key in keys[::2]:
+            c.remove(key)
+
+    def count(c):
+        for key in probes:
+            c.count(key)
+
+    def copy(c):
+        c.copy()
+
+    ops = [('insert', insert, n), ('search', search, len(probes)),
+           ('remove', remove, len(keys[::2])), ('count', count, len(probes)),
+           ('copy', copy, n)]
+
+    if impl != 'counter':
+        ops.append(('getitem', getitem, len(indexes)))
+
+    if impl in ('multiset', 'counter', 'numeric'):
+        right = build(impl, other, True)
+        ops.append(('union', lambda c: c + right, n + len(other)))
+        ops.append(('difference', lambda c: c - right, n + len(other)))
+        ops.append(('intersection', lambda c: c & right, n + len(other)))
+
+    return ops
+
+
+class _GlobalLock(object):
+    """A MultiSet behind one lock taken by every call, readers included."""
+
+    def __init__(self, multiset):
+        """(_GlobalLock, MultiSet) -> NoneType
+        Put multiset behind a new lock.
+        """
+
+        self.multiset = multiset
+        self.lock = threading.Lock()
+
+    def insert(self, key):
+        """(_GlobalLock, object) -> NoneType
+        Insert key into the MultiSet under the lock.
+        """
+
+        with self.lock:
+            self.multiset.insert(key)
+
+    def remove(self, key):
+        """(_GlobalLock, object) -> NoneType
+        Remove one occurrence of key from the MultiSet under the lock.
+        """
+
+        with self.lock:
+            self.multiset.remove(key)
+
+    def __contains__(self, key):
+        """(_GlobalLock, object) -> bool
+        Return whether key is in the MultiSet, under the lock.
+        """
+
+        with self.lock:
+            return key in self.multiset
+
+    def __getitem__(self, i):
+        """(_GlobalLock, int) -> object
+        Return the element at index i of the MultiSet, under the lock.
+        """
+
+        with self.lock:
+            return self.multiset[i]
+
+    def count(self, key):
+        """(_GlobalLock, object) -> int
+        Return the number of occurrences of key, under the lock.
+        """
+
+        with self.lock:
+            return self.multiset.count(key)
+
+
+def stress(n, threads, ops, seed=0, write_ratio=0.1):
+    """(int, int, int, int, float) -> list of dict
+    Run ops operations in every one of threads threads sharing a MultiSet
+    of n keys, a write_ratio of them writes, with concurrent=True and then
+    behind a global lock. Return one record per variant, with the total
+    throughput. Raise AssertionError if the final contents are wrong.
+    """
+
+    keys = make_keys('random', n, random.Random(seed))
+    results = []
+    for variant in ('concurrent', 'global-lock'):
+        if variant == 'concurrent':
+            shared = MultiSet.from_iterable(keys, rng=seed, concurrent=True)
+        else:
+            shared = _GlobalLock(MultiSet.from_iterable(keys, rng=seed))
+        added = [[] for t in range(threads)]
+
+        def work(t):
+            # Every thread writes keys of its own above the initial ones, and
+            # removes only those, so at least n keys are always there.
+            rng = random.Random(seed + t + 1)
+            mine = added[t]
+            for i in range(ops):
+                r = rng.random()
+                if r < write_ratio / 2:
+                    key = 10 * n + threads * i + t
+                    shared.insert(key)
+                    mine.append(key)
+                elif r < write_ratio:
+                    if mine:
+                        shared.remove(mine.pop(rng.randrange(len(mine))))
+                elif r < 0.5:
+                    rng.choice(keys) in shared
+                elif r < 0.75:
+                    shared.count(rng.choice(keys))
+                else:
+                    shared[rng.randrange(n)]
+
+        workers = [threading.Thread(target=work, args=(t,))
+                   for t in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        multiset = shared if variant == 'concurrent' else shared.multiset
+        expected = sorted(keys + [key for mine in added for key in mine])
+        assert list(multiset[:]) == expected, variant + ' lost writes'
+        assert len(multiset) == len(expected)
+
+        results.append({'variant': variant, 'threads': threads, 'n': n,
+                        'ops': ops * threads, 'seconds': elapsed,
+                        'ops_per_sec': ops * threads / elapsed})
+        print('{0:12} {1:>3} threads {2:>8} {3:>14,.0f} ops/s'.format(
+            variant, threads, n, results[-1]['ops_per_sec']))
+    return results
+
+
+def scale(n, cores, seed=0):
+    """(int, list of int, int) -> list of dict
+    Time the bulk build, count_many, count_ranges and union of a
+    ShardedMultiSet of n random keys, first with its shards in this process,
+    then with one shard per worker on a ShardPool of every number of workers
+    of cores. Return one record per number of workers (0 for this process)
+    and operation, with the speedup over this process.
+    """
+
+    rng = random.Random(seed)
+    keys = make_keys('random', n, rng)
+    other = make_keys('random', n, rng)
+    probes = [rng.randrange(10 * n) for i in range(n)]
+    ranges = [tuple(sorted((rng.randrange(10 * n), rng.randrange(10 * n))))
+              for i in range(n // 10)]
+    expected = None
+    base = {}
+    results = []
+    for workers in [0] + list(cores):
+        # The in-process baseline uses as many shards as the first pool.
+        pool = ShardPool(workers) if workers else None
+        shards = workers or (cores[0] if cores else 1)
+        try:
+            times = {}
+            start = time.perf_counter()
+            sharded = ShardedMultiSet.from_iterable(
+                keys, shards, pool, rng=seed)
+            times['build'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            counts = sharded.count_many(probes)
+            times['count_many'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sharded.count_ranges(ranges)
+            times['count_ranges'] = time.perf_counter() - start
+
+            second = ShardedMultiSet.from_iterable(
+                other, shards, pool, rng=seed)
+            start = time.perf_counter()
+            union = sharded + second
+            times['union'] = time.perf_counter() - start
+            size = len(union)
+            del sharded, second, union
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if expected is None:
+            expected = counts, size
+        assert (counts, size) == expected, 'results differ'
+
+        for op, seconds in sorted(times.items()):
+            base.setdefault(op, seconds)
+            results.append({'workers': workers, 'n': n, 'op': op,
+                            'seconds': seconds,
+                            'speedup': base[op] / seconds})
+            print('{0:>3} workers {1:>8} {2:13} {3:8.3f}s {4:6.2f}x'.format(
+                workers, n, op, seconds, results[-1]['speedup']))
+    return results
+
+
+def peak_memory(impl, keys):
+    """(str, list) -> int
+    Return the peak number of bytes allocated while bulk-building impl from
+    keys.
+    """
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    container = build(impl, keys, True)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del container
+    return peak
+
+
+def run(sizes, dists, impls, seed, repeat):
+    """(list of int, list of str, list of str, int, int) -> list of dict
+    Time every operation and return one record per (impl, dist, n, op).
+    """
+
+    results = []
+    for dist in dists:
+        for n in sizes:
+            rng = random.Random(seed)
+            keys = make_keys(dist, n, rng)
+            other = make_keys(dist, n, rng)
+            probes = rng.sample(keys, min(n, 1000)) + rng.sample(other,
+                                                                 min(n, 1000))
+            indexes = [rng.randrange(n) for i in range(min(n, 2000))]
+
+            for impl in impls:
+                memory = peak_memory(impl, keys)
+                for name, op, count in operations(impl, keys, other, probes,
+                                                  indexes):
+                    best = None
+                    for i in range(repeat):
+                        container = build(impl, keys, True, seed)
+                        start = time.perf_counter()
+                        op(container)
+                        elapsed = time.perf_counter() - start
+                        best = elapsed if best is None else min(best, elapsed)
+
+                    results.append({'impl': impl, 'dist': dist, 'n': n,
+                                    'op': name, 'ops': count,
+                                    'seconds': best,
+                                    'ops_per_sec': count / best if best
+                                    else float('inf'),
+                                    'peak_bytes': memory})
+                    print('{0:9} {1:10} {2:>8} {3:13} {4:>14,.0f} ops/s'
+                          .format(impl, dist, n, name,
+                                  results[-1]['ops_per_sec']))
+    return results
+
+
+def fit_exponents(results):
+    """(list of dict) -> list of dict
+    Return the least-squares slope of log(time / ops * n) against log(n) for
+    every (impl, dist, op), that is the exponent b of time(n) ~ n ** b for n
+    operations on n elements.
+    """
+
+    groups = {}
+    for r in results:
+        if r['seconds'] > 0:
+            key = (r['impl'], r['dist'], r['op'])
+            groups.setdefault(key, []).append(
+                (math.log(r['n']), math.log(r['seconds'] / r['ops'] * r['n'])))
+
+    fits = []
+    for (impl, dist, op), points in sorted(groups.items()):
+        if len(points) < 2:
+            continue
+        mx = sum(x for x, y in points) / len(points)
+        my = sum(y for x, y in points) / len(points)
+        sxx = sum((x - mx) ** 2 for x, y in points)
+        sxy = sum((x - mx) * (y - my) for x, y in points)
+        fits.append({'impl': impl, 'dist': dist, 'op': op,
+                     'exponent': sxy / sxx})
+    return fits
+
+
+def _commit():
+    """(NoneType) -> str or NoneType
+    Return the git commit of the working tree, if there is one.
+    """
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _write_report(path, seed, results, **extra):
+    """(str, int, list of dict, object) -> NoneType
+    Write results as JSON to path, with the commit, the Python version, the
+    seed and any extra fields.
+    """
+
+    report = {'commit': _commit(), 'python': platform.python_version(),
+              'seed': seed}
+    report.update(extra)
+    report['results'] = results
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def main(argv=None):
+    """(list of str) -> NoneType
+    Run the benchmarks from the command line.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--dists', nargs='+', default=DISTRIBUTIONS,
+                        choices=DISTRIBUTIONS)
+    parser.add_argument('--impls', nargs='+', default=IMPLEMENTATIONS,
+                        choices=IMPLEMENTATIONS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='keep the best of this many runs')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also write the results to PATH')
+    parser.add_argument('--threads', type=int, nargs='+', metavar='N',
+                        help='run the threaded stress test with N threads')
+    parser.add_argument('--ops', type=int, default=20000,
+                        help='operations per thread in the stress test')
+    parser.add_argument('--cores', type=int, nargs='+', metavar='N',
+                        help='run the sharded benchmark with N processes')
+    args = parser.parse_args(argv)
+
+    if args.cores:
+        results = []
+        for n in args.sizes:
+            results += scale(n, args.cores, args.seed)
+        if args.json:
+            _write_report(args.json, args.seed, results)
+        return
+
+    if args.threads:
+        results = []
+        for n in args.sizes:
+            for threads in args.threads:
+                results += stress(n, threads, args.ops, args.seed)
+        if args.json:
+            _write_report(args.json, args.seed, results)
+        return
+
+    results = run(args.sizes, args.dists, args.impls, args.seed, args.repeat)
+    fits = fit_exponents(results)
+    for f in fits:
+        print('{0:9} {1:10} {2:13} n ** {3:.2f}'.format(
+            f['impl'], f['dist'], f['op'], f['exponent']))
+
+    if args.json:
+        _write_report(args.json, args.seed, results, 
+                      sizes=list(args.sizes), fits=fits)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,22 +6,166 @@ Original Author: Francois Pitt, February 2013.
 """
 
 ##from official_skiplist import SkipList
-from skiplist import SkipList 
+import asyncio
+import heapq
+import os
+import tempfile
+from itertools import chain, groupby, islice, repeat
+from operator import add, itemgetter
+
+from skiplist import CountedSkipList
 from skiplist import TailNode
 from skiplist import HeadNode
+from skiplist import group_runs, keyed_runs
+import serialize
+
+
+CHUNK = 1024  # The most distinct elements an async operation handles before
+              # it lets other tasks run.
 
 
 class MultiSet(object):
     """A multiset is like a set where the number of repetitions of elements
     matters. This implementation uses SkipLists so it is limited to store
-    elements that can be compared with each other.
+    elements that can be compared with each other. Every distinct element is
+    stored once in the SkipList together with its number of occurrences.
+
+    A MultiSet made with a NumPy dtype is a NumericMultiSet instead, which
+    keeps numbers in sorted NumPy arrays (see numeric.py).
     """
+
+    def __new__(cls, p=0.5, max_level=None, rng=None, key=None, 
+                concurrent=False, dtype=None, compact_ratio=None, 
+                memory_budget=None, budget_action='raise'):
+        """(type, float, int, random.Random or int, function, bool, object,
+        float, int, str) -> MultiSet
+        Return a new MultiSet, or a new NumericMultiSet if dtype is given.
+        """
+        if dtype is not None and cls is MultiSet:
+            # NumPy is only needed by the MultiSets that use it.
+            from numeric import NumericMultiSet
+            cls = NumericMultiSet
+        return object.__new__(cls)
     
-    def __init__(self):
-        """(MultiSet) -> NoneType
-        Initialize this MultiSet to be empty.
+    def __init__(self, p=0.5, max_level=None, rng=None, key=None, 
+                 concurrent=False, dtype=None, compact_ratio=None, 
+                 memory_budget=None, budget_action='raise'):
+        """(MultiSet, float, int, random.Random or int, function, bool, 
+        object, float, int, str) -> NoneType
+        Initialize this MultiSet to be empty. The arguments choose how the
+        SkipList draws its levels and orders its elements (see SkipList).
+        Elements with equal keys count as occurrences of the same element,
+        which is the first of them to be inserted.
+
+        If concurrent is True, the MultiSet can be shared between threads.
+        Every method is then safe to call, but only the ones that change or
+        search the SkipList once are atomic: iterating, comparing and the set
+        operations see the writes made meanwhile by other threads or not, and
+        the in-place operators may lose them.
+
+        If compact_ratio is given, removing the last occurrence of an element
+        leaves a dead node behind, which is cheap to bring back, and the dead
+        nodes are dropped in one pass once there are more than compact_ratio
+        of them per occurrence (see compact).
+
+        If memory_budget is given, an insert that would take the SkipList
+        over memory_budget bytes raises MemoryError, or only warns if
+        budget_action is 'warn' (see memory_usage).
+
+        The dtype is only used by NumericMultiSet.
+        """
+        self.skiplist = CountedSkipList(p, max_level, rng, key, concurrent,
+                                        compact_ratio, memory_budget, 
+                                        budget_action)
+
+    @classmethod
+    def from_iterable(cls, items, is_sorted=False, balanced=False, 
+                      **options):
+        """(type, iterable, bool, bool) -> MultiSet
+        Return a new MultiSet holding every element of items. The elements 
+        are sorted once unless is_sorted is True, then the SkipList is built
+        in a single pass (see SkipList.from_sorted). Any options are passed
+        on to the MultiSet constructor.
+        """
+        new_set = cls(**options)
+        new_set._load(items, is_sorted, balanced)
+        return new_set
+
+    @classmethod
+    def from_stream(cls, items, budget=1 << 20, directory=None, 
+                    balanced=False, **options):
+        """(type, iterable, int, str, bool) -> MultiSet
+        Return a new MultiSet holding every element of items, which may be
+        too many to sort in memory. At most budget elements are held at once:
+        every batch of them is sorted and spilled to a temporary file in
+        directory (the default temporary directory if None), then the files
+        are merged and the SkipList is built in a single pass from the merged
+        runs. Any options are passed on to the MultiSet constructor.
         """
-        self.skiplist = SkipList()
+        if budget < 1:
+            raise ValueError("budget must be positive")
+
+        new_set = cls(**options)
+        key = options.get('key')
+        items = iter(items)
+        paths = []
+        spilled = []
+        try:
+            while True:
+                batch = sorted(islice(items, budget), key=key)
+                if not paths and len(batch) < budget:
+                    # Everything fits in one batch: no need for the disk.
+                    new_set._load(batch, True, balanced)
+                    return new_set
+                if not batch:
+                    break
+                paths.append(_spill(batch, key, directory))
+                del batch
+
+            spilled = [serialize.MappedMultiSet(path, key) for path in paths]
+            runs = merge_many([keyed_runs(part.runs(), key) 
+                               for part in spilled], add)
+            new_set._load_runs(((e, count) for k, e, count in runs), 
+                               balanced)
+            return new_set
+
+        finally:
+            for part in spilled:
+                part.close()
+            for path in paths:
+                os.remove(path)
+
+    @staticmethod
+    def merge(*sets):
+        """(MultiSet, ...) -> generator
+        Yield every element of the union of sets in sorted order, as many
+        times as in the set that has the most of it, without building the
+        union. All of sets must order their elements by the same key.
+        """
+        # Efficiency: O(n log k) for n distinct elements in k sets.
+        runs = merge_many([s._keyed_runs() for s in sets], max)
+        for k, e, count in runs:
+            for i in range(count):
+                yield e
+
+    def _load(self, items, is_sorted, balanced):
+        """(MultiSet, iterable, bool, bool) -> NoneType
+        Replace the SkipList of this new MultiSet with one bulk-built from
+        items (see from_iterable).
+        """
+        options = self.skiplist._options()
+        if not is_sorted:
+            items = sorted(items, key=options['key'])
+        self.skiplist = CountedSkipList.from_sorted(items, balanced, 
+                                                    **options)
+
+    def _load_runs(self, runs, balanced):
+        """(MultiSet, iterable of (object, int), bool) -> NoneType
+        Replace the SkipList of this new MultiSet with one bulk-built from
+        sorted (element, count) pairs.
+        """
+        self.skiplist = CountedSkipList.from_runs(
+            runs, balanced, **self.skiplist._options())
     
     def __repr__(self):
 
@@ -35,7 +179,7 @@ class MultiSet(object):
             
         for e in head:
             if type(e) != TailNode:
-                r += str(e.data) + ", "
+                r += (str(e.value) + ", ") * e.count
             
         return "MultiSet([" + r[:-2] + "])"
     
@@ -43,17 +187,31 @@ class MultiSet(object):
         """(MultiSet, object) -> NoneType
         Add one occurrence of element elem to this MultiSet.
         """
-        # Call insert function form skiplist
+        # Call insert function form skiplist, which only adds one to the
+        # count of elem if it is already there.
         self.skiplist.insert(elem)
     
+    def insert_many(self, elems):
+        """(MultiSet, iterable) -> NoneType
+        Add one occurrence of every element of elems to this MultiSet.
+        """
+        # The batch is sorted once and applied in a single forward sweep.
+        self.skiplist.insert_many(elems)
+    
     def remove(self, elem):
         """(MultiSet, object) -> NoneType
         Remove one occurrence of element elem from this MultiSet.
         """
-        # Efficiency: O(n)
+        # Efficiency: O(log(n))
         # Call remove function from skiplist
         self.skiplist.remove(elem)
     
+    def remove_many(self, elems):
+        """(MultiSet, iterable) -> NoneType
+        Remove one occurrence of every element of elems from this MultiSet.
+        """
+        self.skiplist.remove_many(elems)
+    
     def clear(self):
         """(MultiSet) -> NoneType
         Remove all elements from this MultiSet.
@@ -61,8 +219,14 @@ class MultiSet(object):
         # No need to actually "remove" anything: unused memory will be
         # reclaimed automatically.
         
-        self.skiplist = SkipList()
+        self._replace(CountedSkipList(**self.skiplist._options()))
     
+    def compact(self):
+        """(MultiSet) -> NoneType
+        Drop the dead nodes left by removals when compact_ratio is given.
+        """
+        self.skiplist.compact()
+
     def __contains__(self, elem):
         """(MultiSet, object) -> bool
         Return True iff element elem belongs to this MultiSet.
@@ -72,6 +236,51 @@ class MultiSet(object):
         
         return elem in self.skiplist
     
+    def contains_many(self, elems):
+        """(MultiSet, iterable) -> list of bool
+        Return whether every element of elems belongs to this MultiSet, in
+        the order of elems.
+        """
+        # The elements are sorted once and answered in a single forward sweep.
+        return self.skiplist.contains_many(elems)
+
+    def count_many(self, elems):
+        """(MultiSet, iterable) -> list of int
+        Return the number of occurrences of every element of elems in this
+        MultiSet, in the order of elems.
+        """
+        return self.skiplist.count_many(elems)
+    
+    def min(self):
+        """(MultiSet) -> object
+        Return the smallest element of this MultiSet. Raise ValueError if it
+        is empty.
+        """
+        return self.skiplist.min()
+
+    def max(self):
+        """(MultiSet) -> object
+        Return the largest element of this MultiSet. Raise ValueError if it
+        is empty.
+        """
+        # Efficiency: O(1), the last node of every level is kept.
+        return self.skiplist.max()
+
+    def pop_min(self):
+        """(MultiSet) -> object
+        Remove and return one occurrence of the smallest element. Raise 
+        IndexError if this MultiSet is empty.
+        """
+        return self.skiplist.pop_min()
+
+    def pop_max(self):
+        """(MultiSet) -> object
+        Remove and return one occurrence of the largest element. Raise 
+        IndexError if this MultiSet is empty.
+        """
+        # Efficiency: O(log(n)), only the last tower is searched for.
+        return self.skiplist.pop_max()
+    
     def __len__(self):
         """(MultiSet) -> int
         Return the number of elements in this MultiSet.
@@ -94,26 +303,197 @@ class MultiSet(object):
         Return the number of occurrences of element elem in this MultiSet.
         """
         
-        temp = self.travel_down()
-        count = 0
-        #if e is equal to elem, then count plus 1
-        for e in temp:
-            if type(e) != TailNode and e.data == elem:
-                count += 1
+        # Efficiency: O(log(n)), elem has a single node holding its count.
+        return self.skiplist.count(elem)
+
+    def __getitem__(self, index):
+        """(MultiSet, int or slice) -> object or generator
+        Return the element at index in the sorted order of this MultiSet,
+        where every occurrence has its own index. A slice gives a generator.
+        """
+        # Efficiency: O(log(n)) to reach the first element
+        return self.skiplist[index]
+
+    def select(self, index):
+        """(MultiSet, int) -> object
+        Return the element at index in the sorted order of this MultiSet.
+        Raise IndexError if there is no such index.
+        """
+        return self.skiplist.select(index)
 
-        return count
+    def rank(self, elem):
+        """(MultiSet, object) -> int
+        Return the number of occurrences of elements less than elem.
+        """
+        return self.skiplist.rank(elem)
+
+    def bisect_left(self, elem):
+        """(MultiSet, object) -> int
+        Return the index of the first occurrence of elem in the sorted order,
+        or where it would go if elem is not in this MultiSet.
+        """
+        return self.skiplist.bisect_left(elem)
+
+    def bisect_right(self, elem):
+        """(MultiSet, object) -> int
+        Return the index right after the last occurrence of elem in the sorted
+        order, or where it would go if elem is not in this MultiSet.
+        """
+        return self.skiplist.bisect_right(elem)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        """(MultiSet, object, object, (bool, bool)) -> generator
+        Yield every occurrence of the elements from lo to hi in sorted order.
+        A bound of None is unlimited, and inclusive tells whether lo and hi
+        themselves are included.
+        """
+        return self.skiplist.irange(lo, hi, inclusive)
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(MultiSet, object, object, (bool, bool)) -> int
+        Return the number of occurrences of the elements from lo to hi.
+        """
+        # Efficiency: O(log(n)), two searches on the skip values
+        return self.skiplist.count_range(lo, hi, inclusive)
+
+    def delete_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(MultiSet, object, object, (bool, bool)) -> int
+        Remove every occurrence of the elements from lo to hi, and return how
+        many were removed.
+        """
+        return self.skiplist.delete_range(lo, hi, inclusive)
+
+    def _replace(self, skiplist):
+        """(MultiSet, CountedSkipList) -> NoneType
+        Make skiplist the new storage of this MultiSet, keeping the stats
+        going if they are enabled.
+        """
+        if self.skiplist.frozen:
+            raise TypeError("MultiSet snapshot is read-only")
+
+        stats = self.skiplist.stats
+        self.skiplist = skiplist
+        if stats is not None:
+            skiplist.enable_stats(stats)
+
+    @property
+    def stats(self):
+        """(MultiSet) -> SkipStats or NoneType
+        Return the stats of this MultiSet, or None if they are not enabled.
+        """
+        return self.skiplist.stats
+
+    def enable_stats(self):
+        """(MultiSet) -> SkipStats
+        Start counting the work done by this MultiSet (see 
+        SkipList.enable_stats). Return the SkipStats used.
+        """
+        return self.skiplist.enable_stats()
+
+    def disable_stats(self):
+        """(MultiSet) -> SkipStats
+        Stop counting, and return the SkipStats counted so far, if any.
+        """
+        return self.skiplist.disable_stats()
+
+    def memory_usage(self, deep=False):
+        """(MultiSet, bool) -> dict
+        Return the bytes taken by the SkipList of this MultiSet, broken down
+        as in SkipList.memory_usage.
+        """
+        return self.skiplist.memory_usage(deep)
+
+    def runs(self):
+        """(MultiSet) -> generator of (object, int)
+        Yield every distinct element of this MultiSet in sorted order together
+        with its number of occurrences.
+        """
+        for e in self.travel_down():
+            if type(e) != TailNode and e.count:
+                yield e.value, e.count
+
+    def to_bytes(self, runs_only=True):
+        """(MultiSet, bool) -> bytes
+        Return this MultiSet in the binary format of the serialize module,
+        with every distinct element stored once together with its count, or
+        every occurrence stored if runs_only is False.
+        """
+        return serialize.dumps(self.runs(), runs_only)
+
+    @classmethod
+    def from_bytes(cls, data, balanced=False, **options):
+        """(type, bytes-like object, bool) -> MultiSet
+        Return a new MultiSet bulk-built from data, as made by to_bytes. Any
+        options are passed on to the MultiSet constructor.
+        """
+        size, values, ends = serialize.parse(data)
+        new_set = cls(**options)
+        new_set._load_runs(serialize.iter_runs(values, ends), balanced)
+        return new_set
+
+    def save(self, path, runs_only=True):
+        """(MultiSet, str, bool) -> NoneType
+        Write this MultiSet to the file at path (see to_bytes).
+        """
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes(runs_only))
+
+    @classmethod
+    def load(cls, path, balanced=False, **options):
+        """(type, str, bool) -> MultiSet
+        Return a new MultiSet bulk-built from the file at path, as written by
+        save. Any options are passed on to the MultiSet constructor.
+        """
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read(), balanced, **options)
+
+    @staticmethod
+    def open(path, key=None):
+        """(str, function) -> MappedMultiSet
+        Return a read-only MultiSet over the file at path, as written by
+        save, which answers queries by binary search on the memory-mapped
+        file instead of loading it.
+        """
+        return serialize.MappedMultiSet(path, key)
+
+    def __reduce__(self):
+        """(MultiSet) -> tuple
+        Pickle this MultiSet as its binary format, which is bulk-loaded when
+        unpickled, instead of as its graph of nodes.
+        """
+        return _from_bytes, (self.to_bytes(), self.skiplist._options())
+
+    def _keyed_runs(self):
+        """(MultiSet) -> generator of (object, object, int)
+        Yield the cached key, the element and its number of occurrences for
+        every distinct element of this MultiSet in sorted order.
+        """
+        return self.skiplist._runs()
+
+    def _build(self, runs):
+        """(MultiSet, iterable of (object, object, int)) -> MultiSet
+        Return a new MultiSet bulk-built from (key, element, count) triples
+        sorted by key, drawing its levels and ordering its elements like this
+        MultiSet.
+        """
+        # The keys are already cached, so they are not computed again.
+        options = self.skiplist._options()
+        new_set = MultiSet(**options)
+        new_set.skiplist = CountedSkipList._from_runs(runs, **options)
+        return new_set
     
     def __eq__(self, other):
         """(MultiSet, MultiSet) -> bool
         Return True iff this MultiSet is equal to other.
         """
-        # Two sets are equal iff they are subsets of each other.
-        # The Efficiency is O(n)
+        # Both bottom levels are sorted, so walk them together once.
+        # The Efficiency is O(n + m)
 
-        head = self.travel_down()
-        head_1 = other.travel_down()
-        
-        return str(head) == str(head_1)
+        for k, e, a, b in merge_runs(self._keyed_runs(), other._keyed_runs()):
+            if a != b:
+                return False
+
+        return True
     
     def __le__(self, other):
         """(MultiSet, MultiSet) -> bool
@@ -122,8 +502,8 @@ class MultiSet(object):
         # Check that the count of each element in self is no larger than the
         # count of the element in other.
         
-        for e in self.skiplist:
-            if self.count(e) > other.count(e):
+        for k, e, a, b in merge_runs(self._keyed_runs(), other._keyed_runs()):
+            if a > b:
                 return False
             
         return True
@@ -132,82 +512,253 @@ class MultiSet(object):
         """(MultiSet, MultiSet) -> MultiSet
         Return the multiset difference between this MultiSet and other.
         """
-        # __isub__ should always be called indirectly through the '-=' operator
-        # but this is acceptable in implementation code.
-        return self.copy().__isub__(other)
+        # Efficiency: O(n + m)
+        return self._build((k, e, a - b) for k, e, a, b in 
+                           merge_runs(self._keyed_runs(), other._keyed_runs())
+                           if a > b)
     
     def __isub__(self, other):
         """(MultiSet, MultiSet) -> MultiSet
         Make this MultiSet equal to self - other, in-place.
         """
-        # Remove every element of other from this MultiSet.
-        temp = other.travel_down()
-
-        for e in temp:
-            if type(e) != TailNode:
-                self.remove(e.data)
+        # The result is built aside, so other may be this MultiSet itself.
+        self._replace((self - other).skiplist)
         return self
     
     def __add__(self, other):
         """(MultiSet, MultiSet) -> MultiSet
         Return the multiset union between this MultiSet and other.
         """
-        # Efficiency: O(n)
-        return self.copy().__iadd__(other)
+        # Every element occurs as many times as in the operand that has more.
+        # Efficiency: O(n + m)
+        return self._build((k, e, max(a, b)) for k, e, a, b in 
+                           merge_runs(self._keyed_runs(), other._keyed_runs()))
     
     def __iadd__(self, other):
         """(MultiSet, MultiSet) -> MultiSet
         Make this MultiSet equal to self + other, in-place.
         """
-        # Add any additional elements in other to self.
-        temp2 = other.copy()
-        temp = self - other
-        
-        for i in temp.travel_down():
-            if type(i) != TailNode:
-                temp2.insert(i.data)
-                
-        self.skiplist = temp2.skiplist
+        self._replace((self + other).skiplist)
         return self
     
     def __and__(self, other):
         """(MultiSet, MultiSet) -> MultiSet
         Return the multiset intersection between this MultiSet and other.
         """
-        #Efficiency: O(n)
-        return self.copy().__iand__(other)
+        #Efficiency: O(n + m)
+        return self._build((k, e, min(a, b)) for k, e, a, b in 
+                           merge_runs(self._keyed_runs(), other._keyed_runs())
+                           if a and b)
     
     def __iand__(self, other):
         """(MultiSet, MultiSet) -> MultiSet
         Make this MultiSet equal to self & other, in-place.
         """
-        # Remove any elements in self that are not also in other.
-        temp = self - other
-        
-        for i in temp.travel_down():
-            if type(i) != TailNode:
-                self.remove(i.data)
-
+        self._replace((self & other).skiplist)
         return self 
     
     def isdisjoint(self, other):
         """(MultiSet, MultiSet) -> bool
         Return True iff this MultiSet has no element in common with other.
         """
-        # if there difference is not equal to self, then false
-        #Efficiency: O(n)
-        return (self - other) == self
+        #Efficiency: O(n + m), stops at the first common element
+        for k, e, a, b in merge_runs(self._keyed_runs(), other._keyed_runs()):
+            if a and b:
+                return False
+
+        return True
     
     def copy(self):
         """(MultiSet) -> MultiSet
         Return a (shallow) copy of this MultiSet.
         """
-        new_set = MultiSet()
-        temp = self.travel_down()
+        # Efficiency: O(1), the copy sees the nodes of this MultiSet until it
+        # first changes itself. Until then its reads are several times slower,
+        # and that first change rebuilds it in O(n) (see SkipList.copy).
+        new_set = MultiSet(**self.skiplist._options())
+        new_set.skiplist = self.skiplist.copy()
+        return new_set
 
-        #put all elements in old skiplist's bottom level into new multiset
-        for e in temp:
-            if type(e) != TailNode:
-                new_set.insert(e.data)
-            
+    def snapshot(self):
+        """(MultiSet) -> MultiSet
+        Return a read-only copy of this MultiSet, which keeps the elements
+        this MultiSet has now while it goes on changing.
+        """
+        # Efficiency: O(1), and every change to this MultiSet afterwards only
+        # keeps the old fields of the O(log(n)) nodes it touches, until the
+        # snapshot is gone. Reads of the snapshot are several times slower.
+        new_set = MultiSet(**self.skiplist._options())
+        new_set.skiplist = self.skiplist.snapshot()
         return new_set
+
+    def _replace_with(self, other):
+        """(MultiSet, MultiSet) -> MultiSet
+        Make the SkipList of other the storage of this MultiSet, and return
+        this MultiSet.
+        """
+        self._replace(other.skiplist)
+        return self
+
+    # The async operations below walk the distinct elements chunk at a time,
+    # and let other tasks of the event loop run between chunks. Changes made
+    # to the operands meanwhile may or may not be seen.
+
+    async def _abuild(self, runs, chunk):
+        """(MultiSet, iterable of (object, object, int), int) -> MultiSet
+        Return a new MultiSet built like _build, from (key, element, count)
+        triples sorted by key, chunk triples at a time. Triples with a count
+        of 0 are left out.
+        """
+        options = self.skiplist._options()
+        loader = CountedSkipList._loader(**options)
+        async for batch in _batches(runs, chunk):
+            loader.extend(run for run in batch if run[2] > 0)
+        new_set = MultiSet(**options)
+        new_set.skiplist = loader.finish()
+        return new_set
+
+    async def acopy(self, chunk=CHUNK):
+        """(MultiSet, int) -> MultiSet
+        Return a copy of this MultiSet with nodes of its own, so unlike with
+        copy, no later change to either has to copy them.
+        """
+        return await self._abuild(self._keyed_runs(), chunk)
+
+    async def aunion(self, other, chunk=CHUNK):
+        """(MultiSet, MultiSet, int) -> MultiSet
+        Return self + other.
+        """
+        return await self._abuild(
+            ((k, e, max(a, b)) for k, e, a, b in 
+             merge_runs(self._keyed_runs(), other._keyed_runs())), chunk)
+
+    async def aintersection(self, other, chunk=CHUNK):
+        """(MultiSet, MultiSet, int) -> MultiSet
+        Return self & other.
+        """
+        return await self._abuild(
+            ((k, e, min(a, b)) for k, e, a, b in 
+             merge_runs(self._keyed_runs(), other._keyed_runs())), chunk)
+
+    async def adifference(self, other, chunk=CHUNK):
+        """(MultiSet, MultiSet, int) -> MultiSet
+        Return self - other.
+        """
+        return await self._abuild(
+            ((k, e, a - b) for k, e, a, b in 
+             merge_runs(self._keyed_runs(), other._keyed_runs())), chunk)
+
+    async def aiadd(self, other, chunk=CHUNK):
+        """(MultiSet, MultiSet, int) -> MultiSet
+        Make this MultiSet equal to self + other, in-place, and return it.
+        """
+        return self._replace_with(await self.aunion(other, chunk))
+
+    async def aiand(self, other, chunk=CHUNK):
+        """(MultiSet, MultiSet, int) -> MultiSet
+        Make this MultiSet equal to self & other, in-place, and return it.
+        """
+        return self._replace_with(await self.aintersection(other, chunk))
+
+    async def aisub(self, other, chunk=CHUNK):
+        """(MultiSet, MultiSet, int) -> MultiSet
+        Make this MultiSet equal to self - other, in-place, and return it.
+        """
+        return self._replace_with(await self.adifference(other, chunk))
+
+    async def arepr(self, chunk=CHUNK):
+        """(MultiSet, int) -> str
+        Return repr(self).
+        """
+        # Every batch is chunk occurrences, however they are spread over the
+        # runs, and is joined before the next one is taken, so the final join
+        # only glues one string per batch.
+        occurrences = chain.from_iterable(repeat(str(e), count) 
+                                          for e, count in self.runs())
+        parts = []
+        async for batch in _batches(occurrences, chunk):
+            parts.append(", ".join(batch))
+        return "MultiSet([" + ", ".join(parts) + "])"
+
+
+def _from_bytes(data, options):
+    """(bytes, dict) -> MultiSet
+    Return the MultiSet pickled by MultiSet.__reduce__.
+    """
+    return MultiSet.from_bytes(data, **options)
+
+
+async def _batches(items, chunk):
+    """(iterable, int) -> async generator of list
+    Yield the items in lists of chunk items, the last one maybe shorter,
+    letting other tasks run before every list but the first.
+    """
+    if chunk < 1:
+        raise ValueError("chunk must be positive")
+    items = iter(items)
+    batch = list(islice(items, chunk))
+    while batch:
+        yield batch
+        if len(batch) < chunk:
+            return
+        await asyncio.sleep(0)
+        batch = list(islice(items, chunk))
+
+
+def merge_many(runs, combine):
+    """(list of iterables of (object, object, int), function) -> generator
+    Walk any number of sequences of (key, element, count) triples sorted by
+    key together, and yield (key, element, count) for every key in any of
+    them, where count is the counts of the key combined pairwise by combine.
+    The element of the first sequence with the key is kept.
+    """
+    # heapq.merge breaks ties by the order of the sequences.
+    merged = heapq.merge(*runs, key=itemgetter(0))
+    for key, group in groupby(merged, itemgetter(0)):
+        key, elem, count = next(group)
+        for other in group:
+            count = combine(count, other[2])
+        yield key, elem, count
+
+
+def _spill(batch, key, directory):
+    """(list, function, str) -> str
+    Write the elements of the sorted list batch to a new temporary file in
+    directory, in the format of the serialize module, and return its path.
+    """
+    runs = group_runs(keyed_runs(((elem, 1) for elem in batch), key))
+    fd, path = tempfile.mkstemp(suffix='.mset', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(serialize.dumps((e, count) for k, e, count in runs))
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def merge_runs(runs1, runs2):
+    """(iterable of (object, object, int), iterable of (object, object, int))
+    -> generator
+    Walk two sequences of (key, element, count) triples sorted by key
+    together, and yield (key, element, count in runs1, count in runs2) for
+    every key in either. The element of runs1 is kept when both have the key.
+    """
+    it1 = iter(runs1)
+    it2 = iter(runs2)
+    a = next(it1, None)
+    b = next(it2, None)
+
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[0], a[1], a[2], 0
+            a = next(it1, None)
+
+        elif a is None or b[0] < a[0]:
+            yield b[0], b[1], 0, b[2]
+            b = next(it2, None)
+
+        else:
+            yield a[0], a[1], a[2], b[2]
+            a = next(it1, None)
+            b = next(it2, None)
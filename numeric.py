@@ -0,0 +1,799 @@
+"""A numeric backend for the Multiset ADT, using NumPy.
+
+MultiSet(dtype=...) makes a NumericMultiSet, which keeps ints or floats of
+one dtype in sorted blocks of NumPy arrays instead of in a SkipList of nodes,
+and has the same methods as MultiSet.
+"""
+
+import sys
+import warnings
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+import numpy as np
+
+from multiset import MultiSet, _batches, _from_bytes
+
+# The bytes memory_usage counts for every block besides its numbers: the
+# header of the array view, its max and their places in the two lists.
+_BLOCK_BYTES = (sys.getsizeof(np.empty(2)[:1]) + sys.getsizeof(np.float64()) +
+                2 * sys.getsizeof([None]) - 2 * sys.getsizeof([]))
+
+class NumericMultiSet(MultiSet):
+    """A MultiSet of numbers of one NumPy dtype. Every occurrence is kept in
+    a list of sorted blocks of load // 2 to 2 * load numbers, each a NumPy
+    array, so a search is a bisect on the last number of every block followed
+    by np.searchsorted in one block, and a change only rewrites one block.
+    A block that grows too long is split, and one that shrinks too short is
+    joined to a neighbour.
+
+    Blocks are never changed in place, so copies share their blocks.
+    """
+
+    load = 1024
+
+    def __init__(self, p=0.5, max_level=None, rng=None, key=None,
+                 concurrent=False, dtype=None, compact_ratio=None,
+                 memory_budget=None, budget_action='raise'):
+        """(NumericMultiSet, float, int, random.Random or int, function,
+        bool, object, float, int, str) -> NoneType
+        Initialize this NumericMultiSet to be empty, holding numbers of the
+        NumPy dtype, float64 by default. The arguments for the SkipList are
+        ignored, and there can be no key and no concurrent use.
+
+        If memory_budget is given, adding numbers that would take the blocks
+        over memory_budget bytes, as counted by memory_usage, raises 
+        MemoryError, or only warns with a RuntimeWarning if budget_action is
+        'warn'.
+        """
+        dtype = np.dtype(dtype)
+        if dtype.kind not in 'iuf':
+            raise ValueError("dtype must be an int or float dtype")
+        if key is not None or concurrent:
+            raise ValueError("a NumericMultiSet takes no key and cannot be "
+                             "concurrent")
+        if budget_action not in ('raise', 'warn'):
+            raise ValueError("budget_action must be 'raise' or 'warn'")
+
+        self.dtype = dtype
+        self.memory_budget = memory_budget
+        self.budget_action = budget_action
+        self.frozen = False
+        self._set_array(np.empty(0, dtype))
+
+    def _set_array(self, array):
+        """(NumericMultiSet, numpy.ndarray) -> NoneType
+        Make the sorted array the contents of this NumericMultiSet.
+        """
+        # The blocks are views of array, which is never changed afterwards,
+        # of load to 2 * load numbers each unless there are fewer in all.
+        if len(array):
+            self._blocks = np.array_split(array, 
+                                          max(1, len(array) // self.load))
+        else:
+            self._blocks = []
+        self._maxes = [block[-1] for block in self._blocks]
+        self._size = len(array)
+        self._starts = None
+
+    def _array(self):
+        """(NumericMultiSet) -> numpy.ndarray
+        Return every occurrence in this NumericMultiSet as one sorted array.
+        """
+        if not self._blocks:
+            return np.empty(0, self.dtype)
+        return np.concatenate(self._blocks)
+
+    def _cast_array(self, values):
+        """(NumericMultiSet, sequence) -> numpy.ndarray
+        Return the numbers values as an array of the dtype of this
+        NumericMultiSet. Raise ValueError if an int would change or a float
+        would be NaN, which has no place in the sorted order.
+        """
+        array = np.asarray(values)
+        cast = array.astype(self.dtype)
+        if (np.isnan(cast).any() if self.dtype.kind == 'f' 
+                else not np.array_equal(cast, array)):
+            raise ValueError("values cannot be stored as %s" % self.dtype)
+        return cast
+
+    def _check_writable(self):
+        """(NumericMultiSet) -> NoneType
+        Raise TypeError if this NumericMultiSet is a snapshot.
+        """
+        if self.frozen:
+            raise TypeError("MultiSet snapshot is read-only")
+
+    def _changed(self, i):
+        """(NumericMultiSet, int) -> NoneType
+        Bring the bookkeeping up to date after block i has been replaced,
+        splitting it if it grew too long or dropping it if it is empty.
+        """
+        block = self._blocks[i]
+        if not len(block):
+            del self._blocks[i]
+            del self._maxes[i]
+
+        elif len(block) > 2 * self.load:
+            # A batch may have grown it many times over, so it is cut into
+            # blocks of load to 2 * load numbers.
+            parts = np.array_split(block, len(block) // self.load)
+            self._blocks[i:i + 1] = parts
+            self._maxes[i:i + 1] = [part[-1] for part in parts]
+
+        else:
+            self._maxes[i] = block[-1]
+
+        self._starts = None
+
+    def _join(self, i):
+        """(NumericMultiSet, int) -> int
+        Join block i to a neighbour if it has fewer than load // 2 numbers,
+        splitting the result again if it is too long. Return the index of the
+        block that now holds the numbers of block i.
+        """
+        if (len(self._blocks) < 2 or i >= len(self._blocks) or
+                len(self._blocks[i]) >= self.load // 2):
+            return i
+
+        # The last block is joined to the one before, any other to the next.
+        i = min(i, len(self._blocks) - 2)
+        block = np.concatenate(self._blocks[i:i + 2])
+        self._blocks[i:i + 2] = [block]
+        self._maxes[i:i + 2] = [block[-1]]
+        self._changed(i)
+        return i
+
+    def _join_small(self):
+        """(NumericMultiSet) -> NoneType
+        Join every block with fewer than load // 2 numbers to a neighbour,
+        after a batch that may have left many of them.
+        """
+        i = 0
+        while i < len(self._blocks):
+            if (len(self._blocks) > 1 and 
+                    len(self._blocks[i]) < self.load // 2):
+                i = self._join(i)
+            else:
+                i += 1
+
+    def _check_budget(self, extra):
+        """(NumericMultiSet, int) -> NoneType
+        Raise MemoryError, or warn if budget_action is 'warn', if adding
+        extra numbers would take this NumericMultiSet over its memory budget.
+        """
+        if self.memory_budget is None:
+            return
+
+        # The numbers are counted exactly, and every new block as one more
+        # array header and max.
+        blocks = len(self._blocks) + -(-extra // self.load)
+        total = ((self._size + extra) * self.dtype.itemsize + 
+                 blocks * _BLOCK_BYTES)
+        if total <= self.memory_budget:
+            return
+
+        message = ("MultiSet memory budget of %d bytes exceeded" % 
+                   self.memory_budget)
+        if self.budget_action == 'raise':
+            raise MemoryError(message)
+        warnings.warn(message, RuntimeWarning)
+
+    def _groups(self, where):
+        """(NumericMultiSet, numpy.ndarray) -> list of (int, int, int)
+        Return (i, lo, hi) for every run where[lo:hi] of the sorted block 
+        indexes where that all equal i, last run first.
+        """
+        if not len(where):
+            return []
+        bounds = (np.flatnonzero(np.diff(where)) + 1).tolist()
+        los = [0] + bounds
+        his = bounds + [len(where)]
+        return [(int(where[lo]), lo, hi) 
+                for lo, hi in zip(reversed(los), reversed(his))]
+
+    def _ranks(self, values, side):
+        """(NumericMultiSet, numpy.ndarray, str) -> numpy.ndarray
+        Return bisect_left (side 'left') or bisect_right (side 'right') of
+        every number of the sorted array values. Every number is routed to 
+        its block by the maxes, and is only searched for in that block.
+        """
+        ranks = np.full(len(values), self._size, np.int64)
+        if not self._blocks:
+            return ranks
+
+        starts = self._block_starts()
+        where = np.searchsorted(self._maxes, values, side)
+        for i, lo, hi in self._groups(where):
+            if i < len(self._blocks):
+                ranks[lo:hi] = starts[i] + self._blocks[i].searchsorted(
+                    values[lo:hi], side)
+        return ranks
+
+    def _block_starts(self):
+        """(NumericMultiSet) -> list of int
+        Return the index of the first occurrence in every block.
+        """
+        if self._starts is None:
+            self._starts = [0] + list(accumulate(len(b)
+                                                 for b in self._blocks))
+        return self._starts
+
+    def _load(self, items, is_sorted, balanced):
+        """(NumericMultiSet, iterable, bool, bool) -> NoneType
+        Make the numbers of items the contents of this new NumericMultiSet.
+        """
+        # A stable sort of sorted input takes linear time anyway.
+        array = self._cast_array(list(items))
+        self._check_budget(len(array))
+        self._set_array(np.sort(array, kind='stable'))
+
+    def _load_runs(self, runs, balanced):
+        """(NumericMultiSet, iterable of (object, int), bool) -> NoneType
+        Make the sorted (number, count) pairs the contents of this new
+        NumericMultiSet.
+        """
+        runs = list(runs)
+        values = self._cast_array([value for value, count in runs])
+        self._check_budget(sum(count for value, count in runs))
+        self._set_array(np.repeat(values, [count for value, count in runs]))
+
+    def __reduce__(self):
+        """(NumericMultiSet) -> tuple
+        Pickle this NumericMultiSet as its binary format.
+        """
+        return _from_bytes, (self.to_bytes(), {'dtype': self.dtype.str})
+
+    def __repr__(self):
+        """(NumericMultiSet) -> str
+        Return a string representation of this NumericMultiSet.
+        """
+        return ("MultiSet([" +
+                ", ".join(str(e) for e in self._array().tolist()) + "])")
+
+    def __len__(self):
+        """(NumericMultiSet) -> int
+        Return the number of elements in this NumericMultiSet.
+        """
+        return self._size
+
+    def insert(self, elem):
+        """(NumericMultiSet, object) -> NoneType
+        Add one occurrence of the number elem to this NumericMultiSet.
+        """
+        self._check_writable()
+        value = self._cast_array([elem])[0]
+        self._check_budget(1)
+
+        if not self._blocks:
+            self._set_array(np.array([value], self.dtype))
+            return
+
+        i = min(bisect_right(self._maxes, value), len(self._blocks) - 1)
+        block = self._blocks[i]
+        self._blocks[i] = np.insert(block,
+                                    np.searchsorted(block, value, 'right'),
+                                    value)
+        self._size += 1
+        self._changed(i)
+
+    def insert_many(self, elems):
+        """(NumericMultiSet, iterable) -> NoneType
+        Add one occurrence of every number of elems to this NumericMultiSet.
+        """
+        # The new numbers are routed to their blocks by the maxes, and only
+        # those blocks are rewritten, each with one vectorized merge. The 
+        # blocks are done from the last, so splitting one leaves the indexes
+        # of those still to do unchanged.
+        self._check_writable()
+        new = np.sort(self._cast_array(list(elems)))
+        if not len(new):
+            return
+        self._check_budget(len(new))
+        if not self._blocks:
+            self._set_array(new)
+            return
+
+        where = np.minimum(np.searchsorted(self._maxes, new, 'right'),
+                           len(self._blocks) - 1)
+        for i, lo, hi in self._groups(where):
+            block = self._blocks[i]
+            part = new[lo:hi]
+            self._blocks[i] = np.insert(block, 
+                                        np.searchsorted(block, part, 'right'),
+                                        part)
+            self._changed(i)
+        self._size += len(new)
+
+    def remove(self, elem):
+        """(NumericMultiSet, object) -> NoneType
+        Remove one occurrence of the number elem from this NumericMultiSet.
+        """
+        self._check_writable()
+        i = bisect_left(self._maxes, elem)
+        if i == len(self._blocks):
+            return
+
+        block = self._blocks[i]
+        j = np.searchsorted(block, elem, 'left')
+        if block[j] == elem:
+            self._blocks[i] = np.delete(block, j)
+            self._size -= 1
+            self._changed(i)
+            self._join(i)
+
+    def remove_many(self, elems):
+        """(NumericMultiSet, iterable) -> NoneType
+        Remove one occurrence of every number of elems from this
+        NumericMultiSet, if it is there.
+        """
+        self._check_writable()
+        values, counts = np.unique(np.asarray(list(elems)),
+                                   return_counts=True)
+        if not len(values):
+            return
+
+        # Remove min(count, occurrences) numbers from the start of the run
+        # of every value, with one np.delete in every block they are in.
+        left = self._ranks(values, 'left')
+        right = self._ranks(values, 'right')
+        taken = np.minimum(counts, right - left)
+        firsts = np.repeat(left, taken)
+        offsets = np.arange(taken.sum()) - np.repeat(np.cumsum(taken) - taken,
+                                                     taken)
+        doomed = firsts + offsets
+        if not len(doomed):
+            return
+
+        starts = self._block_starts()
+        where = np.searchsorted(starts, doomed, 'right') - 1
+        for i, lo, hi in self._groups(where):
+            self._blocks[i] = np.delete(self._blocks[i], 
+                                        doomed[lo:hi] - starts[i])
+            self._changed(i)
+        self._size -= len(doomed)
+        self._join_small()
+
+    def clear(self):
+        """(NumericMultiSet) -> NoneType
+        Remove all elements from this NumericMultiSet.
+        """
+        self._check_writable()
+        self._set_array(np.empty(0, self.dtype))
+
+    def compact(self):
+        """(NumericMultiSet) -> NoneType
+        Do nothing: removals never leave dead numbers in the blocks.
+        """
+
+    def __contains__(self, elem):
+        """(NumericMultiSet, object) -> bool
+        Return True iff the number elem belongs to this NumericMultiSet.
+        """
+        i = bisect_left(self._maxes, elem)
+        if i == len(self._blocks):
+            return False
+
+        block = self._blocks[i]
+        return bool(block[np.searchsorted(block, elem, 'left')] == elem)
+
+    def min(self):
+        """(NumericMultiSet) -> object
+        Return the smallest number of this NumericMultiSet. Raise ValueError
+        if it is empty.
+        """
+        if not self._size:
+            raise ValueError("min() of an empty MultiSet")
+        return self._blocks[0][0].item()
+
+    def max(self):
+        """(NumericMultiSet) -> object
+        Return the largest number of this NumericMultiSet. Raise ValueError
+        if it is empty.
+        """
+        if not self._size:
+            raise ValueError("max() of an empty MultiSet")
+        return self._blocks[-1][-1].item()
+
+    def pop_min(self):
+        """(NumericMultiSet) -> object
+        Remove and return one occurrence of the smallest number. Raise
+        IndexError if this NumericMultiSet is empty.
+        """
+        self._check_writable()
+        if not self._size:
+            raise IndexError("pop from an empty MultiSet")
+        value = self._blocks[0][0].item()
+        self._blocks[0] = self._blocks[0][1:]
+        self._size -= 1
+        self._changed(0)
+        self._join(0)
+        return value
+
+    def pop_max(self):
+        """(NumericMultiSet) -> object
+        Remove and return one occurrence of the largest number. Raise
+        IndexError if this NumericMultiSet is empty.
+        """
+        self._check_writable()
+        if not self._size:
+            raise IndexError("pop from an empty MultiSet")
+        i = len(self._blocks) - 1
+        value = self._blocks[i][-1].item()
+        self._blocks[i] = self._blocks[i][:-1]
+        self._size -= 1
+        self._changed(i)
+        self._join(i)
+        return value
+
+    def contains_many(self, elems):
+        """(NumericMultiSet, iterable) -> list of bool
+        Return whether every number of elems belongs to this NumericMultiSet,
+        in the order of elems.
+        """
+        return [count > 0 for count in self.count_many(elems)]
+
+    def count_many(self, elems):
+        """(NumericMultiSet, iterable) -> list of int
+        Return the number of occurrences of every number of elems, in the
+        order of elems.
+        """
+        # The probes are sorted, so every block is searched once for all the
+        # probes routed to it.
+        probes = np.asarray(list(elems))
+        order = np.argsort(probes, kind='stable')
+        ordered = probes[order]
+        counts = np.empty(len(probes), np.int64)
+        counts[order] = (self._ranks(ordered, 'right') - 
+                         self._ranks(ordered, 'left'))
+        return counts.tolist()
+
+    def count(self, elem):
+        """(NumericMultiSet, object) -> int
+        Return the number of occurrences of the number elem.
+        """
+        return self.bisect_right(elem) - self.bisect_left(elem)
+
+    def bisect_left(self, elem):
+        """(NumericMultiSet, object) -> int
+        Return the index of the first occurrence of elem in the sorted order,
+        or where it would go if elem is not in this NumericMultiSet.
+        """
+        i = bisect_left(self._maxes, elem)
+        if i == len(self._blocks):
+            return self._size
+        return (self._block_starts()[i] +
+                int(np.searchsorted(self._blocks[i], elem, 'left')))
+
+    def bisect_right(self, elem):
+        """(NumericMultiSet, object) -> int
+        Return the index right after the last occurrence of elem in the sorted
+        order, or where it would go if elem is not in this NumericMultiSet.
+        """
+        i = bisect_right(self._maxes, elem)
+        if i == len(self._blocks):
+            return self._size
+        return (self._block_starts()[i] +
+                int(np.searchsorted(self._blocks[i], elem, 'right')))
+
+    rank = bisect_left
+
+    def select(self, index):
+        """(NumericMultiSet, int) -> object
+        Return the number at index in the sorted order of this
+        NumericMultiSet. Raise IndexError if there is no such index.
+        """
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("MultiSet index out of range")
+
+        starts = self._block_starts()
+        i = bisect_right(starts, index) - 1
+        return self._blocks[i][index - starts[i]].item()
+
+    def __getitem__(self, index):
+        """(NumericMultiSet, int or slice) -> object or generator
+        Return the number at index in the sorted order, where every
+        occurrence has its own index. A slice gives a generator.
+        """
+        if isinstance(index, slice):
+            return self._islice(*index.indices(self._size))
+        return self.select(index)
+
+    def _islice(self, start, stop, step):
+        """(NumericMultiSet, int, int, int) -> generator
+        Yield the numbers at indexes range(start, stop, step).
+        """
+        if step < 0 or start >= stop:
+            for i in range(start, stop, step):
+                yield self.select(i)
+            return
+
+        # Walk the blocks from the one holding start, a slice of each at a
+        # time.
+        starts = self._block_starts()
+        i = bisect_right(starts, start) - 1
+        while start < stop:
+            end = min(stop, starts[i + 1])
+            part = self._blocks[i][start - starts[i]:end - starts[i]:step]
+            for value in part.tolist():
+                yield value
+            start += -(-(end - start) // step) * step
+            i += 1
+            while i < len(self._blocks) and starts[i + 1] <= start:
+                i += 1
+
+    def _bounds(self, lo, hi, inclusive):
+        """(NumericMultiSet, object, object, (bool, bool)) -> (int, int)
+        Return the indexes of the first occurrence from lo to hi and right
+        after the last one, with the bounds as in MultiSet.irange.
+        """
+        if lo is None:
+            start = 0
+        elif inclusive[0]:
+            start = self.bisect_left(lo)
+        else:
+            start = self.bisect_right(lo)
+
+        if hi is None:
+            stop = self._size
+        elif inclusive[1]:
+            stop = self.bisect_right(hi)
+        else:
+            stop = self.bisect_left(hi)
+
+        return start, max(start, stop)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        """(NumericMultiSet, object, object, (bool, bool)) -> generator
+        Yield every occurrence of the numbers from lo to hi in sorted order.
+        """
+        start, stop = self._bounds(lo, hi, inclusive)
+        return self._islice(start, stop, 1)
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(NumericMultiSet, object, object, (bool, bool)) -> int
+        Return the number of occurrences of the numbers from lo to hi.
+        """
+        start, stop = self._bounds(lo, hi, inclusive)
+        return stop - start
+
+    def delete_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(NumericMultiSet, object, object, (bool, bool)) -> int
+        Remove every occurrence of the numbers from lo to hi, and return how
+        many were removed.
+        """
+        self._check_writable()
+        start, stop = self._bounds(lo, hi, inclusive)
+        if start == stop:
+            return 0
+
+        # Only the blocks at both ends are cut, the ones between are dropped.
+        starts = self._block_starts()
+        blocks = []
+        for i in range(len(self._blocks)):
+            block = self._blocks[i]
+            cut_from = min(max(start - starts[i], 0), len(block))
+            cut_to = min(max(stop - starts[i], 0), len(block))
+            if cut_from < cut_to:
+                block = np.concatenate((block[:cut_from], block[cut_to:]))
+            if len(block):
+                blocks.append(block)
+
+        self._blocks = blocks
+        self._maxes = [block[-1] for block in blocks]
+        self._size -= stop - start
+        self._starts = None
+        self._join_small()
+        return stop - start
+
+    def travel_down(self):
+        """(NumericMultiSet) -> NoneType
+        Raise TypeError, since a NumericMultiSet has no SkipList.
+        """
+        raise TypeError("a NumericMultiSet has no SkipList")
+
+    @property
+    def stats(self):
+        """(NumericMultiSet) -> NoneType
+        Return None, since a NumericMultiSet keeps no stats.
+        """
+        return None
+
+    def enable_stats(self):
+        """(NumericMultiSet) -> NoneType
+        Raise TypeError, since a NumericMultiSet keeps no stats.
+        """
+        raise TypeError("a NumericMultiSet keeps no stats")
+
+    def disable_stats(self):
+        """(NumericMultiSet) -> NoneType
+        Return None, since a NumericMultiSet keeps no stats.
+        """
+        return None
+
+    def memory_usage(self, deep=False):
+        """(NumericMultiSet, bool) -> dict
+        Return the bytes taken by this NumericMultiSet as a dict: the 'total',
+        split into the 'payload' (the numbers in the blocks) and the
+        'overhead' (the array headers and the lists of blocks and maxes),
+        and the number of 'blocks'. The numbers are always counted, so deep
+        changes nothing.
+        """
+        payload = sum(block.nbytes for block in self._blocks)
+        # A view does not count the data it shares with its base.
+        overhead = sum(sys.getsizeof(block) - 
+                       (block.nbytes if block.base is None else 0)
+                       for block in self._blocks)
+        overhead += sum(sys.getsizeof(m) for m in self._maxes)
+        overhead += sys.getsizeof(self._blocks) + sys.getsizeof(self._maxes)
+        return {'total': payload + overhead, 'payload': payload,
+                'overhead': overhead, 'blocks': len(self._blocks)}
+
+    def runs(self):
+        """(NumericMultiSet) -> generator of (object, int)
+        Yield every distinct number of this NumericMultiSet in sorted order
+        together with its number of occurrences.
+        """
+        values, counts = np.unique(self._array(), return_counts=True)
+        return zip(values.tolist(), counts.tolist())
+
+    def _keyed_runs(self):
+        """(NumericMultiSet) -> generator of (object, object, int)
+        Yield every distinct number twice, as its own key, with its number of
+        occurrences.
+        """
+        for value, count in self.runs():
+            yield value, value, count
+
+    def _counts(self, other):
+        """(NumericMultiSet, MultiSet) -> (numpy.ndarray, numpy.ndarray,
+        numpy.ndarray)
+        Return every distinct number of this NumericMultiSet and other in
+        sorted order, with the number of occurrences of each in both.
+        """
+        mine, my_counts = np.unique(self._array(), return_counts=True)
+        theirs, their_counts = np.unique(_as_array(other, self.dtype),
+                                         return_counts=True)
+        values = np.union1d(mine, theirs)
+        a = np.zeros(len(values), np.int64)
+        b = np.zeros(len(values), np.int64)
+        a[np.searchsorted(values, mine)] = my_counts
+        b[np.searchsorted(values, theirs)] = their_counts
+        return values, a, b
+
+    def _from_counts(self, values, counts):
+        """(NumericMultiSet, numpy.ndarray, numpy.ndarray) -> NumericMultiSet
+        Return a new NumericMultiSet of the dtype of this one, holding every
+        number of values as many times as its count.
+        """
+        new_set = NumericMultiSet(dtype=self.dtype)
+        new_set._set_array(self._cast_array(np.repeat(values, counts)))
+        return new_set
+
+    def __eq__(self, other):
+        """(NumericMultiSet, MultiSet) -> bool
+        Return True iff this NumericMultiSet is equal to other.
+        """
+        return bool(np.array_equal(self._array(),
+                                   _as_array(other, self.dtype)))
+
+    def __le__(self, other):
+        """(NumericMultiSet, MultiSet) -> bool
+        Return True iff this NumericMultiSet is a subset of other.
+        """
+        values, a, b = self._counts(other)
+        return bool(np.all(a <= b))
+
+    def __sub__(self, other):
+        """(NumericMultiSet, MultiSet) -> NumericMultiSet
+        Return the multiset difference between this NumericMultiSet and other.
+        """
+        values, a, b = self._counts(other)
+        return self._from_counts(values, np.maximum(a - b, 0))
+
+    def __add__(self, other):
+        """(NumericMultiSet, MultiSet) -> NumericMultiSet
+        Return the multiset union between this NumericMultiSet and other.
+        """
+        values, a, b = self._counts(other)
+        return self._from_counts(values, np.maximum(a, b))
+
+    def __and__(self, other):
+        """(NumericMultiSet, MultiSet) -> NumericMultiSet
+        Return the multiset intersection between this NumericMultiSet and
+        other.
+        """
+        values, a, b = self._counts(other)
+        return self._from_counts(values, np.minimum(a, b))
+
+    async def _abuild(self, runs, chunk):
+        """(NumericMultiSet, iterable of (object, object, int), int)
+        -> NumericMultiSet
+        Return a new NumericMultiSet of the dtype of this one, from (key,
+        number, count) triples sorted by key, gathered chunk triples at a
+        time. Triples with a count of 0 or less are left out.
+        """
+        values = []
+        counts = []
+        async for batch in _batches(runs, chunk):
+            for k, value, count in batch:
+                if count > 0:
+                    values.append(value)
+                    counts.append(count)
+        return self._from_counts(values, counts)
+
+    def _replace_with(self, other):
+        """(NumericMultiSet, NumericMultiSet) -> NumericMultiSet
+        Make the contents of other those of this NumericMultiSet, and return
+        this NumericMultiSet.
+        """
+        self._check_writable()
+        self._check_budget(other._size - self._size)
+        self._blocks = other._blocks
+        self._maxes = other._maxes
+        self._size = other._size
+        self._starts = None
+        return self
+
+    def __isub__(self, other):
+        """(NumericMultiSet, MultiSet) -> NumericMultiSet
+        Make this NumericMultiSet equal to self - other, in-place.
+        """
+        return self._replace_with(self - other)
+
+    def __iadd__(self, other):
+        """(NumericMultiSet, MultiSet) -> NumericMultiSet
+        Make this NumericMultiSet equal to self + other, in-place.
+        """
+        return self._replace_with(self + other)
+
+    def __iand__(self, other):
+        """(NumericMultiSet, MultiSet) -> NumericMultiSet
+        Make this NumericMultiSet equal to self & other, in-place.
+        """
+        return self._replace_with(self & other)
+
+    def isdisjoint(self, other):
+        """(NumericMultiSet, MultiSet) -> bool
+        Return True iff this NumericMultiSet has no number in common with
+        other.
+        """
+        return not len(np.intersect1d(self._array(),
+                                      _as_array(other, self.dtype)))
+
+    def copy(self):
+        """(NumericMultiSet) -> NumericMultiSet
+        Return a copy of this NumericMultiSet, which shares its blocks.
+        """
+        new_set = NumericMultiSet(dtype=self.dtype,
+                                  memory_budget=self.memory_budget,
+                                  budget_action=self.budget_action)
+        new_set._blocks = list(self._blocks)
+        new_set._maxes = list(self._maxes)
+        new_set._size = self._size
+        return new_set
+
+    def snapshot(self):
+        """(NumericMultiSet) -> NumericMultiSet
+        Return a read-only copy of this NumericMultiSet.
+        """
+        new_set = self.copy()
+        new_set.frozen = True
+        return new_set
+
+
+def _as_array(multiset, dtype):
+    """(MultiSet, numpy.dtype) -> numpy.ndarray
+    Return every occurrence in multiset as one sorted array, of dtype unless
+    multiset is a NumericMultiSet.
+    """
+    if isinstance(multiset, NumericMultiSet):
+        return multiset._array()
+
+    runs = list(multiset.runs())
+    if not runs:
+        return np.empty(0, dtype)
+    return np.repeat(np.array([value for value, count in runs]),
+                     [count for value, count in runs])
@@ -0,0 +1,484 @@
+"""A compact binary format for the Multiset ADT, and a read-only MultiSet
+that answers queries straight from a memory-mapped file in that format.
+
+A file starts with a 24 byte header: the magic b'MSET', the format version,
+the type code of the elements, the byte order of the numbers, the flags, the
+number of stored elements and the number of occurrences in all. Then come,
+every section being a multiple of 8 bytes long:
+
+    ends      if the RUNS flag is set, the number of occurrences up to and
+              including every stored element, as unsigned 64-bit ints, so
+              every element is stored once with its count. Otherwise every
+              occurrence is stored.
+    elements  for type code 'q' (ints) or 'd' (floats), the elements as
+              fixed-width 64-bit numbers. For 'o' (anything else), the
+              offsets of the elements as unsigned 64-bit ints, one more than
+              there are elements, followed by every element pickled.
+
+The elements are stored in the sorted order of the MultiSet they came from.
+"""
+
+import mmap
+import pickle
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+
+MAGIC = b'MSET'
+VERSION = 1
+RUNS = 1  # Flag: the elements are stored once each, with their counts.
+
+HEADER = struct.Struct('<4sBccBQQ')
+_INT64 = (-2 ** 63, 2 ** 63)
+
+
+def dumps(runs, runs_only=True):
+    """(iterable of (object, int), bool) -> bytes
+    Return the encoding of the sorted (element, count) pairs runs. Every
+    occurrence is stored separately unless runs_only is True.
+    """
+
+    values = []
+    counts = []
+    for value, count in runs:
+        values.append(value)
+        counts.append(count)
+    size = sum(counts)
+
+    if not runs_only:
+        values = [value for value, count in zip(values, counts)
+                  for i in range(count)]
+
+    code = _type_code(values)
+    flags = RUNS if runs_only else 0
+    order = b'<' if sys.byteorder == 'little' else b'>'
+    parts = [HEADER.pack(MAGIC, VERSION, code, order, flags, len(values),
+                         size)]
+
+    if runs_only:
+        parts.append(array('Q', accumulate(counts)).tobytes())
+
+    if code != b'o':
+        parts.append(array(code.decode(), values).tobytes())
+
+    else:
+        blobs = [pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                 for value in values]
+        offsets = array('Q', accumulate([0] + [len(b) for b in blobs]))
+        parts.append(offsets.tobytes())
+        parts.append(b''.join(blobs))
+
+    return b''.join(parts)
+
+
+def _type_code(values):
+    """(list) -> bytes
+    Return the type code the elements values are stored with.
+    """
+
+    # bool is a subclass of int, but would not come back as a bool.
+    if values and all(type(v) is int and _INT64[0] <= v < _INT64[1]
+                      for v in values):
+        return b'q'
+    if values and all(type(v) is float for v in values):
+        return b'd'
+    return b'o'
+
+
+def parse(buffer):
+    """(bytes-like object) -> (int, sequence, sequence of int or NoneType)
+    Return the number of occurrences, the stored elements and their ends (or
+    None if every occurrence is stored) of the encoding in buffer, without
+    copying it where the byte order allows.
+    """
+
+    view = memoryview(buffer)
+    try:
+        code, swap, flags, n, size = _check(view)
+    except ValueError:
+        # A memory map cannot be closed while a view of it is left.
+        view.release()
+        raise
+
+    start = HEADER.size
+    ends = None
+    if flags & RUNS:
+        ends = _numbers(view[start:start + 8 * n], 'Q', swap)
+        start += 8 * n
+
+    if code in (b'q', b'd'):
+        values = _numbers(view[start:start + 8 * n], code.decode(), swap)
+
+    else:
+        offsets = _numbers(view[start:start + 8 * (n + 1)], 'Q', swap)
+        start += 8 * (n + 1)
+        values = _Pickled(offsets, view[start:])
+
+    return size, values, ends
+
+
+def _check(view):
+    """(memoryview) -> (bytes, bool, int, int, int)
+    Return the type code, whether the numbers need swapping, the flags, the
+    number of stored elements and the number of occurrences of the encoding
+    in view. Raise ValueError if it is not one, or if view is shorter than
+    its header says, so that a truncated or corrupt file is never read past
+    its end.
+    """
+
+    if len(view) < HEADER.size:
+        raise ValueError("not a MultiSet file")
+
+    magic, version, code, order, flags, n, size = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("not a MultiSet file")
+    if version != VERSION:
+        raise ValueError("unknown MultiSet file version %d" % version)
+    if code not in (b'q', b'd', b'o') or order not in (b'<', b'>'):
+        raise ValueError("corrupt MultiSet file header")
+
+    length = HEADER.size + 8 * n * (2 if flags & RUNS else 1)
+    if code == b'o':
+        # The last offset is where the pickles end.
+        length += 8
+        if len(view) >= length:
+            length += struct.unpack_from(order.decode() + 'Q', view,
+                                         length - 8)[0]
+    if len(view) < length:
+        raise ValueError("MultiSet file is truncated")
+
+    swap = order != (b'<' if sys.byteorder == 'little' else b'>')
+    return code, swap, flags, n, size
+
+
+def _numbers(view, code, swap):
+    """(memoryview, str, bool) -> sequence of int or float
+    Return the 64-bit numbers of type code in view, byte-swapped if swap is
+    True.
+    """
+
+    if not swap:
+        return view.cast(code)
+
+    numbers = array(code, view.tobytes())
+    numbers.byteswap()
+    return numbers
+
+
+def iter_runs(values, ends):
+    """(sequence, sequence of int or NoneType) -> generator
+    Yield the (element, count) pairs of the parsed elements values with the
+    ends ends.
+    """
+
+    if ends is None:
+        i = 0
+        while i < len(values):
+            j = i + 1
+            while j < len(values) and values[j] == values[i]:
+                j += 1
+            yield values[i], j - i
+            i = j
+        return
+
+    last = 0
+    for i in range(len(values)):
+        yield values[i], ends[i] - last
+        last = ends[i]
+
+
+class _Pickled(object):
+    """The sequence of the pickled elements of an encoded MultiSet, which
+    are only unpickled when they are looked up.
+    """
+
+    def __init__(self, offsets, blob):
+        """(_Pickled, sequence of int, memoryview) -> NoneType
+        Make the sequence of the pickles in blob, where pickle i is
+        blob[offsets[i]:offsets[i + 1]].
+        """
+
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        """(_Pickled) -> int
+        Return the number of pickled elements.
+        """
+
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """(_Pickled, int) -> object
+        Return element i, unpickled, counting from the end if i is negative.
+        """
+
+        if not -len(self) <= i < len(self):
+            raise IndexError("index out of range")
+        if i < 0:
+            i += len(self)
+        return pickle.loads(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def release(self):
+        """(_Pickled) -> NoneType
+        Release the views of the file held by this sequence.
+        """
+
+        # The offsets of a file in the other byte order are a swapped copy.
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.blob.release()
+
+
+class _Keys(object):
+    """The keys of a sequence of elements, computed when looked up."""
+
+    def __init__(self, values, key):
+        """(_Keys, sequence, function) -> NoneType
+        Make the sequence of key(value) for every value of values.
+        """
+
+        self.values = values
+        self.key = key
+
+    def __len__(self):
+        """(_Keys) -> int
+        Return the number of values.
+        """
+
+        return len(self.values)
+
+    def __getitem__(self, i):
+        """(_Keys, int) -> object
+        Return the key of value i.
+        """
+
+        return self.key(self.values[i])
+
+
+class MappedMultiSet(object):
+    """A read-only MultiSet over a file written by MultiSet.save. The file is
+    memory-mapped, and every query is answered by binary search on it, so
+    only the parts of the file that are looked at are ever read.
+    """
+
+    def __init__(self, path, key=None):
+        """(MappedMultiSet, str, function) -> NoneType
+        Open the MultiSet file at path. A MultiSet saved with a key function
+        must be opened with the same key.
+        """
+
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:  # An empty file cannot be mapped.
+            self._file.close()
+            raise ValueError("not a MultiSet file")
+
+        try:
+            self._size, self._values, self._ends = parse(self._map)
+        except ValueError:
+            self._map.close()
+            self._file.close()
+            raise
+
+        self.key = key
+        self._keys = self._values if key is None else _Keys(self._values,
+                                                            key)
+
+    def close(self):
+        """(MappedMultiSet) -> NoneType
+        Unmap and close the file of this MappedMultiSet.
+        """
+
+        # The mapping can only be closed once no view of it is left.
+        for part in (self._values, self._ends):
+            if hasattr(part, 'release'):
+                part.release()
+        self._values = self._keys = self._ends = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        """(MappedMultiSet) -> MappedMultiSet
+        Return this MappedMultiSet, to be closed at the end of a with block.
+        """
+
+        return self
+
+    def __exit__(self, *exc_info):
+        """(MappedMultiSet, object) -> NoneType
+        Close this MappedMultiSet.
+        """
+
+        self.close()
+
+    def __repr__(self):
+        """(MappedMultiSet) -> str
+        Return a string representation of this MappedMultiSet.
+        """
+
+        return "MultiSet([" + ", ".join(str(e) for e in self[:]) + "])"
+
+    def __len__(self):
+        """(MappedMultiSet) -> int
+        Return the number of elements in this MappedMultiSet.
+        """
+
+        return self._size
+
+    def _key_of(self, elem):
+        """(MappedMultiSet, object) -> object
+        Return the key that orders elem.
+        """
+
+        return elem if self.key is None else self.key(elem)
+
+    def _before(self, i):
+        """(MappedMultiSet, int) -> int
+        Return the number of occurrences stored before the element at i.
+        """
+
+        if self._ends is None:
+            return i
+        return self._ends[i - 1] if i else 0
+
+    def __contains__(self, elem):
+        """(MappedMultiSet, object) -> bool
+        Return True iff element elem belongs to this MappedMultiSet.
+        """
+
+        key = self._key_of(elem)
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def count(self, elem):
+        """(MappedMultiSet, object) -> int
+        Return the number of occurrences of element elem.
+        """
+
+        return self.bisect_right(elem) - self.bisect_left(elem)
+
+    def min(self):
+        """(MappedMultiSet) -> object
+        Return the smallest element. Raise ValueError if there is none.
+        """
+
+        if not self._size:
+            raise ValueError("min() of an empty MultiSet")
+        return self._values[0]
+
+    def max(self):
+        """(MappedMultiSet) -> object
+        Return the largest element. Raise ValueError if there is none.
+        """
+
+        if not self._size:
+            raise ValueError("max() of an empty MultiSet")
+        return self._values[len(self._values) - 1]
+
+    def contains_many(self, elems):
+        """(MappedMultiSet, iterable) -> list of bool
+        Return whether every element of elems belongs to this MappedMultiSet,
+        in the order of elems.
+        """
+
+        return [elem in self for elem in elems]
+
+    def count_many(self, elems):
+        """(MappedMultiSet, iterable) -> list of int
+        Return the number of occurrences of every element of elems, in the
+        order of elems.
+        """
+
+        return [self.count(elem) for elem in elems]
+
+    def bisect_left(self, elem):
+        """(MappedMultiSet, object) -> int
+        Return the index of the first occurrence of elem in the sorted order,
+        or where it would go if elem is not in this MappedMultiSet.
+        """
+
+        return self._before(bisect_left(self._keys, self._key_of(elem)))
+
+    def bisect_right(self, elem):
+        """(MappedMultiSet, object) -> int
+        Return the index right after the last occurrence of elem in the sorted
+        order, or where it would go if elem is not in this MappedMultiSet.
+        """
+
+        return self._before(bisect_right(self._keys, self._key_of(elem)))
+
+    rank = bisect_left
+
+    def select(self, index):
+        """(MappedMultiSet, int) -> object
+        Return the element at index in the sorted order of this
+        MappedMultiSet. Raise IndexError if there is no such index.
+        """
+
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("MultiSet index out of range")
+
+        if self._ends is None:
+            return self._values[index]
+        return self._values[bisect_right(self._ends, index)]
+
+    def __getitem__(self, index):
+        """(MappedMultiSet, int or slice) -> object or generator
+        Return the element at index in the sorted order, where every
+        occurrence has its own index. A slice gives a generator.
+        """
+
+        if isinstance(index, slice):
+            return (self.select(i) for i in range(*index.indices(self._size)))
+        return self.select(index)
+
+    def _bound(self, bound, right, end):
+        """(MappedMultiSet, object, bool, bool) -> int
+        Return the index of the first stored element after bound, or not
+        before it if right is False. A bound of None is the start of the
+        elements, or their end if end is True.
+        """
+
+        if bound is None:
+            return len(self._keys) if end else 0
+        if right:
+            return bisect_right(self._keys, self._key_of(bound))
+        return bisect_left(self._keys, self._key_of(bound))
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        """(MappedMultiSet, object, object, (bool, bool)) -> generator
+        Yield every occurrence of the elements from lo to hi in sorted order,
+        with the bounds as in MultiSet.irange.
+        """
+
+        start = self._bound(lo, not inclusive[0], False)
+        stop = self._bound(hi, inclusive[1], True)
+        for i in range(start, stop):
+            value = self._values[i]
+            for j in range(self._before(i + 1) - self._before(i)):
+                yield value
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(MappedMultiSet, object, object, (bool, bool)) -> int
+        Return the number of occurrences of the elements from lo to hi.
+        """
+
+        start = self._bound(lo, not inclusive[0], False)
+        stop = self._bound(hi, inclusive[1], True)
+        return max(self._before(stop) - self._before(start), 0)
+
+    def runs(self):
+        """(MappedMultiSet) -> generator of (object, int)
+        Yield every distinct element in sorted order together with its
+        number of occurrences.
+        """
+
+        return iter_runs(self._values, self._ends)
@@ -0,0 +1,622 @@
+"""A Multiset ADT split by key ranges into shards, so that the work on the
+shards can run in parallel.
+
+Every shard is a MultiSet of its own, holding the elements whose keys fall in
+its range. The shards live in a ShardPool of worker processes, each keeping
+its shards in a registry from one call to the next, so a query only sends
+its probes or ranges to the workers, and gets their counts back. The bulk
+builds, count_many, count_ranges and the set operations run on every worker
+at once, and their results are stitched back together in order. The
+elements, and the key function if any, must be picklable.
+"""
+
+import operator
+import os
+import weakref
+from bisect import bisect_right
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain, count
+
+from multiset import MultiSet
+
+
+# The shards held by this process, by id. The parent process only holds
+# shards of the ShardedMultiSets that have no ShardPool.
+_registry = {}
+
+_local_ids = count()
+
+
+class ShardPool(object):
+    """A set of worker processes that keep shards. The shard with id i lives
+    in worker i % workers for its whole life, and every worker runs its calls
+    one at a time, in the order they were made.
+    """
+
+    def __init__(self, workers=None):
+        """(ShardPool, int) -> NoneType
+        Start a ShardPool of workers processes, one per CPU by default.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if workers < 1:
+            raise ValueError("workers must be positive")
+
+        self.workers = workers
+        self._executors = [ProcessPoolExecutor(1, initializer=_start_worker)
+                           for i in range(workers)]
+        self._ids = count()
+
+    def _new_id(self, worker):
+        """(ShardPool, int) -> int
+        Return an id, never given before, for a new shard in worker.
+        """
+        return next(self._ids) * self.workers + worker % self.workers
+
+    def _submit(self, shard_id, function, *args):
+        """(ShardPool, int, function, object) -> concurrent.futures.Future
+        Run function(*args) in the worker of the shard shard_id.
+        """
+        return self._executors[shard_id % self.workers].submit(function,
+                                                               *args)
+
+    def shutdown(self, wait=True):
+        """(ShardPool, bool) -> NoneType
+        Stop the workers, and with them every shard they keep.
+        """
+        for executor in self._executors:
+            executor.shutdown(wait)
+
+    def __enter__(self):
+        """(ShardPool) -> ShardPool
+        Return this ShardPool, to be shut down at the end of a with block.
+        """
+        return self
+
+    def __exit__(self, *exc_info):
+        """(ShardPool, object) -> NoneType
+        Shut this ShardPool down.
+        """
+        self.shutdown()
+
+
+class _LocalPool(object):
+    """The stand-in for a ShardPool that keeps the shards in this process
+    and runs every call on the spot.
+    """
+
+    workers = 1
+
+    def _new_id(self, worker):
+        """(_LocalPool, int) -> int
+        Return an id, never given before, for a new shard.
+        """
+        return next(_local_ids)
+
+    def _submit(self, shard_id, function, *args):
+        """(_LocalPool, int, function, object) -> concurrent.futures.Future
+        Return the finished Future of function(*args).
+        """
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class ShardedMultiSet(object):
+    """A multiset whose elements are spread over MultiSets by key range. The
+    shard i holds the keys from bounds[i - 1] (included) to bounds[i]
+    (excluded), the first and last shards being open-ended. shards holds the
+    ids of the shards in the pool, and sizes their numbers of elements.
+    """
+
+    def __init__(self, pool=None, max_shard=1 << 16, **options):
+        """(ShardedMultiSet, ShardPool, int) -> NoneType
+        Initialize this ShardedMultiSet to be empty, with a single shard. The
+        shards are kept in pool, or in this process if it is None. A shard
+        that grows past max_shard elements is split in two at its median
+        key. Any options are passed on to the MultiSet constructor of every
+        shard.
+        """
+        if max_shard < 2:
+            raise ValueError("max_shard must be at least 2")
+
+        self.pool = _LocalPool() if pool is None else pool
+        self.max_shard = max_shard
+        self.options = options
+        self.key = options.get('key')
+        self.bounds = []  # The smallest key of every shard but the first.
+        self.shards = []
+        self.sizes = []
+        # The shards are dropped from the pool along with this object. The
+        # list of ids is only ever changed in place for that reason.
+        finalizer = weakref.finalize(self, _release, self.pool, self.shards)
+        finalizer.atexit = False
+
+        shard_id = self.pool._new_id(0)
+        self._call(shard_id, _build_shard, shard_id, [], options)
+        self.shards.append(shard_id)
+        self.sizes.append(0)
+
+    @classmethod
+    def from_iterable(cls, items, shards=None, pool=None,
+                      max_shard=1 << 16, **options):
+        """(type, iterable, int, ShardPool, int) -> ShardedMultiSet
+        Return a new ShardedMultiSet holding every element of items, split
+        into about shards shards of equal size (one per worker of pool by
+        default, or one if there is no pool), which are sorted and built in
+        the workers of pool. Any options are passed on to the MultiSet
+        constructor.
+        """
+        new_set = cls(pool, max_shard, **options)
+        items = list(items)
+        if shards is None:
+            shards = new_set.pool.workers
+        shards = max(shards, -(-len(items) // max_shard), 1)
+        if not items:
+            return new_set
+
+        # The bounds are quantiles of a sample of the keys, which is enough
+        # to balance the shards, and the rest of the sorting is left to them.
+        sample = sorted(new_set._key_of(elem)
+                        for elem in items[::max(len(items) // (64 * shards),
+                                                1)])
+        bounds = []
+        for i in range(1, shards):
+            bound = sample[i * len(sample) // shards]
+            if not bounds or bounds[-1] < bound:
+                bounds.append(bound)
+
+        buckets = [[] for i in range(len(bounds) + 1)]
+        for elem in items:
+            buckets[bisect_right(bounds, new_set._key_of(elem))].append(elem)
+        del items
+
+        # The shards are dealt out to the workers in turn.
+        ids = [new_set.pool._new_id(i) for i in range(len(buckets))]
+        sizes = new_set._gather((shard_id, _build_shard, shard_id, bucket,
+                                 options)
+                                for shard_id, bucket in zip(ids, buckets))
+        new_set._replace(bounds, ids, sizes)
+        new_set._split_large()
+        return new_set
+
+    def _call(self, shard_id, function, *args):
+        """(ShardedMultiSet, int, function, object) -> object
+        Return function(*args), run in the worker of the shard shard_id.
+        """
+        return self.pool._submit(shard_id, function, *args).result()
+
+    def _gather(self, calls):
+        """(ShardedMultiSet, iterable of tuple) -> list
+        Return the list of function(*args) for every (shard_id, function,
+        *args) of calls, all of which run at once in their workers.
+        """
+        futures = [self.pool._submit(*call) for call in calls]
+        return [future.result() for future in futures]
+
+    def _replace(self, bounds, shards, sizes):
+        """(ShardedMultiSet, list, list of int, list of int) -> NoneType
+        Make the shards shards, of sizes elements, split at bounds, the
+        contents of this ShardedMultiSet, dropping its former shards.
+        """
+        _release(self.pool, self.shards)
+        self.bounds = bounds
+        self.shards[:] = shards
+        self.sizes = sizes
+
+    def _worker(self, i):
+        """(ShardedMultiSet, int) -> int
+        Return the index of the worker that keeps the shard i.
+        """
+        return self.shards[i] % self.pool.workers
+
+    def _key_of(self, elem):
+        """(ShardedMultiSet, object) -> object
+        Return the key that orders elem.
+        """
+        return elem if self.key is None else self.key(elem)
+
+    def _shard_of(self, elem):
+        """(ShardedMultiSet, object) -> int
+        Return the index of the shard that holds elem.
+        """
+        return bisect_right(self.bounds, self._key_of(elem))
+
+    def __repr__(self):
+        """(ShardedMultiSet) -> str
+        Return a string representation of this ShardedMultiSet.
+        """
+        return ("MultiSet([" + ", ".join(str(e) for e in self) + "])")
+
+    def __len__(self):
+        """(ShardedMultiSet) -> int
+        Return the number of elements in this ShardedMultiSet.
+        """
+        return sum(self.sizes)
+
+    def __iter__(self):
+        """(ShardedMultiSet) -> generator
+        Yield every occurrence of every element in sorted order.
+        """
+        for e, count in self.runs():
+            for i in range(count):
+                yield e
+
+    def runs(self):
+        """(ShardedMultiSet) -> generator of (object, int)
+        Yield every distinct element in sorted order together with its
+        number of occurrences, fetching the shards one at a time.
+        """
+        for i in range(len(self.shards)):
+            for k, e, count in self._fetch(i):
+                yield e, count
+
+    def _fetch(self, i):
+        """(ShardedMultiSet, int) -> list of (object, object, int)
+        Return the sorted (key, element, count) triples of the shard i.
+        """
+        return self._call(self.shards[i], _keyed_runs, self.shards[i])
+
+    def __eq__(self, other):
+        """(ShardedMultiSet, object) -> bool
+        Return True iff this ShardedMultiSet has the same elements as other,
+        another ShardedMultiSet or MultiSet.
+        """
+        return list(self.runs()) == list(other.runs())
+
+    def __contains__(self, elem):
+        """(ShardedMultiSet, object) -> bool
+        Return True iff element elem belongs to this ShardedMultiSet.
+        """
+        return self.count(elem) > 0
+
+    def count(self, elem):
+        """(ShardedMultiSet, object) -> int
+        Return the number of occurrences of element elem.
+        """
+        shard_id = self.shards[self._shard_of(elem)]
+        return self._call(shard_id, _ask, shard_id, 'count', elem)
+
+    def min(self):
+        """(ShardedMultiSet) -> object
+        Return the smallest element. Raise ValueError if there is none.
+        """
+        for shard_id, size in zip(self.shards, self.sizes):
+            if size:
+                return self._call(shard_id, _ask, shard_id, 'min')
+        raise ValueError("min() of an empty MultiSet")
+
+    def max(self):
+        """(ShardedMultiSet) -> object
+        Return the largest element. Raise ValueError if there is none.
+        """
+        for shard_id, size in zip(reversed(self.shards),
+                                  reversed(self.sizes)):
+            if size:
+                return self._call(shard_id, _ask, shard_id, 'max')
+        raise ValueError("max() of an empty MultiSet")
+
+    def insert(self, elem):
+        """(ShardedMultiSet, object) -> NoneType
+        Add one occurrence of element elem, splitting its shard if it grows
+        past max_shard elements.
+        """
+        i = self._shard_of(elem)
+        self.sizes[i] = self._call(self.shards[i], _change, self.shards[i],
+                                   'insert', elem)
+        if self.sizes[i] > self.max_shard:
+            self._split(i)
+
+    def remove(self, elem):
+        """(ShardedMultiSet, object) -> NoneType
+        Remove one occurrence of element elem, if it is there. A shard left
+        empty is dropped.
+        """
+        i = self._shard_of(elem)
+        self.sizes[i] = self._call(self.shards[i], _change, self.shards[i],
+                                   'remove', elem)
+        if not self.sizes[i] and len(self.shards) > 1:
+            # The neighbour on the left takes over the range, or the one on
+            # the right if there is none.
+            _release(self.pool, [self.shards[i]])
+            del self.shards[i]
+            del self.sizes[i]
+            del self.bounds[max(i - 1, 0)]
+
+    def rebalance(self):
+        """(ShardedMultiSet) -> NoneType
+        Split every shard with more than max_shard elements at its median
+        key, and merge every run of neighbouring shards that together hold
+        at most half as many, as the data skews.
+        """
+        self._split_large()
+        i = 0
+        while i + 1 < len(self.shards):
+            size = self.sizes[i] + self.sizes[i + 1]
+            if size <= self.max_shard // 2:
+                # The merged shard stays in the worker of the left one. The
+                # two hold no key in common, so their union holds both.
+                new_id = self.pool._new_id(self._worker(i))
+                part = (self.shards[i + 1]
+                        if self._worker(i + 1) == self._worker(i)
+                        else self._fetch(i + 1))
+                self._call(new_id, _combine, operator.add, self.shards[i],
+                           part, new_id, self.options)
+                _release(self.pool, self.shards[i:i + 2])
+                self.shards[i:i + 2] = [new_id]
+                self.sizes[i:i + 2] = [size]
+                del self.bounds[i]
+            else:
+                i += 1
+
+    def _split_large(self):
+        """(ShardedMultiSet) -> NoneType
+        Split every shard with more than max_shard elements until none is
+        left, or only ones holding a single key.
+        """
+        i = 0
+        while i < len(self.shards):
+            if self.sizes[i] > self.max_shard and self._split(i):
+                continue
+            i += 1
+
+    def _split(self, i):
+        """(ShardedMultiSet, int) -> bool
+        Split the shard i in two at the key of its median element, and return
+        whether it could be split, which it cannot if it holds one key only.
+        Both halves stay in the worker of the shard.
+        """
+        worker = self._worker(i)
+        ids = [self.pool._new_id(worker), self.pool._new_id(worker)]
+        split = self._call(self.shards[i], _split_shard, self.shards[i],
+                           ids, self.options)
+        if split is None:
+            return False
+
+        bound, sizes = split
+        self.shards[i:i + 1] = ids
+        self.sizes[i:i + 1] = sizes
+        self.bounds.insert(i, bound)
+        return True
+
+    def count_many(self, elems):
+        """(ShardedMultiSet, iterable) -> list of int
+        Return the number of occurrences of every element of elems, in the
+        order of elems. Every shard counts its own elements in its worker.
+        """
+        elems = list(elems)
+        groups = {}
+        for pos, elem in enumerate(elems):
+            groups.setdefault(self._shard_of(elem), []).append(pos)
+
+        order = sorted(groups)
+        results = self._gather((self.shards[i], _ask, self.shards[i],
+                                'count_many',
+                                [elems[pos] for pos in groups[i]])
+                               for i in order)
+        counts = [0] * len(elems)
+        for i, result in zip(order, results):
+            for pos, count in zip(groups[i], result):
+                counts[pos] = count
+        return counts
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(ShardedMultiSet, object, object, (bool, bool)) -> int
+        Return the number of occurrences of the elements from lo to hi, with
+        the bounds as in MultiSet.irange.
+        """
+        return self.count_ranges([(lo, hi)], inclusive)[0]
+
+    def count_ranges(self, ranges, inclusive=(True, True)):
+        """(ShardedMultiSet, iterable of (object, object), (bool, bool))
+        -> list of int
+        Return count_range(lo, hi, inclusive) for every (lo, hi) pair of
+        ranges, in order. Only the shards where a range starts or ends count
+        in their workers; the ones in between count as a whole.
+        """
+        ranges = list(ranges)
+        totals = [0] * len(ranges)
+        groups = {}
+        for pos, (lo, hi) in enumerate(ranges):
+            first = 0 if lo is None else self._shard_of(lo)
+            last = len(self.shards) - 1 if hi is None else self._shard_of(hi)
+            for i in range(first + 1, last):
+                totals[pos] += self.sizes[i]
+            for i in set((first, last)):
+                if first <= i <= last:
+                    groups.setdefault(i, []).append(pos)
+
+        order = sorted(groups)
+        results = self._gather((self.shards[i], _count_ranges,
+                                self.shards[i],
+                                [ranges[pos] for pos in groups[i]],
+                                inclusive)
+                               for i in order)
+        for i, result in zip(order, results):
+            for pos, count in zip(groups[i], result):
+                totals[pos] += count
+        return totals
+
+    def _parts(self, other):
+        """(ShardedMultiSet, ShardedMultiSet or MultiSet) -> list
+        Return the elements of other split by the bounds of this
+        ShardedMultiSet. For every shard the part is the id of the shard of
+        other with the same range in the same worker if there is one, or
+        else a list of sorted (key, element, count) triples.
+        """
+        if isinstance(other, MultiSet):
+            runs = other._keyed_runs()
+        elif other.pool is self.pool and other.bounds == self.bounds:
+            return [other.shards[i] if other._worker(i) == self._worker(i)
+                    else other._fetch(i) for i in range(len(self.shards))]
+        else:
+            runs = chain.from_iterable(other._fetch(i)
+                                       for i in range(len(other.shards)))
+
+        parts = [[] for i in range(len(self.bounds) + 1)]
+        for run in runs:
+            parts[bisect_right(self.bounds, run[0])].append(run)
+        return parts
+
+    def _combine(self, other, op):
+        """(ShardedMultiSet, ShardedMultiSet, function) -> ShardedMultiSet
+        Return the ShardedMultiSet holding op(shard, part) for every shard of
+        this ShardedMultiSet and the part of other in its range, computed in
+        the worker of the shard.
+        """
+        new_set = ShardedMultiSet(self.pool, self.max_shard, **self.options)
+        ids = [self.pool._new_id(self._worker(i))
+               for i in range(len(self.shards))]
+        sizes = new_set._gather((new_id, _combine, op, shard_id, part, new_id,
+                                 self.options)
+                                for new_id, shard_id, part
+                                in zip(ids, self.shards, self._parts(other)))
+        new_set._replace(list(self.bounds), ids, sizes)
+        new_set._split_large()
+        return new_set
+
+    def union(self, other):
+        """(ShardedMultiSet, ShardedMultiSet) -> ShardedMultiSet
+        Return the multiset union of this ShardedMultiSet and other.
+        """
+        return self._combine(other, operator.add)
+
+    def intersection(self, other):
+        """(ShardedMultiSet, ShardedMultiSet) -> ShardedMultiSet
+        Return the multiset intersection of this ShardedMultiSet and other.
+        """
+        return self._combine(other, operator.and_)
+
+    def difference(self, other):
+        """(ShardedMultiSet, ShardedMultiSet) -> ShardedMultiSet
+        Return the multiset difference between this ShardedMultiSet and
+        other.
+        """
+        return self._combine(other, operator.sub)
+
+    __add__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+
+def _release(pool, shards):
+    """(ShardPool, list of int) -> NoneType
+    Drop the shards with the ids shards from pool, unless it is shut down.
+    """
+    for shard_id in shards:
+        try:
+            pool._submit(shard_id, _drop, shard_id)
+        except RuntimeError:
+            return
+
+
+def _from_runs(runs, options):
+    """(iterable of (object, object, int), dict) -> MultiSet
+    Return a new MultiSet made with options, holding the elements of the
+    (key, element, count) triples runs, which are sorted by key.
+    """
+    new_set = MultiSet(**options)
+    new_set._load_runs(((e, count) for k, e, count in runs), False)
+    return new_set
+
+
+# The functions below run in the worker processes, on the shards of their
+# registry.
+
+def _start_worker():
+    """(NoneType) -> NoneType
+    Empty the registry of a new worker, which may have been forked with the
+    shards of its parent.
+    """
+    _registry.clear()
+
+
+def _build_shard(shard_id, items, options):
+    """(int, list, dict) -> int
+    Keep a new MultiSet made with options, holding the elements of items, as
+    the shard shard_id, and return its size.
+    """
+    _registry[shard_id] = MultiSet.from_iterable(items, **options)
+    return len(_registry[shard_id])
+
+
+def _drop(shard_id):
+    """(int) -> NoneType
+    Forget the shard shard_id.
+    """
+    _registry.pop(shard_id, None)
+
+
+def _ask(shard_id, method, *args):
+    """(int, str, object) -> object
+    Return the result of the method of the shard shard_id called with args.
+    """
+    return getattr(_registry[shard_id], method)(*args)
+
+
+def _change(shard_id, method, *args):
+    """(int, str, object) -> int
+    Call the method of the shard shard_id with args, and return the size of
+    the shard afterwards.
+    """
+    getattr(_registry[shard_id], method)(*args)
+    return len(_registry[shard_id])
+
+
+def _keyed_runs(shard_id):
+    """(int) -> list of (object, object, int)
+    Return the sorted (key, element, count) triples of the shard shard_id.
+    """
+    return list(_registry[shard_id]._keyed_runs())
+
+
+def _count_ranges(shard_id, ranges, inclusive):
+    """(int, list of (object, object), (bool, bool)) -> list of int
+    Return count_range(lo, hi, inclusive) of the shard shard_id for every
+    pair of ranges.
+    """
+    shard = _registry[shard_id]
+    return [shard.count_range(lo, hi, inclusive) for lo, hi in ranges]
+
+
+def _split_shard(shard_id, ids, options):
+    """(int, list of int, dict) -> (object, list of int) or NoneType
+    Split the shard shard_id in two at the key of its median element, keep
+    the halves, made with options, as the shards with the two ids of ids,
+    and return the key where the second one starts and the sizes of both.
+    Return None if the shard holds one key only.
+    """
+    runs = list(_registry[shard_id]._keyed_runs())
+    if len(runs) < 2:
+        return None
+
+    # Every run that fits in the first half goes left, and at least one.
+    total = len(_registry[shard_id])
+    j = 1
+    size = runs[0][2]
+    while j < len(runs) - 1 and 2 * (size + runs[j][2]) <= total:
+        size += runs[j][2]
+        j += 1
+
+    _registry[ids[0]] = _from_runs(runs[:j], options)
+    _registry[ids[1]] = _from_runs(runs[j:], options)
+    del _registry[shard_id]
+    return runs[j][0], [size, total - size]
+
+
+def _combine(op, shard_id, part, new_id, options):
+    """(function, int, int or list, int, dict) -> int
+    Keep op(shard, part) as the shard new_id, where shard is the shard
+    shard_id and part either the id of a shard in this worker or a list of
+    (key, element, count) triples, built with options first. Return the
+    size of the new shard.
+    """
+    if isinstance(part, list):
+        part = _from_runs(part, options)
+    else:
+        part = _registry[part]
+    _registry[new_id] = op(_registry[shard_id], part)
+    return len(_registry[new_id])
@@ -3,12 +3,25 @@ c2yaozhi, c2shenfu, c2chenro
 
 Authors: Zhiyang Yao, Fujun Shen, Rongyao Chen
 """
+import math
 import random
+import struct
+import sys
+import threading
+import warnings
+import weakref
+from itertools import groupby
+from operator import itemgetter
+from time import perf_counter
 
 
 class TailNode(object):
     """ A TailNode object.
     """
+
+    # Nodes are created once per level of every element, so they keep their
+    # attributes in slots instead of a per-instance __dict__.
+    __slots__ = ('down', 'skip')
     
     def __init__(self, down=None):
         """(TailNode) -> NoneType
@@ -17,8 +30,6 @@ class TailNode(object):
         
         self.down = down
         self.skip = 0
-        self.index = None  # initialize tailnode's index, which is only for
-                           # the bottom level
 
     def __repr__(self):
         """(TailNode) -> str
@@ -31,6 +42,8 @@ class TailNode(object):
 class HeadNode(TailNode):
     """ A HeadNode object used in SkipList.
     """
+
+    __slots__ = ('link',)
     
     def __init__(self, link=None, down=None):
         """(HeadNode) -> NoneType
@@ -40,7 +53,6 @@ class HeadNode(TailNode):
         TailNode.__init__(self, down)
         self.link = TailNode()
         self.skip = None 
-        self.index = None
         
     def __repr__(self):
         """(HeadNode) -> str
@@ -156,6 +168,10 @@ class HeadNode(TailNode):
 class ElementNode(object):
     """ An Element Node in SkipList
     """
+
+    __slots__ = ('data', 'link', 'down', 'skip')
+
+    count = 1  # The number of occurrences of data held by this node.
     
     def __init__(self, data, link=None, down=None):
         """(ElementNode, object, ElementNode, ElementNode) -> NoneType
@@ -166,8 +182,6 @@ class ElementNode(object):
         self.link = link
         self.down = down
         self.skip = None  # The Initial Skip value is None
-        self.index = None  # initialize tailnode's index, which is only for
-                           # the bottom level
         
     def __repr__(self):
         """(ElementNode) -> str
@@ -194,415 +208,2364 @@ class ElementNode(object):
         
         return self.data == other.data
 
+    @property
+    def value(self):
+        """(ElementNode) -> object
+        Return the item this node stands for. Only the bottom node of a tower
+        in a SkipList with a key function keeps the item apart from its key,
+        which is the data.
+        """
+
+        return self.data
+
+
+class KeyedNode(ElementNode):
+    """ The bottom ElementNode of a tower in a SkipList with a key function.
+    Its data is the key of its value.
+    """
+
+    __slots__ = ('value',)
+
+
+class CountedNode(ElementNode):
+    """ The bottom ElementNode of a tower in a CountedSkipList, standing for
+    count occurrences of its data.
+    """
+
+    __slots__ = ('count',)
+
+    def __init__(self, data, link=None, down=None):
+        """(CountedNode, object, ElementNode, ElementNode) -> NoneType
+        Initialize this node to hold one occurrence of data.
+        """
+
+        ElementNode.__init__(self, data, link, down)
+        self.count = 1
+
+
+class KeyedCountedNode(CountedNode):
+    """ The bottom CountedNode of a tower in a CountedSkipList with a key
+    function. Its data is the key of its value.
+    """
+
+    __slots__ = ('value',)
+
 
 class SkipList(object):
     """ A Skiplist object
     """
+
+    _node = ElementNode  # The class of the bottom node of every tower.
+    _keyed_node = KeyedNode  # The same, when there is a key function.
+    _after_equal = True  # New items go after the items equal to them, so
+                         # items with equal keys keep the order they came in.
+    concurrent = False
+    frozen = False
+    _shared = False  # True while the nodes are those of another SkipList,
+                     # as a snapshot of it sees them.
+    _history = None  # The _History kept for the snapshots of this SkipList.
+    _tail_preds = None  # The last node of every level, once looked up.
+    _bottom = None  # The bottom HeadNode, once looked up.
+    stats = None  # The SkipStats of this SkipList, once enable_stats is on.
     
-    def __init__(self):
-        """(SkipList) -> NoneType
-        Initialize a skip list.
+    def __init__(self, p=0.5, max_level=None, rng=None, key=None, 
+                 concurrent=False, compact_ratio=None, memory_budget=None,
+                 budget_action='raise'):
+        """(SkipList, float, int, random.Random or int, function, bool, 
+        float, int, str) -> NoneType
+        Initialize a skip list. Every tower reaches one more level with
+        probability p, up to max_level levels. Without max_level, towers are
+        kept to about log base 1/p of the size of the list. Levels are drawn
+        from rng, or from a private random.Random seeded with rng if it is an
+        int or None.
+
+        If key is given, items are ordered by key(item) instead of by the
+        items themselves, and items with equal keys count as equal. Every key
+        is computed once, when its item is inserted, and kept in the nodes.
+
+        If concurrent is True, the SkipList can be shared between threads:
+        writers take turns, and readers never wait for them (see 
+        _ConcurrentSkipList).
+
+        If compact_ratio is given, which needs a CountedSkipList, removing
+        the last occurrence of an item leaves its tower in place with a count
+        of 0, so inserting the item again is cheap. Such dead towers take no
+        position, and are all dropped at once by compact(), which runs by
+        itself when there are more than compact_ratio dead towers per item.
+
+        If memory_budget is given, linking a tower that would take the nodes
+        of the SkipList over memory_budget bytes, as counted by memory_usage,
+        raises MemoryError, or only warns with a RuntimeWarning if 
+        budget_action is 'warn'.
         """
         
+        if not 0 < p < 1:
+            raise ValueError("p must be between 0 and 1")
+        if max_level is not None and max_level < 1:
+            raise ValueError("max_level must be at least 1")
+
         self.head = HeadNode()
         self.head.link = None  # The HeadNode at the top of the SkipList has 
                                # no TailNode.
         self.size = 0
-        
+        self.p = p
+        self.max_level = max_level
+        if rng is None or isinstance(rng, int):
+            rng = random.Random(rng)
+        self.rng = rng
+        self.key = key
+        if key is not None:
+            self._node = self._keyed_node
+        if compact_ratio is not None:
+            if not issubclass(self._node, CountedNode):
+                raise ValueError("compact_ratio needs a CountedSkipList")
+            if compact_ratio <= 0:
+                raise ValueError("compact_ratio must be positive")
+        self.compact_ratio = compact_ratio
+        self.dead = 0  # The number of dead towers.
+        if budget_action not in ('raise', 'warn'):
+            raise ValueError("budget_action must be 'raise' or 'warn'")
+        self.memory_budget = memory_budget
+        self.budget_action = budget_action
+        self._level_sizes = []  # The number of nodes of every level, bottom
+                                # first.
+        if concurrent:
+            self.__class__ = _concurrent_class(type(self))
+            self._lock = threading.Lock()
+            self._version = 0
+            self._writer = None  # The thread holding the lock to write.
+
+    def _key_of(self, item):
+        """(SkipList, object) -> object
+        Return the key that orders item in this SkipList.
+        """
+
+        if self.key is None:
+            return item
+        return self.key(item)
+
+    def _options(self):
+        """(SkipList) -> dict
+        Return the keyword arguments that make a new SkipList draw its levels
+        and order its items like this one.
+        """
+
+        return {'p': self.p, 'max_level': self.max_level, 'rng': self.rng,
+                'key': self.key, 'concurrent': self.concurrent,
+                'compact_ratio': self.compact_ratio,
+                'memory_budget': self.memory_budget,
+                'budget_action': self.budget_action}
+
+    def _random_level(self, size=None):
+        """(SkipList, int) -> int
+        Return the number of levels of a new tower in this SkipList, when it
+        holds size items (its current size by default).
+        """
+
+        cap = self.max_level
+        if cap is None:
+            if size is None:
+                size = self.size
+            cap = int(math.log(size + 1) / -math.log(self.p)) + 2
+
+        return random_level(self.p, cap, self.rng)
+
+    @classmethod
+    def from_sorted(cls, items, balanced=False, **options):
+        """(type, iterable, bool) -> SkipList
+        Return a new SkipList holding every item of items, which must already
+        be in non-decreasing order. Every level and every skip value is built
+        in a single pass. If balanced is True, the item at position i (from 1)
+        gets one level more than the number of times 2 divides i, so the same
+        items always give the same layout; otherwise levels are random.
+        Any options are passed on to the SkipList constructor.
+        """
+
+        runs = keyed_runs(((item, 1) for item in items), options.get('key'))
+        return cls._from_runs(runs, balanced, **options)
+
+    @classmethod
+    def _from_runs(cls, runs, balanced=False, **options):
+        """(type, iterable of (object, object, int), bool) -> SkipList
+        Return a new SkipList built in one pass from (key, item, count)
+        triples sorted by key. Every triple becomes count occurrences of item,
+        each in its own tower unless the bottom nodes can hold a count.
+        """
+
+        loader = cls._loader(balanced, **options)
+        loader.extend(runs)
+        return loader.finish()
+
+    @classmethod
+    def _loader(cls, balanced=False, **options):
+        """(type, bool) -> _Loader
+        Return a _Loader that builds a new SkipList made with options like
+        _from_runs does, from triples given in any number of batches.
+        """
+
+        return _Loader(cls(**options), balanced)
+
     def insert(self, item):
         """(SkipList, object) -> NoneType
         Insert the item into this skip list. 
         """
-            
-        new_node = ElementNode(item)
-        level = random_level()
-        
-        # First time of inserting item into the SkipList.
-        
-        if self.head.down is None:
-            self.head.down = make_head(HeadNode(), level)
-            for head in self:
-                head.add(item)
-            
-        else:
-        # Case 1 
-        # The newly inserted node has levels less or equal to the number 
-        # of original levels
-            
-            if level <= self.get_level():
-                differ = self.get_level() - level 
-                count = 0
-                
-                if differ == 0:  # If levels are the same.
-                    temp = self.head
-                    for head in self:
-                        head.add(item)
-                        
-                elif differ != 0:
-                    temp = self.head.down
-                    while count < differ:
-                        count += 1
-                        temp = temp.down
-                    i = 0
-                    while i < level:
-                        i += 1
-                        temp.add(item)
-                        temp = temp.down
-                        
-            # Case 2
-            elif level > self.get_level():
-                differ = level - self.get_level()  # of levels need to create.
-                old = self.head.down
-                self.head.down = make_head(HeadNode(), differ)  # Make levels.
-                temp = self.head 
-                while temp.down is not None:
-                    temp = temp.down 
-                    
-                temp.add_down(old)  # Connect the old HeadNode 
-                                    # to the new HeadNode.
-                
-                for head in self:
-                    head.add(item)
-            
-        self.connect_down()
-        self.fix_skip()
-        set_index(self.head.down)
+
+        if self._shared:
+            self._unshare()
+
+        key = self._key_of(item)
+        preds, ranks = self._search_path(key, self._after_equal)
+        self._insert_at(key, preds, ranks, item)
+
+    def insert_many(self, items):
+        """(SkipList, iterable) -> NoneType
+        Insert every item of items into this skip list. The items are sorted
+        first, so every search starts from the path of the previous item.
+        """
+
+        self._insert_sorted(self._sorted_keys(items))
+
+    def _insert_sorted(self, pairs):
+        """(SkipList, list of (object, object)) -> NoneType
+        Insert the item of every (key, item) pair of pairs, which are sorted
+        by key, into this skip list.
+        """
+
+        if self._shared:
+            self._unshare()
+
+        preds, ranks = self._bound_path(None, False, False)
+        for key, item in pairs:
+            self._finger(key, preds, ranks, self._after_equal)
+            self._insert_at(key, preds, ranks, item)
+
+    def _sorted_keys(self, items):
+        """(SkipList, iterable) -> list of (object, object)
+        Return (key, item) for every item of items, sorted by key.
+        """
+
+        if self.key is None:
+            return [(item, item) for item in sorted(items)]
+        return sorted(((self.key(item), item) for item in items), 
+                      key=itemgetter(0))
+
+    def _insert_at(self, key, preds, ranks, item):
+        """(SkipList, object, list of TailNode, list of int, object) 
+        -> NoneType
+        Insert the item, whose key is key, into this skip list, given its
+        search path.
+        """
+
+        self._link(key, preds, ranks, item)
         self.size += 1
 
-    def connect_down(self):
-        """(SkipList) -> NoneType
-        Connects all the elements in this SkipList together.
+    def _link(self, key, preds, ranks, item):
+        """(SkipList, object, list of TailNode, list of int, object) -> int
+        Link a new tower for one occurrence of item, whose key is key, right
+        after the predecessors preds found at positions ranks by 
+        _search_path, and return its number of levels. New HeadNodes are
+        added to the front of preds and ranks.
         """
-        
-        temp_down = self.head.down
-        c = True
-        #set 2 temps into current level and next level
-        while temp_down.down and c:
-            temp_1_right = temp_down.link
-            temp_2_right = temp_down.down.link
-            
-            b = True
-            #go through every node in upper level
-            while temp_1_right and b:
-                
-                a = True
-
-                #if equal to tailnode, then looking for tailnode in lower level
-                #connct them
-                if type(temp_1_right) == TailNode:
-                    while temp_2_right and a:
-                        if type(temp_2_right) == TailNode:
-                            temp_1_right.down = temp_2_right
-                            a = False
-                        else:
-                            temp_2_right = temp_2_right.link
-
-                #connct other nodes except tailnodes                        
-                else:
-                    while temp_2_right and a:
-                        if type(temp_2_right) != TailNode:
-                            if temp_2_right == temp_1_right:
-                                temp_1_right.down = temp_2_right
-                                a = False  # exit while loop
-                            else:
-                                temp_2_right = temp_2_right.link
-                                
-                    #when connected one node, then move to the next node in
-                    #lower level
-                    temp_2_right = temp_2_right.link
-
-                #stoped the upper level while loop, or move one node forward
-                if type(temp_1_right) != TailNode:    
-                    temp_1_right = temp_1_right.link
-                else:
-                    b = False
-                    
-            #stpped the headnode while loop, or move one headnode downward
-            if temp_down.down.down: 
-                temp_down = temp_down.down
-                
+
+        level = self._random_level()
+        if self.memory_budget is not None:
+            self._check_budget(self._tower_bytes(level))
+        new = self._grow(level)
+        preds[:0] = new
+        ranks[:0] = [0] * len(new)
+        height = len(preds)
+        tails = self._tail_preds
+        if tails is not None and new:
+            tails[:0] = new  # A new level is empty so far.
+        pos = ranks[-1] + 1  # The position the new item takes on the bottom.
+
+        # Splice a tower of ElementNodes right after the predecessors of the
+        # lowest "level" levels. The tower is built from the bottom up, so
+        # every down pointer is set before the node is linked in. Only the
+        # skip values of the nodes on the search path change.
+
+        save = self._saver()
+        if save is not None:
+            for pred in preds:
+                save(pred)
+
+        sizes = self._level_sizes
+        bottom = ranks[-1]
+        below = None
+        for i in range(height - 1, height - level - 1, -1):
+            pred = preds[i]
+            if below is None:
+                node = self._node(key, pred.link)
+                if self.key is not None:
+                    node.value = item
             else:
-                c = False
+                node = ElementNode(key, pred.link, below)
+            node.skip = ranks[i] + pred.skip - bottom
+            pred.link = node
+            pred.skip = pos - ranks[i]
+            sizes[height - 1 - i] += 1
+            below = node
+            if tails is not None and type(node.link) == TailNode:
+                tails[i] = node
 
-    def remove(self, item):
-        """(SKipList, object) -> NoneType
-        Remove the item from this SkipList, if it exists. 
+        # Above the tower, the predecessors only skip one more position.
+        for i in range(height - level):
+            preds[i].skip += 1
+
+        return level
+
+    def _grow(self, level):
+        """(SkipList, int) -> list of HeadNode
+        Make sure this SkipList has at least level levels. The new HeadNodes
+        are put on top of the old ones, and are returned from the top down.
         """
-        
-        for head in self:
-            head.delete(item)
-            
-        self.fix_skip() 
-        set_index(self.head.down)  # reset skip number and index number after
-                                   # removing one node
-        self.size -= 1
 
-    def fix_skip(self):
-        """(SkipList) -> NoneType
-        Modify the skip value for all the nodes in this SkipList.
+        height = len(self._level_sizes)  # Kept up to date, unlike a walk.
+        if level <= height:
+            return []
+
+        top = make_head(HeadNode(), level - height)
+        self._level_sizes.extend([0] * (level - height))
+        new = [top]
+        temp = top
+        while True:
+            temp.skip = self.size + 1  # An empty level skips to the TailNode.
+            if not temp.down:
+                break
+            temp.link.down = temp.down.link
+            temp = temp.down
+            new.append(temp)
+
+        # Connect the old top HeadNode (and its TailNode) under the new ones.
+        old = self.head.down
+        if old is not None:
+            temp.add_down(old)
+            tail = old.link
+            while type(tail) != TailNode:
+                tail = tail.link
+            temp.link.down = tail
+
+        save = self._saver()
+        if save is not None:
+            save(self.head)
+        self.head.down = top
+        return new
+
+    def _search_path(self, item, right=False):
+        """(SkipList, object, bool) -> (list of TailNode, list of int)
+        Return the predecessor of item on every level, from the top level to
+        the bottom level, together with the position of each predecessor on
+        the bottom level. HeadNodes have position 0, and every bottom node
+        takes as many positions as its count. If right is True, the 
+        predecessors are the last nodes not greater than item instead of the
+        last nodes less than item.
         """
-        
+
+        preds = []
+        ranks = []
+        pos = 0
         temp = self.head.down
-        
-        while temp and temp is not None:
-            if type(temp.link) == TailNode:
-                temp.skip = set_skip_helper(temp, TailNode())
+
+        # Every link is read once: this loop is the cost of most operations.
+        while temp:
+            link = temp.link
+            if right:
+                while type(link) != TailNode and not item < link.data:
+                    pos += temp.skip
+                    temp = link
+                    link = temp.link
 
             else:
-                temp2 = temp  # Travel through the levels.
-                while temp2 and type(temp2) != TailNode:
-                    if type(temp2.link) != TailNode:
-                        data = temp2.link.data
-                        temp2.skip = set_skip_helper(temp2, data)
+                while type(link) != TailNode and link.data < item:
+                    pos += temp.skip
+                    temp = link
+                    link = temp.link
+            preds.append(temp)
+            ranks.append(pos)
+            temp = temp.down
 
-                    else:
-                        temp2.skip = set_skip_helper(temp2, TailNode())
+        return preds, ranks
 
-                    temp2 = temp2.link
+    def _finger(self, item, preds, ranks, right=False):
+        """(SkipList, object, list of TailNode, list of int, bool) -> NoneType
+        Move the search path preds, ranks of an item not greater than item 
+        forward, in place, so it becomes _search_path(item, right).
+        """
 
-            temp = temp.down  # Travel down the levels.
+        # Climb while the level has to move forward: if a level can stay, so
+        # can every level above it. Then search down from there.
 
-    def search(self, item):
-        """(SkipList, object) -> bool
-        Return True if the item is in this SkipList.
+        if not preds:  # An empty SkipList has no path to move.
+            return
+
+        i = len(preds) - 1
+        while (i > 0 and type(preds[i].link) != TailNode and 
+               (not item < preds[i].link.data if right else 
+                preds[i].link.data < item)):
+            i -= 1
+
+        temp = preds[i]
+        pos = ranks[i]
+        while temp:
+            while (type(temp.link) != TailNode and 
+                   (not item < temp.link.data if right else
+                    temp.link.data < item)):
+                pos += temp.skip
+                temp = temp.link
+            preds[i] = temp
+            ranks[i] = pos
+            i += 1
+            temp = temp.down
+
+    def _bound_path(self, bound, right, end):
+        """(SkipList, object, bool, bool) -> (list of TailNode, list of int)
+        Return _search_path(bound, right), or if bound is None, the path to
+        the last node of every level if end is True, or to the HeadNodes.
         """
-        
+
+        if bound is not None:
+            return self._search_path(bound, right)
+
+        preds = []
+        ranks = []
+        pos = 0
         temp = self.head.down
-        
-        if not temp:  # Return False if the SkipList is empty
-            return False
-        
-        while type(temp.link) == TailNode:  # Travel down the SkipList until 
-                                            # reaches a non-empty level.
-            if not temp.down: 
-                return False
-            
-            else:
-                temp = temp.down
-        
-        if temp.link.data == item: 
-            return True
-        
-        else:
-            # Go down each level if the value in the first element node in 
-            # each level is greater than the item.
-            
-            while temp.link.data > item:                
-                if temp.down:
-                    temp = temp.down
-                    
-                else:
-                    return False
-            
-            pre = find(temp, item)  # The predecessor of the item.
-            
-            while type(pre) != bool:
-                if pre.down:
-                    pre = find(pre.down, item)
-                
-                # The following is the situation where the predecessor is at 
-                # the bottom level of the skiplist, where the predecessor node
-                # has no other ElementNode connected down.
-                
-                elif pre.link and pre.down is None:
-                    temp = pre
-                    
-                    while type(temp) != TailNode:
-                        if temp.data == item:
-                            return True
-                        temp = temp.link
-                            
-                    return False
-                
-            return True
-          
-    def __len__(self):
-        """(SkipList) -> int
-        Return the length of the bottom level of this SkipList.
+
+        while temp:
+            while end and type(temp.link) != TailNode:
+                pos += temp.skip
+                temp = temp.link
+            preds.append(temp)
+            ranks.append(pos)
+            temp = temp.down
+
+        return preds, ranks
+
+    def irange(self, lo=None, hi=None, inclusive=(True, True)):
+        """(SkipList, object, object, (bool, bool)) -> generator
+        Yield the items of this SkipList from lo to hi in sorted order. A 
+        bound of None is unlimited, and inclusive tells whether items equal
+        to lo and to hi are included.
         """
-        
-        return self.size
-      
-    def get_level(self):
-        """(SkipList) -> int
-        Return the number of levels this skiplist currently has.
+
+        lo, hi = self._bound_keys(lo, hi)
+        preds, ranks = self._bound_path(lo, not inclusive[0], False)
+        if not preds:
+            return
+
+        temp = preds[-1].link
+        while type(temp) != TailNode:
+            if hi is not None and (hi < temp.data or 
+                                   (not inclusive[1] and temp.data == hi)):
+                return
+
+            for i in range(temp.count):
+                yield temp.value
+            temp = temp.link
+
+    def _bound_keys(self, lo, hi):
+        """(SkipList, object, object) -> (object, object)
+        Return the keys of the range bounds lo and hi, keeping None as is.
         """
-        
-        return get_level_helper(self.head)
-    
-    def __getitem__(self, item):
-        """(SkipList, object) -> object or NoneType
-        Return the item in this SkipList given its index. 
+
+        if self.key is None:
+            return lo, hi
+        return (None if lo is None else self.key(lo), 
+                None if hi is None else self.key(hi))
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(SkipList, object, object, (bool, bool)) -> int
+        Return the number of items of this SkipList from lo to hi, with the
+        bounds as in irange.
         """
-        
-        temp = self.head.down
-        max_index = get_max_index(self)
 
-        #if item's index is not in range of skiplist's index, then do nothing
-        if item >= max_index or item <= -1:
-            return None
-    
-        while temp:
-            index = get_index(temp)
-            #if sum of index and skip greater than item, then going down
-            if index + (temp.skip) > item:
-                temp = temp.down
+        lo, hi = self._bound_keys(lo, hi)
+        start = self._bound_path(lo, not inclusive[0], False)[1]
+        stop = self._bound_path(hi, inclusive[1], True)[1]
+        if not start:
+            return 0
 
-            #if sum of index and skip smaller than item, then going right
-            elif index + (temp.skip) < item:
+        return max(stop[-1] - start[-1], 0)
+
+    def delete_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(SkipList, object, object, (bool, bool)) -> int
+        Remove every item of this SkipList from lo to hi, with the bounds as
+        in irange, and return the number of items removed.
+        """
+
+        if self._shared:
+            self._unshare()
+
+        lo, hi = self._bound_keys(lo, hi)
+        preds, ranks = self._bound_path(lo, not inclusive[0], False)
+        lasts, last_ranks = self._bound_path(hi, inclusive[1], True)
+        if not preds or last_ranks[-1] <= ranks[-1]:
+            return 0
+
+        # On every level the nodes after the predecessor of lo, up to the last
+        # node in range, are cut out in one splice. Where no node of the 
+        # level is in range, last is the predecessor itself.
+
+        removed = last_ranks[-1] - ranks[-1]
+        height = len(preds)
+        for i in range(height):
+            # The nodes cut out are counted, and so are the dead towers among
+            # them, which take no position. Freeing them takes as long anyway.
+            temp = preds[i]
+            while temp is not lasts[i]:
                 temp = temp.link
+                self._level_sizes[height - 1 - i] -= 1
+                if i == height - 1 and not temp.count:
+                    self.dead -= 1
 
-            #if sum of index and skip equal to item, then return next node
-            elif index + (temp.skip) == item:
-                
-                return temp.link.data
-   
-    def __contains__(self, item):
-        """(SkipList, item) -> bool
-        Return True if this skiplist contains the item.
+        save = self._saver()
+        for i in range(len(preds)):
+            pred = preds[i]
+            last = lasts[i]
+            if save is not None:
+                save(pred)
+            pred.skip = last_ranks[i] + last.skip - ranks[i] - removed
+            pred.link = last.link
+
+        self._tail_preds = None
+        self.size -= removed
+        self._tidy()
+        return removed
+
+    def remove(self, item):
+        """(SKipList, object) -> NoneType
+        Remove the item from this SkipList, if it exists. 
         """
         
-        return self.search(item) 
+        if self._shared:
+            self._unshare()
 
-    def __str__(self):
-        """(SkipList) -> str
-        Print the SkipList
+        key = self._key_of(item)
+        preds, ranks = self._search_path(key)
+        self._remove_at(key, preds)
+        self._tidy()
+
+    def remove_many(self, items):
+        """(SkipList, iterable) -> NoneType
+        Remove one occurrence of every item of items from this SkipList, if
+        it exists. The items are sorted first, so every search starts from
+        the path of the previous item.
         """
-        
-        s = '' 
-        temp = self.head.down
-        while temp:
-            if not temp.down:  # If at the bottom level, no new line is made.
-                s += str(temp)  
 
-            else:
-                s += str(temp) + '\n'
+        if self._shared:
+            self._unshare()
 
-            temp = temp.down
+        preds, ranks = self._bound_path(None, False, False)
+        for key, item in self._sorted_keys(items):
+            self._finger(key, preds, ranks)
+            self._remove_at(key, preds)
+        self._tidy()
 
-        return s               
-            
-    def __iter__(self):
-        """(SkipList) -> _SkipIter
-        Return an iterator object over this skip list. 
-        The iterator iterate through the HeadNodes.
+    def _remove_at(self, key, preds):
+        """(SkipList, object, list of TailNode) -> NoneType
+        Remove an item with key key from this SkipList if it exists, given
+        the predecessors on its search path.
         """
-        
-        return _SkipIter(self.head)
 
-    
-def make_head(root, count):
-    """ (HeadNode, int) -> HeadNode
-    Return number "count" of HeadNodes linked together. 
-    """
-    
-    # Return a series of HeadNodes linked together.
-    # Use of Recursion
-    
-    if root and count == 1:
-        return root 
-    
-    if not root and count == 1:
-        root = HeadNode()
-        
-    else:
-        root = HeadNode()
-        root.down = make_head(root.down, count - 1)
-        
-    return root 
-        
+        if not preds:
+            return
 
-def random_level():
-    """(NoneType) -> int
-    Keep generating a new number between 0 and 1, until the number is strictly
-    greater than 0.5. Return the number of times the number generated is less 
-    than 0.5.
-    """
-    
-    p = 0.5
-    count = 1
-    r = random.random()  # Generate a radom number between 0 and 1.
-    while r < p:
-        count += 1
-        r = random.random()
-        
-    return count  # Return number of times which the random number is strictly 
-                  # less than 0.5, which becomes the levels. 
+        target = preds[-1].link
+        if type(target) == TailNode or target.data != key:
+            return
 
-                  
-def set_skip_helper(root, item):
-    """(object, object or int) -> int
-    Return the distance between root and the item, which is a node within 
-    the SkipList.
-    """
-    
-    count = 1
-    temp = root
+        self._unlink(preds, target.count)
+        self.size -= target.count
 
-    #going to the bottom level
-    while temp.down:
-        temp = temp.down
+    def _unlink(self, preds, weight):
+        """(SkipList, list of TailNode, int) -> int
+        Unlink the tower of the bottom node right after preds[-1], which
+        takes weight positions on the bottom level, and return its number of
+        levels.
+        """
 
-    #if item's link is tailnode, then return 1
-    if type(temp.link) == TailNode:
-        return count
+        # Walk up from the bottom level. The node above only belongs to the
+        # same tower if its down pointer is the node unlinked just below it,
+        # since other occurrences of item may have taller towers.
 
-    #find root and item distance in bottom level
-    elif type(item) == TailNode:
-        while type(temp.link) != TailNode:
-            count += 1
-            temp = temp.link
-            
-        return count
+        save = self._saver()
+        below = None
+        in_tower = True
+        level = 0
+        tails = self._tail_preds
+        for i in range(len(preds) - 1, -1, -1):
+            pred = preds[i]
+            if save is not None:
+                save(pred)
+            node = pred.link
+            if in_tower and type(node) != TailNode and node.down is below:
+                pred.link = node.link
+                pred.skip += node.skip - weight
+                below = node
+                level += 1
+                self._level_sizes[level - 1] -= 1
+                if tails is not None and type(node.link) == TailNode:
+                    tails[i] = pred
 
-    else:
-        while type(temp.link) != TailNode:
-            if temp.link.data == item:
-                return count
-            
             else:
-                count += 1
-                temp = temp.link
-               
-        return count
+                pred.skip -= weight
+                in_tower = False
 
-    
-def find(root, item):
-    """(ElementNode, object) -> bool or ElementNode.
-    Return True if the root contains the item, else return the predecessor for
-    the item 
-    """
-    
-    # Suppose the string representation for a root looks like the following
-    # -> 1 -> 2 -> 3 -> 
-    # if called find(root, 2.5)
-    # The return value will be ElementNode(2, ElementNode(3, ... 
-    
-    new_node = ElementNode(item)
-    temp = root.link
-    if type(temp) != TailNode:
-        if temp is None:
-            return False
-        
-        else:
-            if type(temp.link) == TailNode:
-                if temp == new_node:
-                    return True
-                
+        return level
+
+    def copy(self):
+        """(SkipList) -> SkipList
+        Return a copy of this SkipList in constant time. The copy sees the
+        nodes of this SkipList as they are now, however this one changes 
+        afterwards, until the copy itself first changes and gets nodes of its
+        own.
+
+        Both halves of that have a cost. Until its first change, every node
+        the copy reads is looked up in the history of this SkipList, so its
+        searches are about ten times slower than on this one. Its first 
+        change then rebuilds all of its nodes, which takes time linear in
+        its size inside that one insert or remove; a skip list cannot copy
+        only the path a change takes, as every node left of it on a level
+        links to the next. Copy with from_sorted instead to pay for the
+        whole copy up front.
+        """
+
+        return self._share(self._options())
+
+    def snapshot(self):
+        """(SkipList) -> SkipList
+        Return a read-only copy of this SkipList in constant time, which
+        keeps the items this SkipList has now while it goes on changing. 
+        Every later write to this SkipList only keeps the old fields of the
+        nodes it changes for the snapshot, so it costs no more than before,
+        and the fields kept are dropped once the snapshots older than them
+        are gone. Reads of the snapshot look every node up in those fields,
+        and are about ten times slower than reads of this SkipList.
+        """
+
+        options = self._options()
+        options['concurrent'] = False  # Nothing writes to a snapshot.
+        new = self._share(options)
+        new.__class__ = _frozen_class(type(new))
+        return new
+
+    def _share(self, options):
+        """(SkipList, dict) -> SkipList
+        Return a new SkipList made with options, which sees the nodes of this
+        one as they are now. It is marked as shared, so it never changes 
+        them.
+        """
+
+        new = _user_class(type(self))(**options)
+        if self._shared:
+            # What this SkipList sees never changes, so the copy sees it too.
+            new.head = self.head
+        else:
+            if self._history is None:
+                self._history = _History()
+            new.head = _Epoch(self._history).see(self.head)
+        new.size = self.size
+        new.dead = self.dead
+        new._level_sizes = list(self._level_sizes)
+        new._shared = True
+        return new
+
+    def _saver(self):
+        """(SkipList) -> function or NoneType
+        Return the function to call with every node of this SkipList before
+        changing it, which keeps its fields for the snapshots that still see
+        it, or None if there is no such snapshot.
+        """
+
+        history = self._history
+        if history is None:
+            return None
+        if history.released:
+            history.prune()
+        if history.live:
+            return history.save
+        return None
+
+    def compact(self):
+        """(SkipList) -> NoneType
+        Drop every dead tower of this SkipList, by rebuilding it in one pass.
+        """
+
+        if self.dead:
+            self._unshare()
+
+    def _tidy(self):
+        """(SkipList) -> NoneType
+        Compact this SkipList once it has more than compact_ratio dead towers
+        per item. Removals leave the compaction to their very end, so that no
+        search path they hold goes stale.
+        """
+
+        if (self.compact_ratio is not None and 
+                self.dead > self.compact_ratio * self.size):
+            self._unshare()
+
+    def _unshare(self):
+        """(SkipList) -> NoneType
+        Give this SkipList nodes of its own, rebuilt in one pass from the
+        ones it sees, which are left as they are. Dead towers are left out.
+        """
+
+        # A copy only gets here on its first write: it cannot write to the
+        # nodes it sees, which belong to the SkipList it was copied from.
+
+        options = self._options()
+        options['concurrent'] = False
+        options['memory_budget'] = None  # The levels are drawn anew.
+        new = _user_class(type(self))._from_runs(self._runs(), **options)
+        self.head = new.head
+        self._level_sizes = new._level_sizes
+        self._tail_preds = self._bottom = None
+        self._shared = False
+        self.dead = 0
+        if self.stats is not None:
+            self.stats.heights = self._tower_heights()
+
+    def _runs(self):
+        """(SkipList) -> generator of (object, object, int)
+        Yield the key, the item and the count of every bottom node of this
+        SkipList in sorted order.
+        """
+
+        temp = self.head.down
+        if temp is None:
+            return
+
+        while temp.down:
+            temp = temp.down
+
+        temp = temp.link
+        while type(temp) != TailNode:
+            if temp.count:
+                yield temp.data, temp.value, temp.count
+            temp = temp.link
+
+    def enable_stats(self, stats=None):
+        """(SkipList, SkipStats) -> SkipStats
+        Start counting the comparisons, visited nodes and descended levels of
+        every search, the time spent searching, linking and unlinking, and
+        the heights of the towers. Counting goes on in stats if it is given.
+        Return the SkipStats used.
+        """
+
+        if self.stats is None:
+            self.__class__ = _stats_class(type(self))
+        self.stats = stats if stats is not None else SkipStats()
+        self.stats.heights = self._tower_heights()
+        return self.stats
+
+    def disable_stats(self):
+        """(SkipList) -> SkipStats
+        Stop counting, and return the SkipStats counted so far, if any.
+        """
+
+        stats = self.stats
+        if stats is not None:
+            self.__class__ = self._plain_class
+            del self.stats
+        return stats
+
+    def _tower_heights(self):
+        """(SkipList) -> dict of {int: int}
+        Return the number of towers of every height in this SkipList.
+        """
+
+        # Every tower reaching level i from the bottom also has a node on 
+        # every level under it.
+        sizes = self._level_sizes + [0]
+        return dict((i + 1, sizes[i] - sizes[i + 1]) 
+                    for i in range(len(sizes) - 1) if sizes[i] > sizes[i + 1])
+
+    def memory_usage(self, deep=False):
+        """(SkipList, bool) -> dict
+        Return the bytes taken by the nodes of this SkipList as a dict: the
+        'total', split into the 'payload' (the slots that refer to the items
+        and their keys) and the 'overhead' (the rest of the nodes), then by
+        'levels' (the nodes of every level, bottom first, with its HeadNode
+        and TailNode, and the sentinel HeadNode with the top level) and by
+        node 'kinds'. Both add up to the total, unless deep is True or the
+        SkipList has no levels yet and takes its sentinel only. This takes
+        time in the number of levels only. If deep is True, the payload also
+        counts the items and keys themselves, each object once, which takes
+        time in the size of the SkipList.
+        """
+
+        sizes = self._level_sizes
+        towers = sizes[0] if sizes else 0
+        upper = sum(sizes) - towers
+        ends = _node_size(HeadNode) + _node_size(TailNode)
+        bottom = _node_size(self._node)
+        element = _node_size(ElementNode)
+
+        levels = [{'nodes': n, 
+                   'bytes': n * (element if i else bottom) + ends}
+                  for i, n in enumerate(sizes)]
+        if levels:
+            levels[-1]['bytes'] += _node_size(HeadNode)
+
+        # The sentinel self.head has no TailNode of its own.
+        kinds = {'HeadNode': (len(sizes) + 1) * _node_size(HeadNode),
+                 'TailNode': len(sizes) * _node_size(TailNode)}
+        kinds[self._node.__name__] = towers * bottom
+        kinds['ElementNode'] = kinds.get('ElementNode', 0) + upper * element
+
+        slots = 1 if self.key is None else 2
+        payload = struct.calcsize('P') * (towers * slots + upper)
+        total = sum(kinds.values())
+        overhead = total - payload
+        if deep:
+            payload += self._payload_bytes()
+
+        return {'total': overhead + payload, 'payload': payload, 
+                'overhead': overhead, 'levels': levels, 'kinds': kinds}
+
+    def _payload_bytes(self):
+        """(SkipList) -> int
+        Return the bytes taken by the items and keys of this SkipList, 
+        counting every object once.
+        """
+
+        seen = set()
+        size = 0
+        temp = self._bottom_head()
+        if temp is None:
+            return 0
+
+        temp = temp.link
+        while type(temp) != TailNode:
+            for obj in (temp.data, temp.value):
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    size += sys.getsizeof(obj)
+            temp = temp.link
+        return size
+
+    def _node_bytes(self):
+        """(SkipList) -> int
+        Return the bytes taken by the nodes of this SkipList, as counted by
+        memory_usage, in time in the number of levels.
+        """
+
+        sizes = self._level_sizes
+        towers = sizes[0] if sizes else 0
+        return (towers * _node_size(self._node) + 
+                (sum(sizes) - towers) * _node_size(ElementNode) + 
+                (len(sizes) + 1) * _node_size(HeadNode) + 
+                len(sizes) * _node_size(TailNode))
+
+    def _tower_bytes(self, level):
+        """(SkipList, int) -> int
+        Return the bytes a new tower of level levels would add to this
+        SkipList, counting the levels it would add.
+        """
+
+        size = _node_size(self._node) + (level - 1) * _node_size(ElementNode)
+        grow = level - len(self._level_sizes)
+        if grow > 0:
+            size += grow * (_node_size(HeadNode) + _node_size(TailNode))
+        return size
+
+    def _check_budget(self, extra):
+        """(SkipList, int) -> NoneType
+        Raise MemoryError, or warn if budget_action is 'warn', if adding
+        extra bytes of nodes would take this SkipList over its memory budget.
+        """
+
+        if self._node_bytes() + extra <= self.memory_budget:
+            return
+
+        message = ("SkipList memory budget of %d bytes exceeded" % 
+                   self.memory_budget)
+        if self.budget_action == 'raise':
+            raise MemoryError(message)
+        warnings.warn(message, RuntimeWarning)
+
+    def fix_skip(self):
+        """(SkipList) -> NoneType
+        Modify the skip value for all the nodes in this SkipList.
+        """
+
+        if self._shared:
+            self._unshare()
+
+        heads = list(self)
+        if not heads:
+            return
+
+        # Number the nodes of the bottom level first, every node above has
+        # the same position as the bottom node of its tower.
+
+        position = {}
+        temp = heads[-1]
+        pos = 0
+        while type(temp) != TailNode:
+            position[id(temp)] = pos
+            temp = temp.link
+            if type(temp) != TailNode:
+                pos += temp.count
+        tail_pos = pos + 1
+
+        save = self._saver()
+        for head in heads:
+            temp = head
+            pos = 0
+            while type(temp) != TailNode:
+                if save is not None:
+                    save(temp)
+                if type(temp.link) == TailNode:
+                    nxt = tail_pos
+
+                else:
+                    bottom = temp.link
+                    while bottom.down:
+                        bottom = bottom.down
+                    nxt = position[id(bottom)]
+
+                temp.skip = nxt - pos
+                pos = nxt
+                temp = temp.link
+
+    def search(self, item):
+        """(SkipList, object) -> bool
+        Return True if the item is in this SkipList.
+        """
+        
+        key = self._key_of(item)
+        preds, ranks = self._search_path(key)
+        
+        if not preds:  # Return False if the SkipList is empty
+            return False
+        
+        # The bottom predecessor is followed by the first node that is not 
+        # less than item, which may be a dead tower.
+        temp = preds[-1].link
+        
+        return type(temp) != TailNode and temp.data == key and temp.count > 0
+          
+    def __len__(self):
+        """(SkipList) -> int
+        Return the length of the bottom level of this SkipList.
+        """
+        
+        return self.size
+      
+    def get_level(self):
+        """(SkipList) -> int
+        Return the number of levels this skiplist currently has.
+        """
+        
+        return get_level_helper(self.head)
+    
+    def __getitem__(self, item):
+        """(SkipList, int or slice) -> object or generator
+        Return the item in this SkipList given its index, counting from the
+        end if the index is negative. A slice gives a generator over the 
+        selected items, which only seeks to the first one when it starts.
+        """
+
+        if isinstance(item, slice):
+            return self._islice(*item.indices(self.size))
+
+        return self.select(item)
+
+    def select(self, index):
+        """(SkipList, int) -> object
+        Return the item at index in this SkipList. Raise IndexError if there
+        is no such index.
+        """
+
+        if index < 0:
+            index += self.size
+
+        #if item's index is not in range of skiplist's index, then raise
+        if index >= self.size or index <= -1:
+            raise IndexError("SkipList index out of range")
+
+        return self._locate(index)[0].value
+
+    def _locate(self, index):
+        """(SkipList, int) -> (ElementNode, int)
+        Return the bottom node holding the item at index, which must be in
+        range, and how many occurrences in that node come before index.
+        """
+
+        # The HeadNodes are at position 0, so the item at index i is at
+        # position i + 1 on the bottom level, or inside a counted node that
+        # ends at a later position.
+        target = index + 1
+        pos = 0
+        temp = self.head.down
+
+        while True:
+            #if sum of position and skip is before item, then going right
+            while type(temp.link) != TailNode and pos + temp.skip < target:
+                pos += temp.skip
+                temp = temp.link
+
+            #else going down, the item is in the next node of the bottom level
+            if not temp.down:
+                return temp.link, target - pos - 1
+            temp = temp.down
+
+    def _islice(self, start, stop, step):
+        """(SkipList, int, int, int) -> generator
+        Yield the items at indexes range(start, stop, step) of this SkipList.
+        """
+
+        if step < 0:
+            # The levels only link forward, so every item is looked up.
+            for i in range(start, stop, step):
+                yield self._locate(i)[0].value
+            return
+
+        if start >= stop:
+            return
+
+        node, offset = self._locate(start)
+        while True:
+            yield node.value
+            start += step
+            if start >= stop:
+                return
+
+            offset += step
+            while offset >= node.count:
+                offset -= node.count
+                node = node.link
+
+    def rank(self, item):
+        """(SkipList, object) -> int
+        Return the number of items in this SkipList that are less than item.
+        """
+
+        return self.bisect_left(item)
+
+    def bisect_left(self, item):
+        """(SkipList, object) -> int
+        Return the index where item would be inserted before every equal item
+        already in this SkipList.
+        """
+
+        preds, ranks = self._search_path(self._key_of(item))
+        return ranks[-1] if ranks else 0
+
+    def bisect_right(self, item):
+        """(SkipList, object) -> int
+        Return the index where item would be inserted after every equal item
+        already in this SkipList.
+        """
+
+        preds, ranks = self._search_path(self._key_of(item), True)
+        return ranks[-1] if ranks else 0
+
+    def count(self, item):
+        """(SkipList, object) -> int
+        Return the number of occurrences of item in this SkipList.
+        """
+
+        return self.bisect_right(item) - self.bisect_left(item)
+   
+    def __contains__(self, item):
+        """(SkipList, item) -> bool
+        Return True if this skiplist contains the item.
+        """
+        
+        return self.search(item) 
+
+    def _bottom_head(self):
+        """(SkipList) -> HeadNode
+        Return the HeadNode of the bottom level, or None if there is none.
+        """
+
+        # The bottom level keeps its HeadNode until the nodes are replaced.
+        if self._bottom is None:
+            temp = self.head.down
+            while temp is not None and temp.down:
+                temp = temp.down
+            self._bottom = temp
+        return self._bottom
+
+    def _first(self):
+        """(SkipList) -> ElementNode
+        Return the first bottom node of this SkipList that is not dead. The
+        SkipList must not be empty.
+        """
+
+        node = self._bottom_head().link
+        if not node.count:
+            node = self._locate(0)[0]
+        return node
+
+    def _tails(self):
+        """(SkipList) -> list of TailNode
+        Return the last node of every level from the top down, that is the
+        predecessor of every TailNode. It is looked up once, then kept up to
+        date as towers are linked and unlinked.
+        """
+
+        if self._tail_preds is None:
+            self._tail_preds = self._bound_path(None, False, True)[0]
+        return self._tail_preds
+
+    def min(self):
+        """(SkipList) -> object
+        Return the smallest item of this SkipList. Raise ValueError if it is
+        empty.
+        """
+
+        if not self.size:
+            raise ValueError("min() of an empty SkipList")
+        return self._first().value
+
+    def max(self):
+        """(SkipList) -> object
+        Return the largest item of this SkipList. Raise ValueError if it is
+        empty.
+        """
+
+        if not self.size:
+            raise ValueError("max() of an empty SkipList")
+
+        node = self._tails()[-1]
+        if not node.count:
+            node = self._locate(self.size - 1)[0]
+        return node.value
+
+    def pop_min(self):
+        """(SkipList) -> object
+        Remove and return the smallest item of this SkipList. Raise 
+        IndexError if it is empty.
+        """
+
+        if not self.size:
+            raise IndexError("pop from an empty SkipList")
+        if self._shared:
+            self._unshare()
+
+        # The HeadNodes are the predecessors of the first tower, unless it is
+        # dead.
+        node = self._first()
+        if node is self._bottom_head().link:
+            self._remove_at(node.data, list(self))
+        else:
+            self._remove_at(node.data, self._search_path(node.data)[0])
+        self._tidy()
+        return node.value
+
+    def pop_max(self):
+        """(SkipList) -> object
+        Remove and return the largest item of this SkipList. Raise IndexError
+        if it is empty.
+        """
+
+        if not self.size:
+            raise IndexError("pop from an empty SkipList")
+        if self._shared:
+            self._unshare()
+
+        tails = self._tails()
+        node = tails[-1]
+        if not node.count:
+            node = self._locate(self.size - 1)[0]
+            self._remove_at(node.data, self._search_path(node.data)[0])
+            self._tidy()
+            return node.value
+
+        # The last tower is the last node of the lowest "level" levels, and
+        # the last node of every level above it is its predecessor there. 
+        # Below those, search for the node before the tower.
+
+        level = 1
+        while level < len(tails) and tails[-level - 1].down is tails[-level]:
+            level += 1
+
+        preds = tails[:len(tails) - level]
+        temp = preds[-1].down if preds else self.head.down
+        while temp:
+            while temp.link is not tails[len(preds)]:
+                temp = temp.link
+            preds.append(temp)
+            temp = temp.down
+
+        self._remove_at(node.data, preds)
+        self._tidy()
+        return node.value
+
+    def _sorted_probes(self, items):
+        """(SkipList, iterable) -> (list, list of int)
+        Return the keys of items, and the indexes of the keys in sorted order.
+        """
+
+        keys = [self._key_of(item) for item in items]
+        return keys, sorted(range(len(keys)), key=keys.__getitem__)
+
+    def contains_many(self, items):
+        """(SkipList, iterable) -> list of bool
+        Return whether every item of items is in this SkipList, in the order
+        of items. The items are looked up in sorted order, so every search 
+        starts from the path of the previous one.
+        """
+
+        keys, order = self._sorted_probes(items)
+        found = [False] * len(keys)
+        preds, ranks = self._bound_path(None, False, False)
+        if not preds:
+            return found
+
+        for i in order:
+            self._finger(keys[i], preds, ranks)
+            temp = preds[-1].link
+            found[i] = (type(temp) != TailNode and temp.data == keys[i] and 
+                        temp.count > 0)
+
+        return found
+
+    def count_many(self, items):
+        """(SkipList, iterable) -> list of int
+        Return the number of occurrences of every item of items in this
+        SkipList, in the order of items. Two search paths, to the first
+        occurrence and past the last one, move forward through the items in
+        sorted order.
+        """
+
+        keys, order = self._sorted_probes(items)
+        counts = [0] * len(keys)
+        lefts, left_ranks = self._bound_path(None, False, False)
+        if not lefts:
+            return counts
+
+        rights = list(lefts)
+        right_ranks = list(left_ranks)
+        for i in order:
+            self._finger(keys[i], lefts, left_ranks)
+            self._finger(keys[i], rights, right_ranks, True)
+            counts[i] = right_ranks[-1] - left_ranks[-1]
+
+        return counts
+
+    def __str__(self):
+        """(SkipList) -> str
+        Print the SkipList
+        """
+        
+        s = '' 
+        temp = self.head.down
+        while temp:
+            if not temp.down:  # If at the bottom level, no new line is made.
+                s += str(temp)  
+
+            else:
+                s += str(temp) + '\n'
+
+            temp = temp.down
+
+        return s               
+            
+    def __iter__(self):
+        """(SkipList) -> _SkipIter
+        Return an iterator object over this skip list. 
+        The iterator iterate through the HeadNodes.
+        """
+        
+        return _SkipIter(self.head)
+
+    
+class CountedSkipList(SkipList):
+    """ A SkipList that keeps every distinct item in a single tower, whose
+    bottom node counts the occurrences of the item.
+    """
+
+    _node = CountedNode
+    _keyed_node = KeyedCountedNode
+    _after_equal = False  # An item already here is found right after the
+                          # search path, and only gets its count bumped.
+
+    @classmethod
+    def from_sorted(cls, items, balanced=False, **options):
+        """(type, iterable, bool) -> CountedSkipList
+        Return a new CountedSkipList holding every item of items, which must
+        already be in non-decreasing order. Equal items share one tower.
+        """
+
+        runs = keyed_runs(((item, 1) for item in items), options.get('key'))
+        return cls._from_runs(group_runs(runs), balanced, **options)
+
+    @classmethod
+    def from_runs(cls, runs, balanced=False, **options):
+        """(type, iterable of (object, int), bool) -> CountedSkipList
+        Return a new CountedSkipList holding count occurrences of item for
+        every (item, count) pair of runs. The items must be in non-decreasing
+        order and every count positive.
+        """
+
+        runs = keyed_runs(runs, options.get('key'))
+        return cls._from_runs(group_runs(runs), balanced, **options)
+
+    def _insert_at(self, key, preds, ranks, item):
+        """(CountedSkipList, object, list of TailNode, list of int, object)
+        -> NoneType
+        Insert one occurrence of item, whose key is key, into this skip list,
+        given its search path.
+        """
+
+        target = preds[-1].link if preds else None
+
+        # An item already here only needs its count and the skip value of
+        # every predecessor bumped, because its tower covers one more 
+        # position on the bottom level.
+
+        if isinstance(target, CountedNode) and target.data == key:
+            save = self._saver()
+            if save is not None:
+                save(target)
+                for pred in preds:
+                    save(pred)
+            if not target.count:  # A dead tower comes back to life.
+                self.dead -= 1
+                if self.key is not None:
+                    target.value = item
+            target.count += 1
+            for pred in preds:
+                pred.skip += 1
+
+        else:
+            self._link(key, preds, ranks, item)
+
+        self.size += 1
+
+    def _remove_at(self, key, preds):
+        """(CountedSkipList, object, list of TailNode) -> NoneType
+        Remove one occurrence of the item with key key from this skip list if
+        it exists, given the predecessors on its search path.
+        """
+
+        if not preds:
+            return
+
+        target = preds[-1].link
+        if type(target) == TailNode or target.data != key or not target.count:
+            return
+
+        if target.count > 1 or self.compact_ratio is not None:
+            save = self._saver()
+            if save is not None:
+                save(target)
+                for pred in preds:
+                    save(pred)
+            target.count -= 1
+            for pred in preds:
+                pred.skip -= 1
+
+        else:
+            self._unlink(preds, 1)
+
+        self.size -= 1
+        if not target.count:
+            self.dead += 1
+
+    def count(self, item):
+        """(CountedSkipList, object) -> int
+        Return the number of occurrences of item in this skip list.
+        """
+
+        key = self._key_of(item)
+        preds, ranks = self._search_path(key)
+        if not preds:
+            return 0
+
+        target = preds[-1].link
+        if type(target) == TailNode or target.data != key:
+            return 0
+
+        return target.count
+
+
+class SkipStats(object):
+    """ Counters of the work done by a SkipList with stats enabled.
+    """
+
+    PHASES = ('search', 'link', 'unlink')
+
+    def __init__(self):
+        """(SkipStats) -> NoneType
+        Initialize every counter to zero.
+        """
+
+        self.searches = 0
+        self.comparisons = 0
+        self.nodes_visited = 0
+        self.levels_descended = 0
+        self.phase_time = dict.fromkeys(self.PHASES, 0.0)
+        self.heights = {}  # The number of towers of every height.
+
+    def add_tower(self, level, count=1):
+        """(SkipStats, int, int) -> NoneType
+        Record that count towers of level levels were linked, or unlinked if
+        count is negative.
+        """
+
+        self.heights[level] = self.heights.get(level, 0) + count
+        if not self.heights[level]:
+            del self.heights[level]
+
+    def as_dict(self):
+        """(SkipStats) -> dict
+        Return every counter as a plain dict, with the averages per search.
+        """
+
+        searches = self.searches or 1
+        return {'searches': self.searches,
+                'comparisons': self.comparisons,
+                'nodes_visited': self.nodes_visited,
+                'levels_descended': self.levels_descended,
+                'comparisons_per_search': self.comparisons / searches,
+                'nodes_per_search': self.nodes_visited / searches,
+                'phase_time': dict(self.phase_time),
+                'tower_heights': dict(sorted(self.heights.items()))}
+
+
+class _StatsSkipList(object):
+    """ Instrumented versions of the SkipList methods on the hot path. A 
+    SkipList with stats enabled is switched to a subclass of both, so a 
+    SkipList without stats never pays for them.
+    """
+
+    def _search_path(self, item, right=False):
+        """(SkipList, object, bool) -> (list of TailNode, list of int)
+        Return SkipList._search_path(item, right), counting the work done.
+        """
+
+        start = perf_counter()
+        comparisons = 0
+        visited = 0
+        preds = []
+        ranks = []
+        pos = 0
+        temp = self.head.down
+
+        while temp:
             while type(temp.link) != TailNode:
-                if temp == new_node or temp.link == new_node:
-                    return True
-                
-                elif temp < new_node and temp.link < new_node:
-                    temp = temp.link
+                comparisons += 1
+                if right:
+                    if item < temp.link.data:
+                        break
+                elif not temp.link.data < item:
+                    break
+                pos += temp.skip
+                temp = temp.link
+                visited += 1
+            preds.append(temp)
+            ranks.append(pos)
+            temp = temp.down
+
+        self._record(comparisons, visited, len(preds) - 1, start)
+        return preds, ranks
+
+    def _finger(self, item, preds, ranks, right=False):
+        """(SkipList, object, list of TailNode, list of int, bool) -> NoneType
+        Do SkipList._finger(item, preds, ranks, right), counting the work 
+        done.
+        """
+
+        if not preds:
+            return
+
+        start = perf_counter()
+        comparisons = 0
+        visited = 0
+        i = len(preds) - 1
+        while i > 0 and type(preds[i].link) != TailNode:
+            comparisons += 1
+            if right:
+                if item < preds[i].link.data:
+                    break
+            elif not preds[i].link.data < item:
+                break
+            i -= 1
+
+        descended = len(preds) - 1 - i
+        temp = preds[i]
+        pos = ranks[i]
+        while temp:
+            while type(temp.link) != TailNode:
+                comparisons += 1
+                if right:
+                    if item < temp.link.data:
+                        break
+                elif not temp.link.data < item:
+                    break
+                pos += temp.skip
+                temp = temp.link
+                visited += 1
+            preds[i] = temp
+            ranks[i] = pos
+            i += 1
+            temp = temp.down
+
+        self._record(comparisons, visited, descended, start)
+
+    def _locate(self, index):
+        """(SkipList, int) -> (ElementNode, int)
+        Return SkipList._locate(index), counting the work done.
+        """
+
+        start = perf_counter()
+        visited = 0
+        descended = 0
+        target = index + 1
+        pos = 0
+        temp = self.head.down
+
+        while True:
+            while type(temp.link) != TailNode and pos + temp.skip < target:
+                pos += temp.skip
+                temp = temp.link
+                visited += 1
+
+            if not temp.down:
+                self._record(0, visited, descended, start)
+                return temp.link, target - pos - 1
+            temp = temp.down
+            descended += 1
+
+    def _record(self, comparisons, visited, descended, start):
+        """(SkipList, int, int, int, float) -> NoneType
+        Add one search to the stats of this SkipList.
+        """
+
+        stats = self.stats
+        stats.searches += 1
+        stats.comparisons += comparisons
+        stats.nodes_visited += visited
+        stats.levels_descended += descended
+        stats.phase_time['search'] += perf_counter() - start
+
+    def _link(self, key, preds, ranks, item):
+        """(SkipList, object, list of TailNode, list of int, object) -> int
+        Do SkipList._link, timing it and counting the new tower.
+        """
+
+        start = perf_counter()
+        level = super(_StatsSkipList, self)._link(key, preds, ranks, item)
+        self.stats.phase_time['link'] += perf_counter() - start
+        self.stats.add_tower(level)
+        return level
+
+    def _unlink(self, preds, weight):
+        """(SkipList, list of TailNode, int) -> int
+        Do SkipList._unlink, timing it and uncounting the tower.
+        """
+
+        start = perf_counter()
+        level = super(_StatsSkipList, self)._unlink(preds, weight)
+        self.stats.phase_time['unlink'] += perf_counter() - start
+        self.stats.add_tower(level, -1)
+        return level
+
+    def delete_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(SkipList, object, object, (bool, bool)) -> int
+        Do SkipList.delete_range, timing it and recounting the towers.
+        """
+
+        start = perf_counter()
+        removed = super(_StatsSkipList, self).delete_range(lo, hi, inclusive)
+        if removed:
+            self.stats.heights = self._tower_heights()
+        self.stats.phase_time['unlink'] += perf_counter() - start
+        return removed
+
+
+class _Loader(object):
+    """ Builds a SkipList in one pass from the bottom up, from (key, item,
+    count) triples sorted by key, which may come in any number of batches.
+    Every level is left open at its last node until finish closes it.
+    """
+
+    def __init__(self, new, balanced):
+        """(_Loader, SkipList, bool) -> NoneType
+        Initialize a _Loader filling the empty SkipList new, with towers of
+        balanced heights if balanced is True.
+        """
+
+        self.new = new
+        self.balanced = balanced
+        self.heads = []  # The HeadNode of each level, bottom first.
+        self.last = []  # The last node linked so far on each level.
+        self.last_pos = []  # The position of that node on the bottom level.
+        self.pos = 0
+        self.towers = 0
+
+    def extend(self, runs):
+        """(_Loader, iterable of (object, object, int)) -> NoneType
+        Link every triple of runs after the ones linked so far.
+        """
+
+        new = self.new
+        balanced = self.balanced
+        counted = issubclass(new._node, CountedNode)
+        keyed = new.key is not None
+        heads = self.heads
+        sizes = new._level_sizes  # The number of nodes of each level.
+        last = self.last
+        last_pos = self.last_pos
+        pos = self.pos
+        towers = self.towers
+
+        for key, item, count in runs:
+            if pos and key < last[0].data:
+                raise ValueError("from_sorted() needs items in sorted order")
+
+            if counted:
+                run = [count]
+            else:
+                run = [1] * count
+
+            for weight in run:
+                pos += weight
+                towers += 1
+
+                if balanced:
+                    level = 1
+                    while towers % (2 ** level) == 0:
+                        level += 1
+                    if new.max_level is not None:
+                        level = min(level, new.max_level)
+
+                else:
+                    level = new._random_level(towers)
+
+                while len(heads) < level:
+                    head = HeadNode()
+                    heads.append(head)
+                    last.append(head)
+                    last_pos.append(0)
+                    sizes.append(0)
+
+                below = None
+                for i in range(level):
+                    if i:
+                        node = ElementNode(key, None, below)
+                    else:
+                        node = new._node(key)
+                        if weight != 1:
+                            node.count = weight
+                        if keyed:
+                            node.value = item
+                    last[i].link = node
+                    last[i].skip = pos - last_pos[i]
+                    last[i] = node
+                    last_pos[i] = pos
+                    sizes[i] += 1
+                    below = node
+
+        self.pos = pos
+        self.towers = towers
+
+    def finish(self):
+        """(_Loader) -> SkipList
+        Close every level of the SkipList and return it.
+        """
+
+        new = self.new
+        heads = self.heads
+        last = self.last
+        pos = self.pos
+
+        # Close every level with a TailNode and stack the HeadNodes.
+        below = None
+        for i in range(len(heads)):
+            last[i].link = TailNode(below)
+            last[i].skip = pos + 1 - self.last_pos[i]
+            below = last[i].link
+            if i:
+                heads[i].add_down(heads[i - 1])
+
+        if heads:
+            new.head.down = heads[-1]
+        new.size = pos
+        if new.memory_budget is not None:
+            new._check_budget(0)
+        return new
+
+
+_node_sizes = {}  # The size in bytes of a node of every class.
+
+
+def _node_size(cls):
+    """(type) -> int
+    Return the size in bytes of a node of class cls, which keeps its
+    attributes in slots, so every node of the class has the same size.
+    """
+
+    if cls not in _node_sizes:
+        _node_sizes[cls] = sys.getsizeof(cls.__new__(cls))
+    return _node_sizes[cls]
+
+
+_stats_classes = {}
+
+
+def _stats_class(cls):
+    """(type) -> type
+    Return the subclass of cls, a kind of SkipList, that keeps stats.
+    """
+
+    if cls not in _stats_classes:
+        _stats_classes[cls] = type(cls.__name__, (_StatsSkipList, cls), 
+                                   {'_plain_class': cls})
+    return _stats_classes[cls]
+
+
+class _ConcurrentSkipList(object):
+    """ Thread-safe versions of the public SkipList methods. A SkipList made
+    with concurrent=True is switched to a subclass of both, so a SkipList
+    used by one thread never pays for them.
+
+    Writers run one at a time under a lock, and keep the version of the 
+    SkipList odd while they change it. Readers take no lock: they note the
+    version, search, and search again if the version has changed in the
+    meantime, since the links and skip values they saw may be half updated.
+    After a few tries they wait for the lock, so writers cannot starve them.
+
+    Iterators, slices and irange walk the bottom level without checking,
+    once a checked search has found where they start. A node is always
+    complete before it is linked in, and keeps its link when it is unlinked,
+    so they never follow a torn link, but they may or may not see the items
+    added or removed by writers on the way.
+    """
+
+    concurrent = True
+    _tries = 3  # Optimistic searches before a reader waits for the lock.
+
+    def _read(self, method, *args):
+        """(SkipList, method, object) -> object
+        Return method(*args), retrying it until no writer ran during the call.
+        """
+
+        # A writer reading its own SkipList, as pop_min does, must not wait
+        # for the lock it holds.
+        if self._writer == threading.get_ident():
+            return method(*args)
+
+        for i in range(self._tries):
+            version = self._version
+            if version % 2:
+                continue
+
+            try:
+                result = method(*args)
+            except Exception:
+                # A torn read may fail in ways the finished one would not.
+                if self._version == version:
+                    raise
+            else:
+                if self._version == version:
+                    return result
+
+        with self._lock:
+            return method(*args)
+
+    def _write(self, method, *args):
+        """(SkipList, method, object) -> object
+        Return method(*args), run while holding the lock of this SkipList.
+        """
+
+        with self._lock:
+            self._version += 1
+            self._writer = threading.get_ident()
+            try:
+                return method(*args)
+            finally:
+                self._writer = None
+                self._version += 1
+
+    def insert(self, item):
+        """(SkipList, object) -> NoneType
+        Do SkipList.insert(item) under the lock.
+        """
+
+        self._write(super(_ConcurrentSkipList, self).insert, item)
+
+    def insert_many(self, items):
+        """(SkipList, iterable) -> NoneType
+        Do SkipList.insert_many(items) under the lock, as one write.
+        """
+
+        # The keys are computed and sorted before the lock is taken, once.
+        self._write(self._insert_sorted, self._sorted_keys(items))
+
+    def remove(self, item):
+        """(SkipList, object) -> NoneType
+        Do SkipList.remove(item) under the lock.
+        """
+
+        self._write(super(_ConcurrentSkipList, self).remove, item)
+
+    def remove_many(self, items):
+        """(SkipList, iterable) -> NoneType
+        Do SkipList.remove_many(items) under the lock, as one write.
+        """
+
+        self._write(super(_ConcurrentSkipList, self).remove_many, 
+                    list(items))
+
+    def delete_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(SkipList, object, object, (bool, bool)) -> int
+        Do SkipList.delete_range under the lock.
+        """
+
+        return self._write(super(_ConcurrentSkipList, self).delete_range, 
+                           lo, hi, inclusive)
+
+    def fix_skip(self):
+        """(SkipList) -> NoneType
+        Do SkipList.fix_skip under the lock.
+        """
+
+        self._write(super(_ConcurrentSkipList, self).fix_skip)
+
+    def compact(self):
+        """(SkipList) -> NoneType
+        Do SkipList.compact under the lock.
+        """
+
+        self._write(super(_ConcurrentSkipList, self).compact)
+
+    def memory_usage(self, deep=False):
+        """(SkipList, bool) -> dict
+        Return SkipList.memory_usage(deep), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).memory_usage, 
+                          deep)
+
+    def _share(self, options):
+        """(SkipList, dict) -> SkipList
+        Do SkipList._share(options) under the lock.
+        """
+
+        # The snapshot starts a new epoch, so no writer may run in between.
+        with self._lock:
+            return super(_ConcurrentSkipList, self)._share(options)
+
+    def search(self, item):
+        """(SkipList, object) -> bool
+        Return SkipList.search(item), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).search, item)
+
+    def select(self, index):
+        """(SkipList, int) -> object
+        Return SkipList.select(index), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).select, index)
+
+    def _locate(self, index):
+        """(SkipList, int) -> (ElementNode, int)
+        Return SkipList._locate(index), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self)._locate, index)
+
+    def bisect_left(self, item):
+        """(SkipList, object) -> int
+        Return SkipList.bisect_left(item), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).bisect_left, item)
+
+    def bisect_right(self, item):
+        """(SkipList, object) -> int
+        Return SkipList.bisect_right(item), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).bisect_right, 
+                          item)
+
+    def count(self, item):
+        """(SkipList, object) -> int
+        Return SkipList.count(item), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).count, item)
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, True)):
+        """(SkipList, object, object, (bool, bool)) -> int
+        Return SkipList.count_range, without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).count_range, 
+                          lo, hi, inclusive)
+
+    def _bottom_head(self):
+        """(SkipList) -> HeadNode
+        Return the HeadNode of the bottom level, or None if there is none.
+        """
+
+        # A reader cannot tell if a writer replaced the nodes after it looked,
+        # so nothing is cached.
+        temp = self.head.down
+        while temp is not None and temp.down:
+            temp = temp.down
+        return temp
+
+    def _tails(self):
+        """(SkipList) -> list of TailNode
+        Return the last node of every level from the top down, without 
+        caching it.
+        """
+
+        return self._bound_path(None, False, True)[0]
+
+    def pop_min(self):
+        """(SkipList) -> object
+        Do SkipList.pop_min under the lock.
+        """
+
+        return self._write(super(_ConcurrentSkipList, self).pop_min)
+
+    def pop_max(self):
+        """(SkipList) -> object
+        Do SkipList.pop_max under the lock.
+        """
+
+        return self._write(super(_ConcurrentSkipList, self).pop_max)
+
+    def min(self):
+        """(SkipList) -> object
+        Return SkipList.min(), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).min)
+
+    def max(self):
+        """(SkipList) -> object
+        Return SkipList.max(), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).max)
+
+    def contains_many(self, items):
+        """(SkipList, iterable) -> list of bool
+        Return SkipList.contains_many(items), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).contains_many, 
+                          list(items))
+
+    def count_many(self, items):
+        """(SkipList, iterable) -> list of int
+        Return SkipList.count_many(items), without taking the lock.
+        """
+
+        return self._read(super(_ConcurrentSkipList, self).count_many, 
+                          list(items))
+
+
+_concurrent_classes = {}
+
+
+def _concurrent_class(cls):
+    """(type) -> type
+    Return the subclass of cls, a kind of SkipList, that is thread-safe.
+    """
+
+    if issubclass(cls, _ConcurrentSkipList):
+        return cls
+    if cls not in _concurrent_classes:
+        _concurrent_classes[cls] = type(cls.__name__, 
+                                        (_ConcurrentSkipList, cls), {})
+    return _concurrent_classes[cls]
+
+
+class _FrozenSkipList(object):
+    """ The methods of a SkipList snapshot that would change it, which all
+    raise TypeError.
+    """
+
+    frozen = True
+
+    def _read_only(self, *args, **kwargs):
+        """(SkipList) -> NoneType
+        Raise TypeError, since this SkipList is a snapshot.
+        """
+
+        raise TypeError("SkipList snapshot is read-only")
+
+    insert = insert_many = remove = remove_many = _read_only
+    delete_range = fix_skip = pop_min = pop_max = compact = _read_only
+
+
+_frozen_classes = {}
+
+
+def _frozen_class(cls):
+    """(type) -> type
+    Return the subclass of cls, a kind of SkipList, that is read-only.
+    """
+
+    if cls not in _frozen_classes:
+        _frozen_classes[cls] = type(cls.__name__, (_FrozenSkipList, cls), {})
+    return _frozen_classes[cls]
+
+
+def _user_class(cls):
+    """(type) -> type
+    Return the class that cls was made from for stats, concurrency or
+    snapshots, or cls itself.
+    """
+
+    while (cls in _stats_classes.values() or 
+           cls in _concurrent_classes.values() or
+           cls in _frozen_classes.values()):
+        cls = cls.__bases__[1]
+    return cls
+
+
+class _History(object):
+    """ The fields the nodes of a SkipList had before it changed them, kept
+    for its snapshots. Taking a snapshot starts a new epoch, and the first
+    change to a node in every epoch keeps the fields it had until then, 
+    stamped with the epoch. A snapshot taken in epoch e sees the fields of
+    the first record stamped after e, or the current fields if there is none.
+
+    No snapshot needs a record stamped at or before the epoch of the oldest
+    one still alive, so such records are dropped once the snapshots that
+    needed them are gone, and the history only holds the changes made since
+    the oldest live snapshot. A SkipList with no snapshot pays nothing but a
+    check for them.
+
+    Only the writer of the SkipList changes the history: snapshots that go
+    away are only noted, and their records are dropped by the next write.
+    """
+
+    def __init__(self):
+        """(_History) -> NoneType
+        Initialize a history with no records.
+        """
+
+        self.epoch = 0
+        self.live = []  # The epochs still seen by a snapshot, oldest first.
+        self.released = []  # The epochs no longer seen, not yet dropped.
+        # id(node) -> [node] followed by the records of node, oldest first,
+        # each as the six fields epoch, link, skip, down, count and value, in
+        # one flat list so that keeping them makes few objects for the
+        # garbage collector.
+        self.saved = {}
+        # epoch -> the ids of the nodes with a record stamped with it.
+        self.touched = {}
+
+    def take(self):
+        """(_History) -> int
+        Start a new epoch for a new snapshot, and return the epoch it sees.
+        """
+
+        if self.released:
+            self.prune()
+        self.live.append(self.epoch)
+        self.epoch += 1
+        return self.epoch - 1
+
+    def release(self, epoch):
+        """(_History, int) -> NoneType
+        Note that no snapshot sees epoch any longer. This may run in any
+        thread, even in the middle of a write, so it changes nothing else.
+        """
+
+        self.released.append(epoch)
+
+    def prune(self):
+        """(_History) -> NoneType
+        Forget the epochs that were released, and drop every record that no
+        live snapshot needs any more.
+        """
+
+        while self.released:
+            self.live.remove(self.released.pop())
+        if not self.live:
+            self.saved = {}
+            self.touched = {}
+            return
+
+        oldest = self.live[0]
+        saved = self.saved
+        for epoch in list(self.touched):
+            if epoch > oldest:
+                break
+            for key in self.touched.pop(epoch):
+                entry = saved.get(key)
+                if entry is None:
+                    continue
+                i = 1
+                while i < len(entry) and entry[i] <= oldest:
+                    i += 6
+                # Snapshots may be reading the entry, so it is replaced, not
+                # cut down.
+                if i == len(entry):
+                    del saved[key]
+                elif i > 1:
+                    saved[key] = entry[:1] + entry[i:]
+
+    def save(self, node):
+        """(_History, TailNode) -> NoneType
+        Keep the fields of node as they are, before it changes, unless they
+        have already been kept in this epoch.
+        """
+
+        key = id(node)
+        entry = self.saved.get(key)
+        if entry is not None and entry[-6] == self.epoch:
+            return
+
+        record = [self.epoch, getattr(node, 'link', None), node.skip, 
+                  node.down, getattr(node, 'count', None),
+                  getattr(node, 'value', None)]
+        if entry is None:
+            # The node is kept along with its records, so its id stays its
+            # own.
+            self.saved[key] = [node] + record
+        else:
+            entry += record
+        touched = self.touched.get(self.epoch)
+        if touched is None:
+            touched = self.touched[self.epoch] = []
+        touched.append(key)
+
+
+class _Epoch(object):
+    """ The nodes of a SkipList as a snapshot taken in one epoch sees them.
+    """
+
+    def __init__(self, history):
+        """(_Epoch, _History) -> NoneType
+        Start a new epoch of history, seen by this _Epoch until it is gone.
+        """
+
+        self.history = history
+        self.epoch = history.take()
+        weakref.finalize(self, history.release, self.epoch)
+
+    def see(self, node):
+        """(_Epoch, TailNode) -> TailNode
+        Return node as seen in this epoch. TailNodes never change, so they
+        are returned as they are.
+        """
+
+        if node is None or type(node) == TailNode:
+            return node
+        if isinstance(node, HeadNode):
+            return _PastHead(node, self)
+        return _PastNode(node, self)
+
+    def field(self, node, index, name):
+        """(_Epoch, TailNode, int, str) -> object
+        Return the field name of node in this epoch, which is at index in its
+        records.
+        """
+
+        # The field is read before the records: a writer keeps the record 
+        # before it changes the field, so a changed field always has one.
+        value = getattr(node, name)
+        entry = self.history.saved.get(id(node))
+        if entry is None:
+            return value
+        return self.past(entry, index, value)
+
+    def past(self, entry, index, value):
+        """(_Epoch, list, int, object) -> object
+        Return the field at index in the first of the records in entry that
+        is stamped after this epoch, or value if there is none.
+        """
+
+        epoch = self.epoch
+        lo = 0
+        hi = len(entry) // 6
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entry[6 * mid + 1] > epoch:
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo < len(entry) // 6:
+            return entry[6 * lo + 1 + index]
+        return value
+
+
+class _PastNode(object):
+    """ An ElementNode as a snapshot sees it. The nodes it links to are seen
+    in the same epoch.
+    """
+
+    __slots__ = ('node', 'epoch')
+
+    def __init__(self, node, epoch):
+        """(_PastNode, ElementNode, _Epoch) -> NoneType
+        Initialize a view of node in epoch.
+        """
+
+        self.node = node
+        self.epoch = epoch
+
+    @property
+    def data(self):
+        """(_PastNode) -> object
+        Return the data of the node, which never changes.
+        """
+
+        return self.node.data
+
+    @property
+    def link(self):
+        """(_PastNode) -> TailNode
+        Return the next node on the level.
+        """
+
+        # The same as see(field(...)), written out: every step of a search
+        # reads it.
+        node = self.node
+        epoch = self.epoch
+        link = node.link
+        entry = epoch.history.saved.get(id(node))
+        if entry is not None:
+            link = epoch.past(entry, 1, link)
+        if link is None or type(link) == TailNode:
+            return link
+        return _PastNode(link, epoch)
+
+    @property
+    def skip(self):
+        """(_PastNode) -> int
+        Return the skip value of the node.
+        """
+
+        node = self.node
+        epoch = self.epoch
+        skip = node.skip
+        entry = epoch.history.saved.get(id(node))
+        if entry is not None:
+            return epoch.past(entry, 2, skip)
+        return skip
+
+    @property
+    def down(self):
+        """(_PastNode) -> TailNode
+        Return the node below.
+        """
+
+        return self.epoch.see(self.epoch.field(self.node, 3, 'down'))
+
+    @property
+    def count(self):
+        """(_PastNode) -> int
+        Return the number of occurrences the node holds.
+        """
+
+        return self.epoch.field(self.node, 4, 'count')
+
+    @property
+    def value(self):
+        """(_PastNode) -> object
+        Return the item the node stands for.
+        """
+
+        return self.epoch.field(self.node, 5, 'value')
+
+    __lt__ = ElementNode.__lt__
+    __eq__ = ElementNode.__eq__
+    __hash__ = None
+    __repr__ = ElementNode.__repr__
+
+
+class _PastHead(_PastNode):
+    """ A HeadNode as a snapshot sees it.
+    """
+
+    __slots__ = ()
+
+    __str__ = HeadNode.__str__
+    __iter__ = HeadNode.__iter__
+    __repr__ = HeadNode.__repr__
+
+
+def make_head(root, count):
+    """ (HeadNode, int) -> HeadNode
+    Return number "count" of HeadNodes linked together. 
+    """
+    
+    # Return a series of HeadNodes linked together.
+    # Use of Recursion
+    
+    if root and count == 1:
+        return root 
+    
+    if not root and count == 1:
+        root = HeadNode()
         
-                else:
-                    return temp
-                
-            return temp
+    else:
+        root = HeadNode()
+        root.down = make_head(root.down, count - 1)
+        
+    return root 
         
-    return root
-         
+
+def random_level(p=0.5, max_level=32, rng=random):
+    """(float, int, random.Random) -> int
+    Return a random number of levels from 1 to max_level, where every level
+    above the first is reached with probability p. A single call to
+    rng.getrandbits makes the draw.
+    """
+
+    if max_level <= 1:
+        return 1
+
+    # When p is 1 / 2 ** k, every k trailing zero bits of a random number are
+    # one more level.
+    k = max(int(round(-math.log(p, 2))), 1)
+    if p == 0.5 ** k:
+        bits = rng.getrandbits(k * (max_level - 1))
+        if not bits:
+            return max_level
+        return 1 + ((bits & -bits).bit_length() - 1) // k
+
+    # Otherwise invert the geometric distribution with a uniform in (0, 1].
+    u = (rng.getrandbits(53) + 1) / 2.0 ** 53
+    return min(1 + int(math.log(u) / math.log(p)), max_level)
+
+                  
+def keyed_runs(runs, key=None):
+    """(iterable of (object, int), function) -> generator
+    Yield (key(item), item, count) for every (item, count) pair of runs, or
+    (item, item, count) if key is None.
+    """
+
+    if key is None:
+        for item, count in runs:
+            yield item, item, count
+
+    else:
+        for item, count in runs:
+            yield key(item), item, count
+
+
+def group_runs(runs):
+    """(iterable of (object, object, int)) -> generator
+    Yield the (key, item, count) triples of runs, merging the neighbours with
+    equal keys into the first one of them.
+    """
+
+    for key, group in groupby(runs, itemgetter(0)):
+        key, item, count = next(group)
+        for other in group:
+            count += other[2]
+        yield key, item, count
+
 
 def get_level_helper(head):
     """(HeadNode) -> int
@@ -625,56 +2588,6 @@ def get_level_helper(head):
     return count 
 
 
-def set_index(root):
-    '''(HeadNode) -> NoneType
-    Set the index of the bottom level
-    '''
-    temp = root
-    count = -1
-    a = True
-    while temp.down:
-        temp = temp.down
-    while temp and a:
-        #set temp.link is tailnode, then tailnode's index is temp's index
-        #plus 1
-        if type(temp) == TailNode:
-            temp.index = (count + 1)
-            a = False
-        #set index from '-1', and plus 1 for next node
-        else:
-            temp.index = count
-            count += 1
-            temp = temp.link
-
-            
-def get_index(root):
-    '''(Object) -> int
-    Return the index of current Node.
-    '''
-    #going to bottom level and return root's index
-    temp = root
-    
-    while temp.down:
-        temp = temp.down
-        
-    return temp.index
-
-
-def get_max_index(root):
-    """(object) -> int
-    """
-    
-    temp = root.head.down
-    
-    while temp.down:
-        temp = temp.down
-    
-    while type(temp) != TailNode:
-        temp = temp.link
-    
-    return temp.index - 1  # The index of the TailNode - 1.
-      
-
 #The following class is taken from official_skiplist.py by Francois Pitt.
 class _SkipIter(object):  # "private" class because name starts with _
     """An iterator (allowing the use of for-loops) for skip lists.
@@ -0,0 +1,223 @@
+"""Randomized differential tests of NumericMultiSet, checked against a
+sorted list and a Counter.
+
+Run with "python -m pytest" or "python -m unittest".
+"""
+
+import bisect
+import random
+import unittest
+import warnings
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    from numeric import NumericMultiSet
+
+from multiset import MultiSet
+
+
+STEPS = 300
+SEEDS = range(6)
+LOAD = 8  # Small blocks, so that they are split and joined often.
+
+
+def check_blocks(m):
+    """(NumericMultiSet) -> NoneType
+    Raise AssertionError unless the blocks of m are sorted, non-empty, of
+    load // 2 to 2 * load numbers each unless there is only one, and agree
+    with the maxes and the size.
+    """
+
+    blocks = m._blocks
+    for block in blocks:
+        assert 0 < len(block) <= 2 * m.load, len(block)
+        if len(blocks) > 1:
+            assert len(block) >= m.load // 2, [len(b) for b in blocks]
+    assert m._maxes == [block[-1] for block in blocks]
+    numbers = m._array().tolist()
+    assert numbers == sorted(numbers)
+    assert len(numbers) == m._size == len(m)
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class NumericDifferentialTest(unittest.TestCase):
+    """Random operations on a NumericMultiSet, checked against a sorted
+    list."""
+
+    def make(self, dtype, seed):
+        """(NumericDifferentialTest, str, int) -> NumericMultiSet
+        Return an empty NumericMultiSet of dtype with small blocks.
+        """
+
+        m = MultiSet(dtype=dtype)
+        self.assertIsInstance(m, NumericMultiSet)
+        m.load = LOAD
+        return m
+
+    def number(self, rng, dtype):
+        """(NumericDifferentialTest, random.Random, str) -> object
+        Return a random number of dtype, often a repeat.
+        """
+
+        if dtype == 'float64':
+            return rng.randrange(80) / 2.0
+        return rng.randrange(-20, 60)
+
+    def step(self, m, ref, rng, dtype):
+        """(NumericDifferentialTest, NumericMultiSet, list, random.Random,
+        str) -> NoneType
+        Apply one random change to both m and the sorted list ref.
+        """
+
+        op = rng.random()
+        x = self.number(rng, dtype)
+        if op < 0.25:
+            m.insert(x)
+            bisect.insort(ref, x)
+        elif op < 0.45:
+            m.remove(x)
+            if x in ref:
+                ref.remove(x)
+        elif op < 0.6:
+            xs = [self.number(rng, dtype) for i in range(rng.randrange(40))]
+            m.insert_many(xs)
+            ref[:] = sorted(ref + xs)
+        elif op < 0.75:
+            xs = [self.number(rng, dtype) for i in range(rng.randrange(40))]
+            m.remove_many(xs)
+            for y in xs:
+                if y in ref:
+                    ref.remove(y)
+        elif op < 0.8:
+            lo, hi = sorted((x, self.number(rng, dtype)))
+            inclusive = (rng.random() < 0.5, rng.random() < 0.5)
+            kept = [y for y in ref 
+                    if not ((lo < y or (y == lo and inclusive[0])) and
+                            (y < hi or (y == hi and inclusive[1])))]
+            self.assertEqual(m.delete_range(lo, hi, inclusive),
+                             len(ref) - len(kept))
+            ref[:] = kept
+        elif op < 0.9:
+            if ref:
+                self.assertEqual(m.pop_min(), ref.pop(0))
+            else:
+                self.assertRaises(IndexError, m.pop_min)
+        else:
+            if ref:
+                self.assertEqual(m.pop_max(), ref.pop())
+            else:
+                self.assertRaises(IndexError, m.pop_max)
+
+    def check_reads(self, m, ref, rng, dtype):
+        """(NumericDifferentialTest, NumericMultiSet, list, random.Random,
+        str) -> NoneType
+        Check the read-only operations of m against the sorted list ref.
+        """
+
+        self.assertEqual(list(m[:]), ref)
+        self.assertEqual(list(m.runs()), sorted(Counter(ref).items()))
+        if ref:
+            i = rng.randrange(len(ref))
+            self.assertEqual(m[i], ref[i])
+            self.assertEqual(m[-1 - i], ref[-1 - i])
+            self.assertEqual(m.min(), ref[0])
+            self.assertEqual(m.max(), ref[-1])
+        start, stop = sorted((rng.randrange(len(ref) + 1),
+                              rng.randrange(len(ref) + 1)))
+        step = rng.randrange(1, 4)
+        self.assertEqual(list(m[start:stop:step]), ref[start:stop:step])
+
+        probes = [self.number(rng, dtype) for i in range(8)]
+        self.assertEqual(m.count_many(probes), [ref.count(p) for p in probes])
+        self.assertEqual(m.contains_many(probes), [p in ref for p in probes])
+        for p in probes[:3]:
+            self.assertEqual(m.count(p), ref.count(p))
+            self.assertEqual(p in m, p in ref)
+            self.assertEqual(m.bisect_left(p), bisect.bisect_left(ref, p))
+            self.assertEqual(m.bisect_right(p), bisect.bisect_right(ref, p))
+
+        lo, hi = sorted(probes[:2])
+        expected = [y for y in ref if lo <= y < hi]
+        self.assertEqual(list(m.irange(lo, hi, (True, False))), expected)
+        self.assertEqual(m.count_range(lo, hi, (True, False)), len(expected))
+
+    def test_random_operations(self):
+        """Random changes keep the numbers and the blocks right."""
+        for dtype in ('int64', 'float64'):
+            for seed in SEEDS:
+                rng = random.Random(seed)
+                m = self.make(dtype, seed)
+                ref = []
+                for i in range(STEPS):
+                    self.step(m, ref, rng, dtype)
+                    check_blocks(m)
+                    self.check_reads(m, ref, rng, dtype)
+
+    def test_shrinking(self):
+        """Blocks emptied by removals are joined, so that few blocks are
+        left for few numbers."""
+        m = self.make('int64', 0)
+        m.insert_many(range(1000))
+        m.remove_many(range(0, 1000, 2))
+        check_blocks(m)
+        for i in range(1, 990, 2):
+            m.remove(i)
+            check_blocks(m)
+        self.assertEqual(list(m[:]), [991, 993, 995, 997, 999])
+        self.assertEqual(len(m._blocks), 1)
+
+    def test_set_algebra(self):
+        """Union, intersection and difference match those of Counters, with
+        a NumericMultiSet or a MultiSet on the right."""
+        rng = random.Random(4)
+        for i in range(20):
+            a = Counter(rng.randrange(30) for j in range(rng.randrange(60)))
+            b = Counter(rng.randrange(30) for j in range(rng.randrange(60)))
+            m = MultiSet.from_iterable(a.elements(), dtype='int64')
+            for other in (MultiSet.from_iterable(b.elements(), dtype='int64'),
+                          MultiSet.from_iterable(b.elements())):
+                self.assertEqual(list((m + other).runs()),
+                                 sorted((a | b).items()))
+                self.assertEqual(list((m & other).runs()),
+                                 sorted((a & b).items()))
+                self.assertEqual(list((m - other).runs()),
+                                 sorted((a - b).items()))
+                self.assertEqual(m <= other, not (a - b))
+                self.assertEqual(m == other, +a == +b)
+
+    def test_memory_budget(self):
+        """Numbers that would take the blocks over the budget raise
+        MemoryError, or warn if asked to, and nothing changes when they
+        raise."""
+        m = MultiSet(dtype='int64', memory_budget=20000)
+        m.insert_many(range(1000))
+        self.assertLessEqual(m.memory_usage()['total'], 20000)
+        self.assertRaises(MemoryError, m.insert_many, range(2000))
+        self.assertRaises(MemoryError, m.copy().insert_many, range(2000))
+        self.assertEqual(list(m[:]), list(range(1000)))
+        self.assertRaises(MemoryError, MultiSet.from_iterable, range(5000),
+                          dtype='int64', memory_budget=20000)
+
+        m = MultiSet(dtype='int64', memory_budget=20000, budget_action='warn')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            m.insert_many(range(3000))
+        self.assertTrue(caught)
+        self.assertEqual(len(m), 3000)
+        self.assertRaises(ValueError, MultiSet, dtype='int64',
+                          budget_action='ignore')
+
+    def test_no_skiplist(self):
+        """The SkipList helpers a NumericMultiSet cannot have raise
+        TypeError."""
+        m = MultiSet.from_iterable([1, 2], dtype='int64')
+        self.assertRaises(TypeError, m.travel_down)
+        self.assertRaises(TypeError, m.enable_stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
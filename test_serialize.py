@@ -0,0 +1,154 @@
+"""Randomized differential tests of the binary format of serialize.py and of
+MappedMultiSet, checked against a Counter and a sorted list.
+
+Run with "python -m pytest" or "python -m unittest".
+"""
+
+import bisect
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from array import array
+from collections import Counter
+
+import serialize
+from multiset import MultiSet
+from serialize import HEADER, RUNS, MappedMultiSet
+
+
+SEEDS = range(5)
+
+
+def random_elements(rng, kind, n):
+    """(random.Random, str, int) -> list
+    Return n random elements of kind 'int', 'float' or 'str', with repeats.
+    """
+
+    if kind == 'int':
+        return [rng.randrange(-50, 50) for i in range(n)]
+    if kind == 'float':
+        return [rng.randrange(40) / 4.0 for i in range(n)]
+    return [chr(97 + rng.randrange(26)) * rng.randrange(1, 4)
+            for i in range(n)]
+
+
+def swapped(data):
+    """(bytes) -> bytes
+    Return the encoding data in the other byte order.
+    """
+
+    magic, version, code, order, flags, n, size = HEADER.unpack_from(data)
+    other = b'>' if order == b'<' else b'<'
+    words = (n if flags & RUNS else 0) + (n + 1 if code == b'o' else n)
+    end = HEADER.size + 8 * words
+    numbers = array('Q', data[HEADER.size:end])
+    numbers.byteswap()
+    return (HEADER.pack(magic, version, code, other, flags, n, size) +
+            numbers.tobytes() + data[end:])
+
+
+class SerializeTest(unittest.TestCase):
+    """Encodings of random MultiSets, decoded again."""
+
+    def setUp(self):
+        """(SerializeTest) -> NoneType
+        Make a directory for the files of a test.
+        """
+
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """(SerializeTest) -> NoneType
+        Remove the directory of the files of a test.
+        """
+
+        shutil.rmtree(self.dir)
+
+    def encodings(self, seed, n=200):
+        """(SerializeTest, int, int) -> generator of (Counter, bytes)
+        Yield random Counters of every kind of element together with their
+        encodings, with runs and without, in both byte orders.
+        """
+
+        rng = random.Random(seed)
+        for kind in ('int', 'float', 'str'):
+            ref = Counter(random_elements(rng, kind, rng.randrange(n)))
+            m = MultiSet.from_iterable(ref.elements(), rng=seed)
+            for runs_only in (True, False):
+                data = m.to_bytes(runs_only)
+                yield ref, data
+                yield ref, swapped(data)
+
+    def test_round_trip(self):
+        """A MultiSet comes back from its encoding with the same elements
+        and counts."""
+        for seed in SEEDS:
+            for ref, data in self.encodings(seed):
+                m = MultiSet.from_bytes(data)
+                self.assertEqual(list(m.runs()), sorted(ref.items()))
+                self.assertEqual(len(m), sum(ref.values()))
+
+    def test_mapped(self):
+        """A MappedMultiSet answers every query like the sorted list of the
+        elements it was saved with, and closes cleanly."""
+        path = os.path.join(self.dir, 'm.mset')
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            for ref, data in self.encodings(seed):
+                with open(path, 'wb') as f:
+                    f.write(data)
+                flat = sorted(ref.elements())
+                probes = sorted(ref) + random_elements(
+                    rng, type(flat[0]).__name__ if flat else 'int', 5)
+                with MappedMultiSet(path) as m:
+                    self.assertEqual(len(m), len(flat))
+                    self.assertEqual(list(m.runs()), sorted(ref.items()))
+                    if flat:
+                        self.assertEqual(m.min(), flat[0])
+                        self.assertEqual(m.max(), flat[-1])
+                        i = rng.randrange(len(flat))
+                        self.assertEqual(m.select(i), flat[i])
+                        self.assertEqual(m[-1 - i], flat[-1 - i])
+                    self.assertEqual(m.count_many(probes),
+                                     [ref[p] for p in probes])
+                    self.assertEqual(m.contains_many(probes),
+                                     [p in ref for p in probes])
+                    for p in probes[:10]:
+                        self.assertEqual(m.count(p), ref[p])
+                        self.assertEqual(p in m, p in ref)
+                        self.assertEqual(m.bisect_left(p),
+                                         bisect.bisect_left(flat, p))
+                        self.assertEqual(m.bisect_right(p),
+                                         bisect.bisect_right(flat, p))
+                    if len(probes) > 1:
+                        lo, hi = sorted(rng.sample(probes, 2))
+                        expected = [x for x in flat if lo <= x < hi]
+                        self.assertEqual(
+                            list(m.irange(lo, hi, (True, False))), expected)
+                        self.assertEqual(
+                            m.count_range(lo, hi, (True, False)),
+                            len(expected))
+
+    def test_truncated(self):
+        """Every cut short encoding is rejected with a ValueError, and is
+        never read past its end."""
+        path = os.path.join(self.dir, 'm.mset')
+        for ref, data in self.encodings(0, 12):
+            for cut in range(len(data)):
+                self.assertRaises(ValueError, serialize.parse, data[:cut])
+            with open(path, 'wb') as f:
+                f.write(data[:len(data) - 1])
+            self.assertRaises(ValueError, MappedMultiSet, path)
+
+    def test_corrupt(self):
+        """Bad magic, versions and element types are rejected."""
+        data = MultiSet.from_iterable([1, 2, 2]).to_bytes()
+        for bad in (b'XSET' + data[4:], data[:4] + b'\x09' + data[5:],
+                    data[:5] + b'z' + data[6:]):
+            self.assertRaises(ValueError, serialize.parse, bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+"""Randomized differential tests of ShardedMultiSet, checked against a
+Counter, with the shards in this process and in a small ShardPool.
+
+Run with "python -m pytest" or "python -m unittest".
+"""
+
+import gc
+import random
+import unittest
+from bisect import bisect_right
+from collections import Counter
+
+import sharded
+from multiset import MultiSet
+from sharded import ShardedMultiSet, ShardPool
+
+
+STEPS = 300
+SEEDS = range(4)
+MAX_SHARD = 8  # Small shards, so that they are split and merged often.
+
+
+def negate(x):
+    """(int) -> int
+    Return -x, a key that orders the largest first.
+    """
+    return -x
+
+
+def registry_size():
+    """(NoneType) -> int
+    Return the number of shards kept by the process this runs in.
+    """
+    return len(sharded._registry)
+
+
+def check_shards(m):
+    """(ShardedMultiSet) -> NoneType
+    Raise AssertionError unless the bounds of m are sorted, every shard
+    holds only keys of its range and as many elements as its size says, and
+    no shard holding two keys or more is over max_shard elements.
+    """
+    assert len(m.shards) == len(m.sizes) == len(m.bounds) + 1
+    assert m.bounds == sorted(set(m.bounds))
+    for i in range(len(m.shards)):
+        runs = m._fetch(i)
+        assert sum(count for k, e, count in runs) == m.sizes[i]
+        for k, e, count in runs:
+            assert bisect_right(m.bounds, k) == i, (k, i, m.bounds)
+        assert m.sizes[i] <= m.max_shard or len(runs) < 2
+
+
+class ShardedDifferentialTest(unittest.TestCase):
+    """Random operations on a ShardedMultiSet, checked against a Counter."""
+
+    top = 40
+    pool = None
+
+    def make(self, seed, **options):
+        """(ShardedDifferentialTest, int) -> ShardedMultiSet
+        Return a ShardedMultiSet of random elements with small shards, and
+        the Counter of its elements.
+        """
+        rng = random.Random(seed)
+        items = [rng.randrange(self.top) for i in range(rng.randrange(60))]
+        m = ShardedMultiSet.from_iterable(items, rng.randrange(1, 5),
+                                          self.pool, MAX_SHARD, **options)
+        return m, Counter(items)
+
+    def order(self, m):
+        """(ShardedDifferentialTest, ShardedMultiSet) -> function
+        Return the key that sorts elements like m.
+        """
+        return m.key or (lambda x: x)
+
+    def step(self, m, ref, rng):
+        """(ShardedDifferentialTest, ShardedMultiSet, Counter, random.Random)
+        -> NoneType
+        Apply one random change to both m and ref.
+        """
+        op = rng.random()
+        elem = rng.randrange(self.top)
+        if op < 0.5:
+            m.insert(elem)
+            ref[elem] += 1
+        elif op < 0.95:
+            m.remove(elem)
+            ref[elem] -= 1
+        else:
+            m.rebalance()
+        ref += Counter()  # Drop the counts that fell to 0 or below.
+
+    def check_reads(self, m, ref, rng):
+        """(ShardedDifferentialTest, ShardedMultiSet, Counter, random.Random)
+        -> NoneType
+        Check the read-only operations of m against ref.
+        """
+        key = self.order(m)
+        flat = sorted(ref.elements(), key=key)
+        self.assertEqual(len(m), len(flat))
+        self.assertEqual(list(m), flat)
+        self.assertEqual(list(m.runs()), sorted(ref.items(),
+                                                key=lambda run: key(run[0])))
+        if flat:
+            self.assertEqual((m.min(), m.max()), (flat[0], flat[-1]))
+        else:
+            self.assertRaises(ValueError, m.min)
+            self.assertRaises(ValueError, m.max)
+
+        probes = [rng.randrange(-1, self.top + 1) for i in range(6)]
+        self.assertEqual(m.count_many(probes), [ref[p] for p in probes])
+        for p in probes[:2]:
+            self.assertEqual(m.count(p), ref[p])
+            self.assertEqual(p in m, ref[p] > 0)
+
+        ranges = []
+        for i in range(4):
+            lo, hi = sorted(rng.sample(probes, 2), key=key)
+            ranges.append((lo if rng.random() < 0.8 else None,
+                           hi if rng.random() < 0.8 else None))
+        inclusive = (rng.random() < 0.5, rng.random() < 0.5)
+        expected = []
+        for lo, hi in ranges:
+            expected.append(sum(
+                1 for e in flat
+                if (lo is None or key(lo) < key(e) or
+                    (key(lo) == key(e) and inclusive[0])) and
+                (hi is None or key(e) < key(hi) or
+                 (key(e) == key(hi) and inclusive[1]))))
+        self.assertEqual(m.count_ranges(ranges, inclusive), expected)
+        self.assertEqual(m.count_range(*ranges[0], inclusive=inclusive),
+                         expected[0])
+
+    def test_random_operations(self):
+        """Random changes keep the elements and the shards right, with and
+        without a key."""
+        for seed in SEEDS:
+            for options in ({}, {'key': negate}):
+                rng = random.Random(seed)
+                m, ref = self.make(seed, **options)
+                check_shards(m)
+                for i in range(STEPS // 3 if self.pool else STEPS):
+                    self.step(m, ref, rng)
+                    check_shards(m)
+                    self.check_reads(m, ref, rng)
+
+    def test_set_algebra(self):
+        """Union, intersection and difference match those of Counters, with
+        a ShardedMultiSet of the same or other bounds, or a MultiSet, on the
+        right."""
+        for seed in SEEDS:
+            m, a = self.make(seed)
+            other, b = self.make(seed + 100)
+            # m & m has the bounds of m, so its shards are used as they are.
+            for right in (other, MultiSet.from_iterable(b.elements()), m & m):
+                counts = Counter(dict(right.runs()))
+                for op, expected in ((m + right, a | counts),
+                                     (m & right, a & counts),
+                                     (m - right, a - counts)):
+                    check_shards(op)
+                    self.assertEqual(list(op.runs()),
+                                     sorted(expected.items()))
+            self.assertTrue(m == MultiSet.from_iterable(a.elements()))
+
+    def test_errors(self):
+        """Bad shard sizes are rejected."""
+        self.assertRaises(ValueError, ShardedMultiSet, self.pool, 1)
+
+    def shards_kept(self):
+        """(ShardedDifferentialTest) -> int
+        Return the number of shards kept by the workers of the pool, or by
+        this process if there is none.
+        """
+        pool = self.pool or sharded._LocalPool()
+        return sum(pool._submit(worker, registry_size).result()
+                   for worker in range(pool.workers))
+
+    def test_release(self):
+        """The shards of a ShardedMultiSet are dropped along with it."""
+        before = self.shards_kept()
+        m, ref = self.make(0)
+        for i in range(50):
+            m.insert(i % 5)
+        m.rebalance()
+        self.assertEqual(self.shards_kept() - before, len(m.shards))
+        del m
+        gc.collect()
+        self.assertEqual(self.shards_kept(), before)
+
+
+class ShardPoolTest(ShardedDifferentialTest):
+    """The same, with the shards in the workers of a ShardPool."""
+
+    @classmethod
+    def setUpClass(cls):
+        """(type) -> NoneType
+        Start the ShardPool of two workers shared by the tests.
+        """
+        cls.pool = ShardPool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        """(type) -> NoneType
+        Shut the ShardPool down.
+        """
+        cls.pool.shutdown()
+
+    def test_errors(self):
+        """Bad shard sizes and pools are rejected."""
+        ShardedDifferentialTest.test_errors(self)
+        self.assertRaises(ValueError, ShardPool, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
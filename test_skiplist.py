@@ -0,0 +1,967 @@
+"""Randomized differential tests of SkipList, CountedSkipList and MultiSet.
+
+Every test drives a skip list and a plain sorted list with the same random
+operations, and checks after every step that both hold the same items and
+that the skip values and the per-level node counts of the skip list are
+right. Run with "python -m pytest" or "python -m unittest".
+"""
+
+import asyncio
+import bisect
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import warnings
+from collections import Counter
+from operator import itemgetter
+
+from multiset import MultiSet
+from skiplist import CountedSkipList, SkipList, TailNode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+STEPS = 300  # Random operations per run.
+SEEDS = range(8)  # One run per seed.
+
+
+def check_structure(skiplist):
+    """(SkipList) -> NoneType
+    Raise AssertionError unless every skip value of skiplist is the distance
+    between the bottom positions of a node and the next one on its level,
+    and the node counts of its levels, its size and its number of dead
+    towers are right.
+    """
+    heads = list(skiplist)
+    if not heads:
+        assert skiplist.size == 0
+        assert not any(skiplist._level_sizes)
+        return
+
+    # A bottom node is at the position of its last occurrence, so dead nodes
+    # share the position of the node before them.
+    position = {}
+    pos = 0
+    dead = 0
+    temp = heads[-1].link
+    while type(temp) != TailNode:
+        pos += temp.count
+        dead += not temp.count
+        position[identity(temp)] = pos
+        temp = temp.link
+    assert pos == skiplist.size, (pos, skiplist.size)
+    assert dead == skiplist.dead, (dead, skiplist.dead)
+
+    sizes = []
+    for head in reversed(heads):
+        nodes = 0
+        temp = head
+        pos = 0
+        while type(temp) != TailNode:
+            if type(temp.link) == TailNode:
+                nxt = skiplist.size + 1
+            else:
+                nodes += 1
+                bottom = temp.link
+                while bottom.down:
+                    bottom = bottom.down
+                assert bottom.data == temp.link.data
+                nxt = position[identity(bottom)]
+            assert temp.skip == nxt - pos, (temp.skip, nxt, pos)
+            pos = nxt
+            temp = temp.link
+        sizes.append(nodes)
+    assert sizes == skiplist._level_sizes, (sizes, skiplist._level_sizes)
+
+
+def identity(node):
+    """(TailNode) -> int
+    Return the id of node, or of the node it stands for if it is how a copy
+    or a snapshot sees a node.
+    """
+
+    return id(getattr(node, 'node', node))
+
+
+def negate(x):
+    """(int) -> int
+    Return -x, a key that orders the largest first.
+    """
+    return -x
+
+
+def remove_one(ref, item):
+    """(list, object) -> NoneType
+    Remove one occurrence of item from the sorted list ref, if it is there.
+    """
+    i = bisect.bisect_left(ref, item)
+    if i < len(ref) and ref[i] == item:
+        del ref[i]
+
+
+def in_range(item, lo, hi, inclusive):
+    """(object, object, object, (bool, bool)) -> bool
+    Return whether item is from lo to hi, with the bounds as in irange.
+    """
+    if lo is not None and (item < lo or (item == lo and not inclusive[0])):
+        return False
+    if hi is not None and (hi < item or (item == hi and not inclusive[1])):
+        return False
+    return True
+
+
+def random_bounds(rng, top):
+    """(random.Random, int) -> (int, int, (bool, bool))
+    Return random range bounds below top, each maybe None, and random
+    inclusive flags.
+    """
+    lo = rng.randrange(top) if rng.random() < 0.8 else None
+    hi = rng.randrange(top) if rng.random() < 0.8 else None
+    return lo, hi, (rng.random() < 0.5, rng.random() < 0.5)
+
+
+class Differential(object):
+    """Random operations on a skip list and a sorted list, and checks that
+    they agree, for the test cases below."""
+
+    top = 60  # Items are drawn from range(top), so many repeat.
+
+    def make(self, seed):
+        """(Differential, int) -> SkipList
+        Return the empty skip list under test.
+        """
+        return SkipList(rng=seed)
+
+    def check_reads(self, s, ref, rng):
+        """(Differential, SkipList, list, random.Random) -> NoneType
+        Check the read-only operations of s against the sorted list ref.
+        """
+        self.assertEqual(len(s), len(ref))
+        self.assertEqual(list(s[:]), ref)
+        if ref:
+            i = rng.randrange(len(ref))
+            self.assertEqual(s.select(i), ref[i])
+            self.assertEqual(s[-1 - i], ref[-1 - i])
+            self.assertEqual(s.min(), ref[0])
+            self.assertEqual(s.max(), ref[-1])
+        start, stop = sorted((rng.randrange(len(ref) + 1),
+                              rng.randrange(len(ref) + 1)))
+        step = rng.randrange(1, 4)
+        self.assertEqual(list(s[start:stop:step]), ref[start:stop:step])
+
+        item = rng.randrange(-1, self.top + 1)
+        self.assertEqual(s.bisect_left(item), bisect.bisect_left(ref, item))
+        self.assertEqual(s.bisect_right(item), bisect.bisect_right(ref, item))
+        self.assertEqual(s.rank(item), bisect.bisect_left(ref, item))
+        self.assertEqual(s.count(item), ref.count(item))
+        self.assertEqual(s.search(item), item in ref)
+
+        lo, hi, inclusive = random_bounds(rng, self.top)
+        expected = [x for x in ref if in_range(x, lo, hi, inclusive)]
+        self.assertEqual(list(s.irange(lo, hi, inclusive)), expected)
+        self.assertEqual(s.count_range(lo, hi, inclusive), len(expected))
+
+        probes = [rng.randrange(self.top) for i in range(5)]
+        self.assertEqual(s.count_many(probes), [ref.count(p) for p in probes])
+        self.assertEqual(s.contains_many(probes), [p in ref for p in probes])
+
+    def step(self, s, ref, rng):
+        """(Differential, SkipList, list, random.Random) -> NoneType
+        Apply one random change to both s and the sorted list ref.
+        """
+        op = rng.random()
+        item = rng.randrange(self.top)
+        if op < 0.3:
+            s.insert(item)
+            bisect.insort(ref, item)
+        elif op < 0.5:
+            s.remove(item)
+            remove_one(ref, item)
+        elif op < 0.6:
+            items = [rng.randrange(self.top) for i in range(rng.randrange(20))]
+            s.insert_many(items)
+            ref[:] = sorted(ref + items)
+        elif op < 0.7:
+            items = [rng.randrange(self.top) for i in range(rng.randrange(20))]
+            s.remove_many(items)
+            for x in items:
+                remove_one(ref, x)
+        elif op < 0.75:
+            lo, hi, inclusive = random_bounds(rng, self.top)
+            kept = [x for x in ref if not in_range(x, lo, hi, inclusive)]
+            self.assertEqual(s.delete_range(lo, hi, inclusive),
+                             len(ref) - len(kept))
+            ref[:] = kept
+        elif op < 0.85:
+            if ref:
+                self.assertEqual(s.pop_min(), ref.pop(0))
+            else:
+                self.assertRaises(IndexError, s.pop_min)
+        else:
+            if ref:
+                self.assertEqual(s.pop_max(), ref.pop())
+            else:
+                self.assertRaises(IndexError, s.pop_max)
+
+
+class DifferentialTest(Differential, unittest.TestCase):
+    """Random operations on a skip list, checked against a sorted list."""
+
+    def test_random_operations(self):
+        """Random changes keep the items, skip values and level sizes
+        right."""
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            s = self.make(seed)
+            ref = []
+            for i in range(STEPS):
+                self.step(s, ref, rng)
+                check_structure(s)
+                self.check_reads(s, ref, rng)
+
+    def test_insert_many_empty(self):
+        """insert_many into an empty skip list, with and without stats,
+        starts from an empty search path."""
+        for stats in (False, True):
+            s = self.make(0)
+            if stats:
+                s.enable_stats()
+            s.insert_many([5, 1, 4, 1, 3])
+            check_structure(s)
+            self.assertEqual(list(s[:]), [1, 1, 3, 4, 5])
+
+
+class CountedDifferentialTest(DifferentialTest):
+    """The same, on a CountedSkipList."""
+
+    def make(self, seed):
+        """(CountedDifferentialTest, int) -> CountedSkipList
+        Return the empty skip list under test.
+        """
+        return CountedSkipList(rng=seed)
+
+
+class LazyDeleteDifferentialTest(DifferentialTest):
+    """The same, on a CountedSkipList that leaves dead towers behind."""
+
+    def make(self, seed):
+        """(LazyDeleteDifferentialTest, int) -> CountedSkipList
+        Return the empty skip list under test.
+        """
+        return CountedSkipList(rng=seed, compact_ratio=0.5)
+
+    def test_compaction(self):
+        """Dead towers never outnumber compact_ratio per item for long, and
+        compact drops them all."""
+        rng = random.Random(1)
+        s = self.make(1)
+        ref = []
+        for i in range(STEPS):
+            self.step(s, ref, rng)
+            self.assertLessEqual(s.dead, 0.5 * s.size)
+        s.insert_many(range(self.top))
+        s.remove_many(range(0, self.top, 2))
+        self.assertTrue(s.dead)
+        s.compact()
+        self.assertEqual(s.dead, 0)
+        check_structure(s)
+
+
+class Probe(int):
+    """An int that counts the comparisons made with it, from either side."""
+
+    comparisons = 0
+
+    def __lt__(self, other):
+        """(Probe, int) -> bool
+        Return whether self is less than other, counting the comparison.
+        """
+        Probe.comparisons += 1
+        return int(self) < other
+
+    def __gt__(self, other):
+        """(Probe, int) -> bool
+        Return whether self is greater than other, counting the comparison.
+        """
+        Probe.comparisons += 1
+        return int(self) > other
+
+
+class StatsTest(Differential, unittest.TestCase):
+    """Skip lists with stats enabled, checked against a sorted list and
+    against the work their searches really do."""
+
+    def test_random_operations(self):
+        """Stats change no result, and the tower heights they keep are
+        those of the skip list after every change."""
+        for make in (SkipList, CountedSkipList,
+                     lambda rng: CountedSkipList(rng=rng, compact_ratio=0.5)):
+            for seed in SEEDS[:4]:
+                rng = random.Random(seed)
+                s = make(rng=seed)
+                stats = s.enable_stats()
+                ref = []
+                for i in range(STEPS):
+                    self.step(s, ref, rng)
+                    check_structure(s)
+                    self.check_reads(s, ref, rng)
+                    self.assertEqual(stats.heights, s._tower_heights())
+                self.assertIs(s.disable_stats(), stats)
+                self.assertIs(type(s), type(make(rng=seed)))
+
+    def test_search_counts(self):
+        """A search counts one search, the comparisons it makes and the
+        levels it goes down."""
+        rng = random.Random(5)
+        s = SkipList(rng=5)
+        s.insert_many(rng.randrange(1000) for i in range(500))
+        stats = s.enable_stats()
+        for i in range(50):
+            probe = Probe(rng.randrange(-10, 1010))
+            before = stats.as_dict()
+            Probe.comparisons = 0
+            search = rng.choice((s.bisect_left, s.bisect_right))
+            search(probe)
+            after = stats.as_dict()
+            self.assertEqual(after['searches'], before['searches'] + 1)
+            self.assertEqual(after['comparisons'] - before['comparisons'],
+                             Probe.comparisons)
+            self.assertEqual(
+                after['levels_descended'] - before['levels_descended'],
+                len(s._level_sizes) - 1)
+            self.assertGreaterEqual(after['nodes_visited'],
+                                    before['nodes_visited'])
+        result = stats.as_dict()
+        self.assertEqual(result['comparisons_per_search'],
+                         result['comparisons'] / result['searches'])
+        self.assertEqual(result['tower_heights'], s._tower_heights())
+
+    def test_disable(self):
+        """Nothing is counted once stats are disabled, and they count on in
+        the SkipStats they are enabled with again."""
+        s = SkipList(rng=1)
+        self.assertIsNone(s.disable_stats())
+        stats = s.enable_stats()
+        s.insert_many(range(100))
+        self.assertEqual(s.disable_stats().searches, stats.searches)
+        searches = stats.searches
+        s.search(5)
+        s.insert(5)
+        self.assertEqual(stats.searches, searches)
+        self.assertIs(s.enable_stats(stats), stats)
+        s.search(5)
+        self.assertEqual(stats.searches, searches + 1)
+        self.assertEqual(stats.heights, s._tower_heights())
+        m = MultiSet.from_iterable(range(10))
+        self.assertIsNone(m.stats)
+        m.enable_stats()
+        m.count(3)
+        self.assertEqual(m.disable_stats().searches, 1)
+
+
+class KeyTest(unittest.TestCase):
+    """Skip lists with a key function, checked against a list kept in order
+    by a stable sort."""
+
+    def test_stable_order(self):
+        """Items with equal keys stay in the order they were inserted in,
+        whether one by one or in batches, and every key is computed once."""
+        for seed in SEEDS:
+            rng = random.Random(seed)
+            calls = []
+            def key(item):
+                calls.append(item)
+                return item[0]
+            s = SkipList(rng=seed, key=key)
+            ref = []
+            serial = 0
+            for i in range(STEPS):
+                op = rng.random()
+                if op < 0.4:
+                    item = (rng.randrange(20), serial)
+                    serial += 1
+                    s.insert(item)
+                    ref.append(item)
+                    ref.sort(key=itemgetter(0))  # Stable, like the skip list.
+                    new = 1
+                elif op < 0.6:
+                    items = [(rng.randrange(20), serial + j) 
+                             for j in range(rng.randrange(10))]
+                    serial += len(items)
+                    s.insert_many(items)
+                    ref.extend(items)
+                    ref.sort(key=itemgetter(0))
+                    new = len(items)
+                else:
+                    # Removing drops the first item with an equal key.
+                    item = (rng.randrange(20), None)
+                    s.remove(item)
+                    keys = [x[0] for x in ref]
+                    i = bisect.bisect_left(keys, item[0])
+                    if i < len(ref) and keys[i] == item[0]:
+                        del ref[i]
+                    new = 1
+                self.assertEqual(len(calls), new)
+                del calls[:]
+
+                self.assertEqual(list(s[:]), ref)
+                check_structure(s)
+                probe = (rng.randrange(20), None)
+                keys = [x[0] for x in ref]
+                self.assertEqual(s.count(probe), keys.count(probe[0]))
+                self.assertEqual(s.bisect_right(probe), 
+                                 bisect.bisect_right(keys, probe[0]))
+                del calls[:]
+
+    def test_counted(self):
+        """A CountedSkipList with a key counts the items with equal keys as
+        one item, the first of them."""
+        rng = random.Random(3)
+        s = CountedSkipList(rng=3, key=itemgetter(0))
+        ref = Counter()
+        first = {}
+        for i in range(STEPS):
+            item = (rng.randrange(20), i)
+            if rng.random() < 0.6:
+                s.insert(item)
+                ref[item[0]] += 1
+                first.setdefault(item[0], item)
+            else:
+                s.remove(item)
+                if ref[item[0]]:
+                    ref[item[0]] -= 1
+                    if not ref[item[0]]:
+                        del ref[item[0]], first[item[0]]
+            check_structure(s)
+            self.assertEqual(
+                list(s[:]), 
+                [first[k] for k in sorted(ref) for j in range(ref[k])])
+
+
+class SnapshotTest(Differential, unittest.TestCase):
+    """Snapshots and copies of skip lists, checked against copies of sorted
+    lists."""
+
+    def lists(self, seed):
+        """(SnapshotTest, int) -> list of SkipList
+        Return an empty skip list of every kind.
+        """
+
+        return [SkipList(rng=seed), CountedSkipList(rng=seed), 
+                CountedSkipList(rng=seed, compact_ratio=0.5)]
+
+    def test_snapshot_isolation(self):
+        """Every snapshot keeps the items its skip list had when it was
+        taken, however the skip list changes afterwards."""
+        for seed in SEEDS:
+            for s in self.lists(seed):
+                rng = random.Random(seed)
+                ref = []
+                snaps = []
+                for i in range(STEPS):
+                    if i % 30 == 0:
+                        snaps.append((s.snapshot(), list(ref)))
+                    self.step(s, ref, rng)
+                    if i % 10 == 0:
+                        for snap, old in snaps:
+                            self.check_reads(snap, old, rng)
+                check_structure(s)
+                self.assertEqual(list(s[:]), ref)
+                for snap, old in snaps:
+                    check_structure(snap)
+                    self.check_reads(snap, old, rng)
+                    self.assertRaises(TypeError, snap.insert, 1)
+
+    def test_history_bounded(self):
+        """The fields kept for snapshots that take turns only cover the
+        changes since the oldest one alive, and are all dropped once none
+        is left."""
+        rng = random.Random(2)
+        s = CountedSkipList(rng=2)
+        s.insert_many(range(0, 2000, 2))
+        snaps = []
+        records = []
+        for i in range(10):
+            snaps.append(s.snapshot())
+            del snaps[:-2]
+            for j in range(500):
+                if rng.random() < 0.5:
+                    s.insert(rng.randrange(2000))
+                else:
+                    s.remove(rng.randrange(2000))
+            history = s._history
+            oldest = history.live[0]
+            for entry in history.saved.values():
+                stamps = entry[1::6]
+                self.assertEqual(stamps, sorted(stamps))
+                self.assertGreater(stamps[0], oldest)
+            records.append(sum(len(entry) // 6 
+                               for entry in history.saved.values()))
+        self.assertLess(records[-1], 1.5 * records[1])
+
+        del snaps
+        gc.collect()
+        s.insert(1)
+        self.assertFalse(s._history.saved)
+        self.assertFalse(s._history.touched)
+
+    def test_copy_independence(self):
+        """A copy and the skip list it was copied from change on their own,
+        as do copies of copies."""
+        for seed in SEEDS:
+            for s in self.lists(seed):
+                rng = random.Random(seed)
+                ref = []
+                for i in range(50):
+                    self.step(s, ref, rng)
+                copy = s.copy()
+                copy_ref = list(ref)
+                self.assertEqual(list(copy[:]), copy_ref)
+                for i in range(100):
+                    self.step(s, ref, rng)
+                    self.step(copy, copy_ref, rng)
+                    if i == 50:
+                        second = copy.copy()
+                        second_ref = list(copy_ref)
+                    self.assertEqual(list(s[:]), ref)
+                    self.assertEqual(list(copy[:]), copy_ref)
+                self.check_reads(second, second_ref, rng)
+                for t, t_ref in ((s, ref), (copy, copy_ref), 
+                                 (second, second_ref)):
+                    check_structure(t)
+                    self.check_reads(t, t_ref, rng)
+
+
+def node_bytes(skiplist):
+    """(SkipList) -> (int, Counter)
+    Return the bytes taken by every node reachable from the sentinel of
+    skiplist, and the bytes taken by the nodes of every class.
+    """
+    seen = {}
+    todo = [skiplist.head]
+    while todo:
+        node = todo.pop()
+        if node is None or id(node) in seen:
+            continue
+        seen[id(node)] = node
+        todo.append(getattr(node, 'link', None))  # A TailNode has no link.
+        todo.append(node.down)
+    kinds = Counter()
+    for node in seen.values():
+        kinds[type(node).__name__] += sys.getsizeof(node)
+    return sum(kinds.values()), kinds
+
+
+class MemoryTest(Differential, unittest.TestCase):
+    """memory_usage checked against the nodes of a skip list, and the
+    memory budget."""
+
+    def test_memory_usage(self):
+        """The total is the bytes of the nodes, and the levels and the kinds
+        add up to it."""
+        for make in (SkipList, CountedSkipList,
+                     lambda rng: SkipList(rng=rng, key=abs)):
+            rng = random.Random(2)
+            s = make(rng=2)
+            ref = []
+            for i in range(STEPS):
+                self.step(s, ref, rng)
+                usage = s.memory_usage()
+                total, kinds = node_bytes(s)
+                self.assertEqual(usage['total'], total)
+                self.assertEqual(usage['payload'] + usage['overhead'], total)
+                self.assertEqual(+Counter(usage['kinds']), kinds)
+                if s._level_sizes:
+                    self.assertEqual(
+                        sum(level['bytes'] for level in usage['levels']),
+                        total)
+                self.assertEqual([level['nodes'] for level in usage['levels']],
+                                 s._level_sizes)
+            self.assertGreater(s.memory_usage(True)['payload'],
+                               usage['payload'])
+
+    def test_memory_budget(self):
+        """A tower that would take the nodes over the budget raises
+        MemoryError and is not linked, or only warns if asked to."""
+        s = SkipList(rng=3, memory_budget=20000)
+        ref = []
+        rng = random.Random(3)
+        with self.assertRaises(MemoryError):
+            while True:
+                item = rng.randrange(1000)
+                try:
+                    s.insert(item)
+                finally:
+                    self.assertLessEqual(s.memory_usage()['total'], 20000)
+                    check_structure(s)
+                bisect.insort(ref, item)
+        self.assertEqual(list(s[:]), ref)
+        # insert_many keeps the towers it linked before the one over budget.
+        self.assertRaises(MemoryError, s.insert_many, range(1000))
+        self.assertEqual(list(s[:]), 
+                         sorted(ref + list(range(len(s) - len(ref)))))
+        self.assertLessEqual(s.memory_usage()['total'], 20000)
+        check_structure(s)
+
+        s = SkipList(rng=3, memory_budget=20000, budget_action='warn')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            s.insert_many(range(1000))
+        self.assertTrue(caught)
+        self.assertEqual(list(s[:]), list(range(1000)))
+        self.assertRaises(ValueError, SkipList, budget_action='ignore')
+
+
+class ConcurrentTest(unittest.TestCase):
+    """Skip lists made with concurrent=True, shared by threads that read
+    and write at once."""
+
+    threads = 4
+    ops = 1500
+
+    def setUp(self):
+        """(ConcurrentTest) -> NoneType
+        Make the threads switch often, so that reads and writes interleave.
+        """
+
+        self.interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+
+    def tearDown(self):
+        """(ConcurrentTest) -> NoneType
+        Put the switch interval back.
+        """
+
+        sys.setswitchinterval(self.interval)
+
+    def stress(self, shared, base, counted):
+        """(ConcurrentTest, object, list of int, bool) -> NoneType
+        Run threads that each insert and remove keys of their own above the
+        sorted keys base, which stay in shared, while reading shared. Check
+        every read, and the contents and structure at the end.
+        """
+
+        n = len(base)
+        errors = []
+        added = [[] for t in range(self.threads)]
+
+        def work(t):
+            rng = random.Random(t)
+            mine = added[t]
+            try:
+                for i in range(self.ops):
+                    r = rng.random()
+                    key = base[rng.randrange(n)]
+                    if r < 0.1:
+                        new = 10 * n + self.threads * i + t
+                        shared.insert(new)
+                        mine.append(new)
+                    elif r < 0.15:
+                        new = [10 * n + self.threads * (self.ops + 10 * i + j)
+                               + t for j in range(10)]
+                        shared.insert_many(new)
+                        mine.extend(new)
+                    elif r < 0.25:
+                        if mine:
+                            shared.remove(mine.pop(rng.randrange(len(mine))))
+                    elif r < 0.45:
+                        assert key in shared, key
+                    elif r < 0.6:
+                        assert shared.count(key) >= 1, key
+                    elif r < 0.75:
+                        # The base keys come first and never move.
+                        i = rng.randrange(n)
+                        assert shared[i] == base[i], (i, shared[i])
+                    elif r < 0.9:
+                        assert shared.bisect_left(key) == base.index(key)
+                    else:
+                        assert list(shared.irange(key, key)) == (
+                            [key] * base.count(key))
+            except Exception as e:
+                errors.append(e)
+
+        workers = [threading.Thread(target=work, args=(t,))
+                   for t in range(self.threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(errors, [])
+        expected = sorted(base + [key for mine in added for key in mine])
+        self.assertEqual(list(shared[:]), expected)
+        self.assertEqual(len(shared), len(expected))
+        check_structure(shared.skiplist if counted else shared)
+
+    def test_skiplist(self):
+        """Threads sharing a concurrent SkipList see every base key, and
+        lose no write."""
+        rng = random.Random(0)
+        base = sorted(rng.randrange(1000) for i in range(300))
+        self.stress(SkipList.from_sorted(base, rng=0, concurrent=True), base,
+                    False)
+
+    def test_multiset(self):
+        """The same with a concurrent MultiSet, which is counted."""
+        rng = random.Random(1)
+        base = sorted(rng.randrange(1000) for i in range(300))
+        self.stress(MultiSet.from_iterable(base, rng=1, concurrent=True),
+                    base, True)
+
+    def test_keys_computed_once(self):
+        """A concurrent insert_many computes every key once."""
+        calls = []
+        def key(item):
+            calls.append(item)
+            return -item
+        s = SkipList(rng=0, key=key, concurrent=True)
+        s.insert_many(range(50))
+        self.assertEqual(len(calls), 50)
+        self.assertEqual(list(s[:]), list(range(49, -1, -1)))
+
+
+class MultiSetDifferentialTest(unittest.TestCase):
+    """Random operations on a MultiSet, checked against a Counter."""
+
+    top = 40
+
+    def test_random_operations(self):
+        """Random changes keep the elements and counts of a MultiSet, and the
+        structure of its skip list, right."""
+        for seed in SEEDS:
+            for compact_ratio in (None, 0.5):
+                rng = random.Random(seed)
+                m = MultiSet(rng=seed, compact_ratio=compact_ratio)
+                ref = Counter()
+                for i in range(STEPS):
+                    self.step(m, ref, rng)
+                    check_structure(m.skiplist)
+                    self.check_reads(m, ref, rng)
+                m.compact()
+                self.assertEqual(m.skiplist.dead, 0)
+                check_structure(m.skiplist)
+
+    def step(self, m, ref, rng):
+        """(MultiSetDifferentialTest, MultiSet, Counter, random.Random)
+        -> NoneType
+        Apply one random change to both m and ref.
+        """
+        op = rng.random()
+        elem = rng.randrange(self.top)
+        if op < 0.3:
+            m.insert(elem)
+            ref[elem] += 1
+        elif op < 0.5:
+            m.remove(elem)
+            ref[elem] -= 1
+        elif op < 0.6:
+            elems = [rng.randrange(self.top) for i in range(rng.randrange(20))]
+            m.insert_many(elems)
+            ref.update(elems)
+        elif op < 0.7:
+            elems = [rng.randrange(self.top) for i in range(rng.randrange(20))]
+            m.remove_many(elems)
+            ref.subtract(elems)
+        elif op < 0.75:
+            lo, hi, inclusive = random_bounds(rng, self.top)
+            doomed = [e for e in ref if in_range(e, lo, hi, inclusive)]
+            self.assertEqual(m.delete_range(lo, hi, inclusive),
+                             sum(ref[e] for e in doomed))
+            for e in doomed:
+                del ref[e]
+        elif op < 0.85:
+            if +ref:
+                elem = min(+ref)
+                self.assertEqual(m.pop_min(), elem)
+                ref[elem] -= 1
+            else:
+                self.assertRaises(IndexError, m.pop_min)
+        else:
+            if +ref:
+                elem = max(+ref)
+                self.assertEqual(m.pop_max(), elem)
+                ref[elem] -= 1
+            else:
+                self.assertRaises(IndexError, m.pop_max)
+        ref += Counter()  # Drop the counts that fell to 0 or below.
+
+    def check_reads(self, m, ref, rng):
+        """(MultiSetDifferentialTest, MultiSet, Counter, random.Random)
+        -> NoneType
+        Check the read-only operations of m against ref.
+        """
+        flat = sorted(ref.elements())
+        self.assertEqual(len(m), len(flat))
+        self.assertEqual(list(m.runs()), sorted(ref.items()))
+        self.assertEqual(list(m[:]), flat)
+        if flat:
+            i = rng.randrange(len(flat))
+            self.assertEqual(m[i], flat[i])
+            self.assertEqual(m.min(), flat[0])
+            self.assertEqual(m.max(), flat[-1])
+
+        elem = rng.randrange(-1, self.top + 1)
+        self.assertEqual(m.count(elem), ref[elem])
+        self.assertEqual(elem in m, ref[elem] > 0)
+        self.assertEqual(m.bisect_left(elem), bisect.bisect_left(flat, elem))
+        self.assertEqual(m.bisect_right(elem),
+                         bisect.bisect_right(flat, elem))
+
+        lo, hi, inclusive = random_bounds(rng, self.top)
+        expected = [e for e in flat if in_range(e, lo, hi, inclusive)]
+        self.assertEqual(list(m.irange(lo, hi, inclusive)), expected)
+        self.assertEqual(m.count_range(lo, hi, inclusive), len(expected))
+
+
+class MergeTest(unittest.TestCase):
+    """MultiSet.merge and MultiSet.from_stream, checked against Counters."""
+
+    def setUp(self):
+        """(MergeTest) -> NoneType
+        Make a directory for the batches from_stream spills.
+        """
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """(MergeTest) -> NoneType
+        Remove the directory of the spilled batches.
+        """
+        shutil.rmtree(self.dir)
+
+    def test_merge(self):
+        """merge yields the elements of the union of any number of sets in
+        order, each as many times as the set with the most of it has."""
+        rng = random.Random(6)
+        for i in range(40):
+            refs = [Counter(rng.randrange(30) 
+                            for j in range(rng.randrange(50)))
+                    for k in range(rng.randrange(5))]
+            union = Counter()
+            for ref in refs:
+                union |= ref
+            for options in ({}, {'compact_ratio': 0.5}, {'dtype': 'int64'}):
+                if 'dtype' in options and numpy is None:
+                    continue
+                sets = [MultiSet.from_iterable(ref.elements(), **options) 
+                        for ref in refs]
+                self.assertEqual(list(MultiSet.merge(*sets)),
+                                 sorted(union.elements()))
+            sets = [MultiSet.from_iterable(ref.elements(), key=negate) 
+                    for ref in refs]
+            self.assertEqual(list(MultiSet.merge(*sets)),
+                             sorted(union.elements(), reverse=True))
+
+    def test_from_stream(self):
+        """from_stream holds the elements of its input whatever the budget,
+        and leaves no spilled batch behind."""
+        rng = random.Random(7)
+        for i in range(30):
+            items = [rng.randrange(50) for j in range(rng.randrange(200))]
+            ref = Counter(items)
+            budget = rng.randrange(1, len(items) + 3)
+            m = MultiSet.from_stream(iter(items), budget, self.dir, 
+                                     rng=i, balanced=i % 2 == 0)
+            self.assertEqual(list(m.runs()), sorted(ref.items()))
+            check_structure(m.skiplist)
+            m = MultiSet.from_stream(items, budget, self.dir, key=negate)
+            self.assertEqual(list(m[:]), sorted(items, reverse=True))
+            self.assertEqual(os.listdir(self.dir), [])
+        self.assertRaises(ValueError, MultiSet.from_stream, [1], 0)
+
+    def test_from_stream_error(self):
+        """The spilled batches are removed when the input raises."""
+        def items():
+            for i in range(100):
+                yield i
+            raise KeyError(i)
+        self.assertRaises(KeyError, MultiSet.from_stream, items(), 10, 
+                          self.dir)
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+class AsyncTest(unittest.TestCase):
+    """The async MultiSet operations, checked against the ones they stand
+    for."""
+
+    def kinds(self):
+        """(AsyncTest) -> list of dict
+        Return the options of every kind of MultiSet to test.
+        """
+        kinds = [{}, {'compact_ratio': 0.5}, {'key': negate}]
+        if numpy is not None:
+            kinds.append({'dtype': 'int64'})
+        return kinds
+
+    def test_operations(self):
+        """Every async operation gives what the operation it stands for
+        does, whatever the chunk, and lets other tasks run between
+        chunks."""
+        rng = random.Random(8)
+        for i in range(20):
+            a = Counter(rng.randrange(40) for j in range(rng.randrange(80)))
+            b = Counter(rng.randrange(40) for j in range(rng.randrange(80)))
+            chunk = rng.choice((1, 3, 1024))
+            for options in self.kinds():
+                m = MultiSet.from_iterable(a.elements(), **options)
+                other = MultiSet.from_iterable(b.elements(), **options)
+                asyncio.run(self.check(m, other, chunk))
+
+    async def check(self, m, other, chunk):
+        """(AsyncTest, MultiSet, MultiSet, int) -> NoneType
+        Check every async operation on m and other, with a task ticking
+        beside them.
+        """
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.sleep(0)
+        try:
+            for name, expected in (('aunion', m + other), 
+                                   ('aintersection', m & other), 
+                                   ('adifference', m - other)):
+                result = await getattr(m, name)(other, chunk)
+                self.assertEqual(list(result[:]), list(expected[:]))
+                if hasattr(result, 'skiplist'):
+                    check_structure(result.skiplist)
+
+            self.assertEqual(await m.arepr(chunk), repr(m))
+            copy = await m.acopy(chunk)
+            self.assertEqual(list(copy[:]), list(m[:]))
+            copy.insert(1000)
+            self.assertNotIn(1000, m)
+
+            for name, op in (('aiadd', '__iadd__'), ('aiand', '__iand__'), 
+                             ('aisub', '__isub__')):
+                left = m.copy()
+                expected = getattr(m.copy(), op)(other)
+                self.assertIs(await getattr(left, name)(other, chunk), left)
+                self.assertEqual(list(left[:]), list(expected[:]))
+
+            before = len(ticks)
+            await m.aunion(other, 1)
+            distinct = len(list(m.runs()) + list(other.runs()))
+            if distinct > 2:
+                self.assertGreater(len(ticks), before)
+        finally:
+            ticker.cancel()
+
+    def test_bad_chunk(self):
+        """A chunk of less than one element is rejected."""
+        m = MultiSet.from_iterable(range(5))
+        self.assertRaises(ValueError, asyncio.run, m.acopy(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
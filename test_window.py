@@ -0,0 +1,139 @@
+"""Randomized differential tests of WindowMultiSet, checked against a list
+of the samples in the window.
+
+Run with "python -m pytest" or "python -m unittest".
+"""
+
+import random
+import unittest
+
+from window import WindowMultiSet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+STEPS = 600
+SEEDS = range(5)
+
+
+def quantile(samples, q):
+    """(list of number, float) -> number
+    Return the q-quantile of samples, interpolated linearly between the two
+    closest ones like numpy.quantile.
+    """
+
+    ordered = sorted(samples)
+    pos = q * (len(ordered) - 1)
+    i = int(pos)
+    if i + 1 == len(ordered):
+        return ordered[i]
+    return ordered[i] + (ordered[i + 1] - ordered[i]) * (pos - i)
+
+
+class WindowTest(unittest.TestCase):
+    """Random pushes to windows of every kind."""
+
+    def run_window(self, seed, size, duration, distinct, reverse=False,
+                   **options):
+        """(WindowTest, int, int, float, int, bool) -> NoneType
+        Push random samples from range(distinct) at random times to a
+        window of size and duration made with options, and check it against
+        the list of the samples it should hold after every push. If reverse
+        is True, the options order the samples from the largest.
+        """
+
+        rng = random.Random(seed)
+        w = WindowMultiSet(size, duration, **options)
+        ref = []  # (time, sample) pairs, oldest first.
+        now = 0.0
+        for i in range(STEPS):
+            now += rng.random()
+            if rng.random() < 0.05:
+                w.expire(now)
+            else:
+                sample = rng.randrange(distinct)
+                w.push(sample, now)
+                ref.append((now, sample))
+            if duration is not None:
+                ref = [(t, x) for t, x in ref if t >= now - duration]
+            if size is not None:
+                ref = ref[-size:]
+
+            samples = [x for t, x in ref]
+            self.assertEqual(list(w), samples)
+            self.assertEqual(len(w), len(samples))
+            self.assertEqual(list(w.multiset[:]),
+                             sorted(samples, reverse=reverse))
+            probe = rng.randrange(distinct)
+            self.assertEqual(w.count(probe), samples.count(probe))
+            self.assertEqual(probe in w, probe in samples)
+            if samples:
+                low, high = min(samples), max(samples)
+                self.assertEqual((w.min(), w.max()), 
+                                 (high, low) if reverse else (low, high))
+                q = rng.random()
+                self.assertAlmostEqual(
+                    w.quantile(q), quantile(samples, 1 - q if reverse else q))
+                self.assertAlmostEqual(w.median(), quantile(samples, 0.5))
+            else:
+                self.assertRaises(ValueError, w.median)
+
+    def test_size(self):
+        """A window of the last size samples, with few distinct samples so
+        that equal ones often replace each other."""
+        for seed in SEEDS:
+            self.run_window(seed, 50, None, 8, rng=seed)
+            self.run_window(seed, 50, None, 1000, rng=seed)
+
+    def test_duration(self):
+        """A window of the samples of the last duration seconds."""
+        for seed in SEEDS:
+            self.run_window(seed, None, 20.0, 100, rng=seed)
+
+    def test_size_and_duration(self):
+        """A window bounded both ways."""
+        for seed in SEEDS:
+            self.run_window(seed, 15, 20.0, 6, rng=seed)
+
+    def test_key(self):
+        """A window ordered by a key, from the largest sample."""
+        for seed in SEEDS:
+            self.run_window(seed, 30, None, 8, True, rng=seed, 
+                            key=lambda x: -x)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numeric(self):
+        """A window kept in a NumericMultiSet, checked against
+        numpy.quantile too."""
+        for seed in SEEDS:
+            self.run_window(seed, 40, 30.0, 50, dtype='int64')
+        w = WindowMultiSet(100, dtype='float64')
+        rng = random.Random(0)
+        samples = [rng.gauss(0, 1) for i in range(300)]
+        for x in samples:
+            w.push(x)
+        for q in (0, 0.1, 0.5, 0.9, 1):
+            self.assertAlmostEqual(w.quantile(q),
+                                   numpy.quantile(samples[-100:], q))
+
+    def test_clear_and_errors(self):
+        """clear empties the window, and bad windows are rejected."""
+        w = WindowMultiSet(3)
+        for x in range(5):
+            w.push(x)
+        w.clear()
+        self.assertEqual(len(w), 0)
+        self.assertEqual(list(w.multiset[:]), [])
+        w.push(7)
+        self.assertEqual(w.median(), 7)
+        self.assertRaises(ValueError, w.quantile, 1.5)
+        self.assertRaises(ValueError, WindowMultiSet)
+        self.assertRaises(ValueError, WindowMultiSet, 0)
+        self.assertRaises(ValueError, WindowMultiSet, None, -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""A sliding window over a stream of samples, kept in a MultiSet so that
+order statistics of the window are found in O(log n).
+
+The window holds the last size samples pushed, or the samples pushed in the
+last duration seconds, or both. Pushing a sample evicts the samples that fall
+out of the window, oldest first, so every push costs an insert and, once the
+window is full, a remove, both O(log n). median and quantile then look up one
+or two indexes of the sorted window through the skip widths of the SkipList.
+"""
+
+import time
+from collections import deque
+
+from multiset import MultiSet
+
+
+class WindowMultiSet(object):
+    """A MultiSet of the latest samples of a stream, evicting the oldest
+    ones as new ones are pushed.
+    """
+
+    def __init__(self, size=None, duration=None, clock=time.monotonic,
+                 **options):
+        """(WindowMultiSet, int, float, function) -> NoneType
+        Initialize this WindowMultiSet to be empty. It keeps at most size
+        samples, and none pushed more than duration seconds ago as measured
+        by clock, at least one of the two being given. Any options are
+        passed on to the MultiSet constructor.
+        """
+        if size is None and duration is None:
+            raise ValueError("a window needs a size or a duration")
+        if size is not None and size < 1:
+            raise ValueError("size must be positive")
+        if duration is not None and duration <= 0:
+            raise ValueError("duration must be positive")
+
+        self.size = size
+        self.duration = duration
+        self.clock = clock
+        # The MultiSet of the samples, for the queries not repeated here. It
+        # must only be changed through push and expire.
+        self.multiset = MultiSet(**options)
+        self._samples = deque()  # The samples in the order they were pushed.
+        self._times = deque()  # The times they were pushed, for a duration.
+        # Without a key, equal samples are the same element of the MultiSet.
+        self._plain = options.get('key') is None
+
+    def __repr__(self):
+        """(WindowMultiSet) -> str
+        Return a string representation of this WindowMultiSet.
+        """
+        return repr(self.multiset)
+
+    def __len__(self):
+        """(WindowMultiSet) -> int
+        Return the number of samples in the window.
+        """
+        return len(self._samples)
+
+    def __iter__(self):
+        """(WindowMultiSet) -> iterator
+        Iterate over the samples in the window, oldest first.
+        """
+        return iter(self._samples)
+
+    def push(self, sample, now=None):
+        """(WindowMultiSet, object, float) -> NoneType
+        Add sample to the window at time now (the time of the clock if
+        None), and evict the samples that fall out of the window.
+        """
+        samples = self._samples
+        if (self.size is not None and len(samples) == self.size and 
+                self._plain and samples[0] == sample):
+            # The oldest sample goes for an equal one, so the MultiSet can
+            # stay as it is, and no search is needed.
+            samples.popleft()
+            if self._times:
+                self._times.popleft()
+        else:
+            self.multiset.insert(sample)
+        samples.append(sample)
+        if self.duration is not None:
+            if now is None:
+                now = self.clock()
+            self._times.append(now)
+            self._expire(now)
+
+        if self.size is not None and len(samples) > self.size:
+            self._evict()
+
+    def expire(self, now=None):
+        """(WindowMultiSet, float) -> NoneType
+        Evict the samples pushed more than duration seconds before now (the
+        time of the clock if None), as a window that gets no new samples
+        still moves on.
+        """
+        if self.duration is not None:
+            self._expire(self.clock() if now is None else now)
+
+    def _expire(self, now):
+        """(WindowMultiSet, float) -> NoneType
+        Evict the samples pushed more than duration seconds before now.
+        """
+        start = now - self.duration
+        times = self._times
+        while times and times[0] < start:
+            self._evict()
+
+    def _evict(self):
+        """(WindowMultiSet) -> NoneType
+        Evict the oldest sample of the window.
+        """
+        self.multiset.remove(self._samples.popleft())
+        if self._times:
+            self._times.popleft()
+
+    def clear(self):
+        """(WindowMultiSet) -> NoneType
+        Evict every sample.
+        """
+        self.multiset.clear()
+        self._samples.clear()
+        self._times.clear()
+
+    def __contains__(self, sample):
+        """(WindowMultiSet, object) -> bool
+        Return True iff sample is in the window.
+        """
+        return sample in self.multiset
+
+    def count(self, sample):
+        """(WindowMultiSet, object) -> int
+        Return the number of occurrences of sample in the window.
+        """
+        return self.multiset.count(sample)
+
+    def min(self):
+        """(WindowMultiSet) -> object
+        Return the smallest sample. Raise ValueError if there is none.
+        """
+        return self.multiset.min()
+
+    def max(self):
+        """(WindowMultiSet) -> object
+        Return the largest sample. Raise ValueError if there is none.
+        """
+        return self.multiset.max()
+
+    def quantile(self, q):
+        """(WindowMultiSet, float) -> number
+        Return the q-quantile of the samples, which must be numbers, for q
+        from 0 to 1. Between two samples, it is interpolated linearly, as
+        numpy.quantile does by default. Raise ValueError if the window is
+        empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be between 0 and 1")
+        n = len(self._samples)
+        if not n:
+            raise ValueError("quantile() of an empty window")
+
+        pos = q * (n - 1)
+        i = int(pos)
+        fraction = pos - i
+        if not fraction:
+            return self.multiset.select(i)
+
+        # Both neighbours are found with a single search.
+        low, high = self.multiset[i:i + 2]
+        return low + (high - low) * fraction
+
+    def median(self):
+        """(WindowMultiSet) -> number
+        Return the median of the samples, the mean of the two middle ones if
+        there is an even number of them. Raise ValueError if the window is
+        empty.
+        """
+        return self.quantile(0.5)